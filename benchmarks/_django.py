@@ -0,0 +1,45 @@
+import os
+import tempfile
+import time
+
+# Shared setup for the benchmark scripts.
+# Each script runs against a throwaway SQLite database so it never touches real data.
+# Run them from the project root, e.g. python -m benchmarks.bench_page_dispatch
+
+
+def setup(db_path=None):
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='social_bench_'), 'bench.sqlite3')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'social_app.settings')
+    os.environ.setdefault('SECRET_KEY', 'benchmark-only-secret-key-not-for-production-use')
+    os.environ['DJ_DATABASE_URL'] = f'sqlite:///{db_path}'
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+    return db_path
+
+
+def timed(fn, repeat):
+    # Runs fn repeat times and returns the per call latencies in milliseconds
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def summary(latencies):
+    ordered = sorted(latencies)
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+    return {
+        'n': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered), 3),
+        'p50_ms': round(pct(50), 3),
+        'p95_ms': round(pct(95), 3),
+        'p99_ms': round(pct(99), 3),
+    }
@@ -0,0 +1,69 @@
+"""
+Cost of authenticating one API read, loading the user versus reading the claims.
+
+"authenticate" runs core.authentication.JWTAuthentication on a GET request with
+a token from the token endpoint, once with the database lookup and once
+stateless, counting queries. "denylist" fills the blacklist tables with
+--revoked tokens and times a lookup of a token that is not on it (the common
+case) and one that is, plus the memory the filter and the exact set take.
+
+    python -m benchmarks.bench_auth --repeat 5000 --revoked 100000
+"""
+import argparse
+import json
+import sys
+import uuid
+
+from benchmarks import _django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5000)
+    parser.add_argument('--revoked', type=int, default=100000)
+    args = parser.parse_args()
+
+    _django.setup()
+
+    from datetime import timedelta
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from django.utils import timezone
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+    from core import authentication, denylist
+
+    user = User.objects.create_user(username='bench', password='bench-pass-123')
+    token = str(authentication.RefreshToken.for_user(user).access_token)
+    request = Request(APIRequestFactory().get('/api/posts/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+    denylist.denylist.refresh(force=True)
+
+    results = {'authenticate': {}}
+    for name, stateless in (('database', False), ('stateless', True)):
+        authentication.STATELESS = stateless
+        with CaptureQueriesContext(connection) as queries:
+            latencies = _django.timed(lambda: authentication.JWTAuthentication().authenticate(request), args.repeat)
+        results['authenticate'][name] = dict(_django.summary(latencies), queries_per_request=len(queries) / args.repeat)
+
+    expires = timezone.now() + timedelta(days=1)
+    outstanding = OutstandingToken.objects.bulk_create(
+        (OutstandingToken(user=user, jti=uuid.uuid4().hex, token='', expires_at=expires) for _ in range(args.revoked)),
+        batch_size=5000)
+    BlacklistedToken.objects.bulk_create((BlacklistedToken(token=row) for row in outstanding), batch_size=5000)
+    deny = denylist.Denylist()
+    deny.refresh()
+    revoked = outstanding[0].jti
+    results['denylist'] = {
+        'revoked': args.revoked,
+        'bloom_kb': round(deny.nbytes() / 1024, 1),
+        'exact_set_kb': round((sys.getsizeof(deny.exact) + sum(sys.getsizeof(j) for j in deny.exact)) / 1024, 1),
+        'lookup_not_revoked': _django.summary(_django.timed(lambda: uuid.uuid4().hex in deny, args.repeat)),
+        'lookup_revoked': _django.summary(_django.timed(lambda: revoked in deny, args.repeat)),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
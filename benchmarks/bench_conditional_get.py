@@ -0,0 +1,77 @@
+"""
+Repeated polling of the read endpoints with and without ETag validators.
+
+A client polls each URL --polls times through the full Django and DRF stack.
+"full" re-downloads the body every time (served from the response cache).
+"conditional" sends back the last ETag in If-None-Match and gets a 304 while
+nothing changed. Every --change-every polls a post is liked, so the post
+responses change and are downloaded again. Reports the body bytes received
+and the latency of both.
+
+    python -m benchmarks.bench_conditional_get --polls 500
+"""
+import argparse
+import json
+import time
+from unittest import mock
+
+from benchmarks import _django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--polls', type=int, default=300)
+    parser.add_argument('--posts', type=int, default=50)
+    parser.add_argument('--change-every', type=int, default=50)
+    args = parser.parse_args()
+
+    _django.setup()
+
+    from django.contrib.auth.models import User
+    from django.core.cache import cache
+    from django.test import Client
+    from rest_framework.views import APIView
+    from core.models import Comment, Like, Post
+
+    author = User.objects.create_user(username='bench_author', password='bench-pass-123')
+    posts = [Post.objects.create(uploader=author, caption=f'Benchmark post {i}') for i in range(args.posts)]
+    comment = None
+    for i in range(20):
+        comment = Comment.objects.create(user=author, post=posts[0], content=f'Benchmark comment {i}')
+    likers = iter(User.objects.create_user(username=f'liker{i}', password='bench-pass-123')
+                  for i in range(2 * (args.polls // args.change_every + 1)))
+    urls = ['/api/posts/', f'/api/posts/{posts[0].id}/', '/api/profiles/', '/api/profiles/bench_author/',
+            f'/api/comments/?post={posts[0].id}', f'/api/comments/{comment.id}/']
+
+    def poll(conditional):
+        client = Client()
+        tags = {}
+        latencies = []
+        received = not_modified = 0
+        for i in range(args.polls):
+            if i and i % args.change_every == 0:
+                Like.objects.create(user=next(likers), post=posts[0])
+            for url in urls:
+                headers = {'HTTP_IF_NONE_MATCH': tags[url]} if conditional and url in tags else {}
+                start = time.perf_counter()
+                response = client.get(url, **headers)
+                latencies.append((time.perf_counter() - start) * 1000)
+                received += len(response.content)
+                not_modified += response.status_code == 304
+                if response.has_header('ETag'):
+                    tags[url] = response['ETag']
+        return dict(_django.summary(latencies), body_bytes=received, not_modified=not_modified)
+
+    # The throttles would refuse a polling client long before the end
+    with mock.patch.object(APIView, 'throttle_classes', []):
+        cache.clear()
+        results = {'full': poll(False)}
+        cache.clear()
+        results['conditional'] = poll(True)
+    results['bytes_saved'] = results['full']['body_bytes'] - results['conditional']['body_bytes']
+    results['bytes_saved_pct'] = round(100 * results['bytes_saved'] / results['full']['body_bytes'], 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Overhead of the request timing in core/instrumentation.py.
+
+"requests" times the same API and page requests through the full stack with
+the test client, once with RequestTimingMiddleware in MIDDLEWARE and once
+without. "query" times a single SELECT with and without a request being
+tracked, the cost the SQL wrapper adds to every statement.
+
+    python -m benchmarks.bench_instrumentation --repeat 2000
+"""
+import argparse
+import json
+from unittest import mock
+
+from benchmarks import _django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=1000)
+    args = parser.parse_args()
+
+    _django.setup()
+
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import Client, override_settings
+    from rest_framework.views import APIView
+    from core import instrumentation
+    from core.models import Post
+
+    user = User.objects.create_user(username='bench', password='bench-pass-123')
+    for i in range(20):
+        Post.objects.create(uploader=user, caption=f'Benchmark post {i}')
+    without = [name for name in settings.MIDDLEWARE if name != 'core.instrumentation.RequestTimingMiddleware']
+
+    results = {'requests': {}}
+    for url in ('/api/posts/', '/feed/'):
+        results['requests'][url] = {}
+        for name, middleware in (('off', without), ('on', settings.MIDDLEWARE)):
+            # No throttles, they would refuse the client long before the end
+            with override_settings(MIDDLEWARE=middleware), mock.patch.object(APIView, 'throttle_classes', []):
+                client = Client()
+                client.force_login(user)
+                client.get(url)
+                results['requests'][url][name] = _django.summary(_django.timed(lambda: client.get(url), args.repeat))
+        on, off = results['requests'][url]['on']['p50_ms'], results['requests'][url]['off']['p50_ms']
+        results['requests'][url]['overhead_p50_ms'] = round(on - off, 3)
+
+    def query():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+
+    results['query'] = {'untracked': _django.summary(_django.timed(query, args.repeat * 10))}
+    with instrumentation.track():
+        results['query']['tracked'] = _django.summary(_django.timed(query, args.repeat * 10))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
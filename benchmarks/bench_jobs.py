@@ -0,0 +1,73 @@
+"""
+Jobs per second through the database queue on one node.
+
+Queues --jobs no-op jobs, then drains them with manage.py runworker style workers
+for each thread count and batch size. Each run reports the drain rate, which is
+the queue's own overhead: claim, run, delete.
+
+    python -m benchmarks.bench_jobs --jobs 20000
+"""
+import argparse
+import json
+import threading
+import time
+
+from benchmarks import _django
+
+
+def noop(value):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=5000)
+    parser.add_argument('--threads', default='1,4')
+    parser.add_argument('--batches', default='1,10,50')
+    args = parser.parse_args()
+
+    _django.setup()
+
+    from django.db import connections
+    from core import tasks
+
+    # Registered after setup, the worker finds it again by its dotted name
+    tasks.task()(noop)
+
+    def drain(threads, batch):
+        stop = threading.Event()
+        workers = [tasks.Worker(['default'], batch=batch, name=f'bench-{i}') for i in range(threads)]
+
+        def serve(worker):
+            try:
+                worker.run(stop, burst=True)
+            finally:
+                connections.close_all()
+
+        pool = [threading.Thread(target=serve, args=(worker,)) for worker in workers]
+        start = time.perf_counter()
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        done = sum(worker.counts['done'] for worker in workers)
+        return {'jobs': done, 'seconds': round(elapsed, 3), 'jobs_per_sec': round(done / elapsed, 1)}
+
+    results = {'jobs': args.jobs, 'runs': []}
+    start = time.perf_counter()
+    tasks.defer_many(noop, ([i] for i in range(args.jobs)))
+    results['enqueue_per_sec'] = round(args.jobs / (time.perf_counter() - start), 1)
+    first = True
+    for threads in map(int, args.threads.split(',')):
+        for batch in map(int, args.batches.split(',')):
+            if not first:
+                tasks.defer_many(noop, ([i] for i in range(args.jobs)))
+            first = False
+            results['runs'].append({'threads': threads, 'batch': batch, **drain(threads, batch)})
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
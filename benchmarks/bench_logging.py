@@ -0,0 +1,83 @@
+"""
+Latency of the post and profile pages with their debug logging off and on.
+
+"off" leaves core.views at INFO, so the per-request debug records are never
+built. "queued" logs them all (no sampling) through core.log.QueueHandler,
+the request only puts the record on a queue. "sync" writes the same JSON lines
+from the request thread with a plain StreamHandler, what the queue avoids.
+The sink is a file; --sink-latency-ms adds a delay to every write, like a
+slow pipe or log collector.
+
+    python -m benchmarks.bench_logging --repeat 1000 --sink-latency-ms 1
+"""
+import argparse
+import json
+import logging
+import tempfile
+import time
+
+from benchmarks import _django
+
+
+class SlowStream:
+    # A file whose writes take at least latency seconds
+
+    def __init__(self, handle, latency):
+        self.handle = handle
+        self.latency = latency
+
+    def write(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.handle.write(text)
+
+    def flush(self):
+        self.handle.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=1000)
+    parser.add_argument('--sink-latency-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    _django.setup()
+
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from core import log
+    from core.models import Comment, Post
+
+    user = User.objects.create_user(username='bench', password='bench-pass-123')
+    post = Post.objects.create(uploader=user, caption='Benchmark post')
+    for i in range(20):
+        Comment.objects.create(user=user, post=post, content=f'Benchmark comment {i}')
+    client = Client()
+    client.force_login(user)
+    urls = [f'/post/{post.id}/', '/profile/bench/']
+
+    sink = SlowStream(tempfile.TemporaryFile('w+'), args.sink_latency_ms / 1000)
+    queued = log.QueueHandler(sink)
+    sync = logging.StreamHandler(sink)
+    sync.setFormatter(log.JSONFormatter())
+    for handler in (queued, sync):
+        handler.addFilter(log.RedactingFilter())
+
+    logger = logging.getLogger('core.views')
+    logger.propagate = False
+    results = {}
+    for name, handler, level in (('off', None, logging.INFO), ('queued', queued, logging.DEBUG),
+                                 ('sync', sync, logging.DEBUG)):
+        logger.handlers = [handler] if handler else []
+        logger.setLevel(level)
+        for url in urls:
+            client.get(url)
+        counter = iter(range(10 ** 9))
+        results[name] = _django.summary(_django.timed(lambda: client.get(urls[next(counter) % len(urls)]), args.repeat))
+    queued.close()
+    results['queued']['dropped'] = queued.dropped
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
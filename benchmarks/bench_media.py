@@ -0,0 +1,67 @@
+"""
+Derivative generation cost and the bytes a feed page downloads with and without them.
+
+The source is a synthetic photo-like JPEG (gradient plus noise) at camera size.
+"feed_bytes" is what 10 post cards cost: the original each time versus the card
+derivative in WebP or JPEG. "stage_upload" is what a post request still pays now
+that store_upload runs in the media worker.
+
+    python -m benchmarks.bench_media --width 4000 --height 3000
+"""
+import argparse
+import io
+import json
+import tempfile
+
+from benchmarks import _django
+
+
+def photo(width, height):
+    from PIL import Image
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    return Image.merge('RGB', (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    _django.setup()
+
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test.utils import override_settings
+    from core import media
+
+    buffer = io.BytesIO()
+    photo(args.width, args.height).save(buffer, 'JPEG', quality=92)
+    original = buffer.getvalue()
+
+    storage = media.LocalStorage(tempfile.mkdtemp(prefix='social_bench_media_'), '/media/')
+    upload = SimpleUploadedFile('photo.jpg', original, content_type='image/jpeg')
+    latencies = _django.timed(lambda: media.store_upload(upload, 'posts', storage), args.repeat)
+    with override_settings(MEDIA_STAGING_ROOT=tempfile.mkdtemp(prefix='social_bench_staging_')):
+        staged = _django.timed(lambda: media.stage_upload(upload), args.repeat)
+
+    rendered = media.render(original)
+    sizes = {name: {ext: len(data) for ext, data in files.items()} for name, (width, files) in rendered.items()}
+    results = {
+        'source': f'{args.width}x{args.height}',
+        'original_bytes': len(original),
+        'store_upload': _django.summary(latencies),
+        'stage_upload': _django.summary(staged),
+        'derivative_bytes': sizes,
+        'feed_bytes': {
+            'original': len(original) * 10,
+            'card_webp': sizes['card']['webp'] * 10,
+            'card_jpeg': sizes['card']['jpeg'] * 10,
+        },
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
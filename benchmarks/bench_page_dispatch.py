@@ -0,0 +1,84 @@
+"""
+Compares page latency and server requests per page for the HTML views.
+
+"before" replays what the pages used to do: the page request plus the HTTP
+loopback calls each view made to our own API (one fresh connection per call).
+"after" is the page request alone, the views now call core.services in-process.
+
+    python -m benchmarks.bench_page_dispatch --repeat 50
+"""
+import argparse
+import json
+
+from benchmarks import _django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--posts', type=int, default=50)
+    args = parser.parse_args()
+
+    _django.setup()
+
+    import requests
+    from django.contrib.auth.models import User
+    from django.core.signals import request_started
+    from django.test import Client
+    from django.test.testcases import LiveServerThread, _StaticFilesHandler
+    from core.models import Post, Comment
+
+    author = User.objects.create_user(username='bench_author', password='bench-pass-123')
+    reader = User.objects.create_user(username='bench_reader', password='bench-pass-123')
+    posts = [Post.objects.create(uploader=author, caption=f'Benchmark post {i}') for i in range(args.posts)]
+    for i in range(20):
+        Comment.objects.create(user=reader, post=posts[0], content=f'Benchmark comment {i}')
+
+    client = Client()
+    client.force_login(reader)
+    cookies = {'sessionid': client.cookies['sessionid'].value}
+
+    server = LiveServerThread('localhost', _StaticFilesHandler)
+    server.daemon = True
+    server.start()
+    server.is_ready.wait()
+    base = f'http://localhost:{server.port}'
+
+    handled = {'count': 0}
+    def count_request(**kwargs):
+        handled['count'] += 1
+    request_started.connect(count_request)
+
+    post_id = posts[0].id
+    # The API calls each page used to make over HTTP before rendering
+    pages = {
+        'feed': ('/feed/', ['/api/posts/']),
+        'profile': ('/profile/bench_author/', ['/api/profiles/bench_author/', '/api/posts/?uploader__username=bench_author']),
+        'post_detail': (f'/post/{post_id}/', [f'/api/posts/{post_id}/', f'/api/comments/?post={post_id}']),
+    }
+
+    session = requests.Session()
+    results = {}
+    for name, (page, loopback_calls) in pages.items():
+        def before():
+            for url in loopback_calls:
+                requests.get(base + url, timeout=10)
+            session.get(base + page, cookies=cookies, timeout=10)
+
+        def after():
+            session.get(base + page, cookies=cookies, timeout=10)
+
+        results[name] = {}
+        for label, fn in (('before', before), ('after', after)):
+            handled['count'] = 0
+            latencies = _django.timed(fn, args.repeat)
+            stats = _django.summary(latencies)
+            stats['server_requests_per_page'] = handled['count'] / args.repeat
+            results[name][label] = stats
+
+    server.terminate()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Page-N latency of offset pagination versus keyset cursor pagination on posts.
+
+"offset" is what PageNumberPagination did, a COUNT(*) plus an OFFSET slice.
+"keyset" is core.pagination, a range read starting after the cursor position.
+The cursor for page N is looked up before timing, as a client would already hold it.
+
+    python -m benchmarks.bench_pagination --rows 2000000
+"""
+import argparse
+import json
+
+from benchmarks import _django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--batch', type=int, default=10000)
+    args = parser.parse_args()
+
+    _django.setup()
+
+    from django.contrib.auth.models import User
+    from core.models import Post
+    from core.pagination import PAGE_SIZE, keyset_page, encode_cursor
+
+    author = User.objects.create_user(username='bench_author', password='bench-pass-123')
+    # bulk_create skips the post_save fan-out, only the rows matter here
+    for start in range(0, args.rows, args.batch):
+        Post.objects.bulk_create(
+            Post(uploader=author, caption=f'Benchmark post {i}')
+            for i in range(start, min(start + args.batch, args.rows))
+        )
+
+    posts = Post.objects.order_by('-created_at', '-id')
+    last_page = args.rows // PAGE_SIZE
+    pages = sorted({p for p in (1, 10, 100, 1000, 10000, 100000, last_page) if p <= last_page})
+
+    results = {'rows': args.rows, 'pages': {}}
+    for page in pages:
+        offset = (page - 1) * PAGE_SIZE
+
+        def offset_page():
+            posts.count()
+            list(posts[offset:offset + PAGE_SIZE])
+
+        cursor = None
+        if offset:
+            created_at, pk = posts.values_list('created_at', 'id')[offset - 1]
+            cursor = encode_cursor(created_at, pk)
+
+        def cursor_page():
+            keyset_page(Post.objects.all(), 'created_at', cursor)
+
+        results['pages'][page] = {
+            'offset': _django.summary(_django.timed(offset_page, args.repeat)),
+            'keyset': _django.summary(_django.timed(cursor_page, args.repeat)),
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
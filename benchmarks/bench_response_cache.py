@@ -0,0 +1,57 @@
+"""
+Throughput of the cached read endpoints with the response cache on and off.
+
+Requests go through the full Django and DRF stack with the test client.
+"off" points every request at a fresh version so nothing is reused.
+
+    python -m benchmarks.bench_response_cache --requests 500
+"""
+import argparse
+import json
+import time
+from unittest import mock
+
+from benchmarks import _django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--posts', type=int, default=200)
+    args = parser.parse_args()
+
+    _django.setup()
+
+    from django.contrib.auth.models import User
+    from django.core.cache import cache
+    from django.test import Client
+    from core.models import Post, Comment
+    from core import response_cache
+
+    author = User.objects.create_user(username='bench_author', password='bench-pass-123')
+    posts = [Post.objects.create(uploader=author, caption=f'Benchmark post {i}') for i in range(args.posts)]
+    for i in range(20):
+        Comment.objects.create(user=author, post=posts[0], content=f'Benchmark comment {i}')
+
+    client = Client()
+    urls = ['/api/posts/', f'/api/posts/{posts[0].id}/', '/api/profiles/bench_author/', f'/api/comments/?post={posts[0].id}']
+
+    def throughput():
+        start = time.perf_counter()
+        for i in range(args.requests):
+            client.get(urls[i % len(urls)])
+        return round(args.requests / (time.perf_counter() - start), 1)
+
+    results = {}
+    counter = iter(range(10 ** 9))
+    with mock.patch.object(response_cache, 'make_key', lambda *a, **k: f'bench:{next(counter)}'):
+        results['cache_off_rps'] = throughput()
+    cache.clear()
+    results['cache_on_rps'] = throughput()
+    results['speedup'] = round(results['cache_on_rps'] / results['cache_off_rps'], 2)
+    results['stats'] = response_cache.stats()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
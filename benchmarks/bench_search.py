@@ -0,0 +1,57 @@
+"""
+Search latency on a seeded corpus, indexed backend versus the icontains scan.
+
+Posts get random captions from a small vocabulary, then the full-text index is
+built in batches the same way manage.py rebuild_search_index does it.
+
+    python -m benchmarks.bench_search --posts 1000000
+"""
+import argparse
+import json
+import random
+
+from benchmarks import _django
+
+WORDS = ('sunset harbour mountain coffee river city night street garden winter summer beach '
+         'forest market bridge festival train morning music friends food travel snow rain '
+         'portrait skyline lake island desert autumn spring sky cloud ocean').split()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--batch', type=int, default=20000)
+    args = parser.parse_args()
+
+    _django.setup()
+
+    from django.contrib.auth.models import User
+    from core.models import Post
+    from core import search
+
+    rng = random.Random(42)
+    authors = [User.objects.create_user(username=f'bench_user_{i}') for i in range(args.users)]
+    backend = search.get_backend()
+    for start in range(0, args.posts, args.batch):
+        posts = Post.objects.bulk_create(
+            Post(uploader=rng.choice(authors), caption=' '.join(rng.sample(WORDS, 6)) + f' tag{i}')
+            for i in range(start, min(start + args.batch, args.posts))
+        )
+        backend.index_many(search.POST, [(post.id, post.caption) for post in posts])
+
+    basic = search.BasicBackend()
+    queries = ['harbour', 'sun', 'mountain coffee', 'tag12345', 'nomatch']
+    results = {'posts': args.posts, 'backend': type(backend).__name__, 'queries': {}}
+    for query in queries:
+        results['queries'][query] = {
+            'indexed': _django.summary(_django.timed(lambda: backend.search(search.POST, query, 10), args.repeat)),
+            'icontains': _django.summary(_django.timed(lambda: basic.search(search.POST, query, 10), args.repeat)),
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Database queries and latency per page view for each session engine.
+
+A user logs in through the login page (so the session holds the JWT tokens, as
+in production), then views the feed, profile and post pages round robin.
+"session_queries" counts the statements on the session table alone. The cached
+engine runs against the local memory cache here, a file or db cache adds its own
+read instead of the session row.
+
+    python -m benchmarks.bench_sessions --repeat 300
+"""
+import argparse
+import json
+
+from benchmarks import _django
+
+ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached': 'core.sessions',
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=300)
+    args = parser.parse_args()
+
+    _django.setup()
+
+    from django.contrib.auth.models import User
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext, override_settings
+    from core.models import Post
+
+    user = User.objects.create_user(username='reader', password='bench-pass-123')
+    post = Post.objects.create(uploader=user, caption='Bench post')
+    urls = ['/feed/', f'/profile/{user.username}/', f'/post/{post.id}/']
+
+    results = {}
+    for name, engine in ENGINES.items():
+        cache.clear()
+        with override_settings(SESSION_ENGINE=engine, ALLOWED_HOSTS=['*']):
+            client = Client()
+            client.post('/login/', {'username': 'reader', 'password': 'bench-pass-123'})
+            client.get(urls[0])  # Warm up
+            counts, session_counts = [], []
+
+            def view():
+                url = urls[len(counts) % len(urls)]
+                with CaptureQueriesContext(connection) as queries:
+                    assert client.get(url).status_code == 200, url
+                counts.append(len(queries))
+                session_counts.append(sum('django_session' in q['sql'] for q in queries))
+
+            latencies = _django.timed(view, args.repeat)
+        results[name] = {
+            'queries_per_view': round(sum(counts) / len(counts), 2),
+            'session_queries_per_view': round(sum(session_counts) / len(session_counts), 2),
+            'latency': _django.summary(latencies),
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
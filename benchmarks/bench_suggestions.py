@@ -0,0 +1,71 @@
+"""
+Memory and time of the follow suggestions engine on a synthetic follow graph.
+
+The graph is generated in memory with a power-law out-degree and a skewed choice
+of whom to follow (low ids are the popular accounts), then loaded into the CSR
+arrays exactly as FollowGraph.from_db does with rows streamed from the database.
+Scoring runs on a random sample of users and is extrapolated to all of them.
+
+    python -m benchmarks.bench_suggestions --users 1000000 --edges 10000000
+"""
+import argparse
+import json
+import random
+import resource
+import time
+
+from benchmarks import _django
+
+
+def edges(users, total, rng):
+    # (follower, following) pairs sorted by follower then following, about total of them
+    mean = total / users
+    for follower in range(1, users + 1):
+        degree = min(int(rng.paretovariate(1.6) * mean * 0.4), users - 1, 5000)
+        following = {int(users * rng.random() ** 3) + 1 for _ in range(degree)}
+        following.discard(follower)
+        for target in sorted(following):
+            yield follower, target
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--edges', type=int, default=10000000)
+    parser.add_argument('--sample', type=int, default=5000)
+    parser.add_argument('--top-k', type=int, default=20)
+    args = parser.parse_args()
+
+    _django.setup()
+    from core.suggestions import FollowGraph, MAX_DEGREE
+
+    rng = random.Random(42)
+    before = max_rss_mb()
+    start = time.perf_counter()
+    graph = FollowGraph.from_edges(range(1, args.users + 1), edges(args.users, args.edges, rng))
+    built = time.perf_counter() - start
+
+    sample = rng.sample(range(len(graph)), min(args.sample, len(graph)))
+    start = time.perf_counter()
+    latencies = _django.timed(lambda: graph.suggest(sample.pop(), args.top_k, MAX_DEGREE), len(sample))
+    scored = time.perf_counter() - start
+    rate = len(latencies) / scored
+
+    print(json.dumps({
+        'users': len(graph),
+        'edges': len(graph.targets),
+        'graph_mb': round(graph.nbytes() / 1024 / 1024, 1),
+        'max_rss_growth_mb': round(max_rss_mb() - before, 1),
+        'build_seconds': round(built, 1),
+        'suggest': _django.summary(latencies),
+        'users_per_sec': round(rate, 1),
+        'estimated_full_run_minutes': round(len(graph) / rate / 60, 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
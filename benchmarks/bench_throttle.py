@@ -0,0 +1,105 @@
+"""
+Per-request cost and cross-process accuracy of the shared token bucket throttle.
+
+"check" times one throttle decision: DRF's UserRateThrottle on the local memory
+cache (per process, not shared) versus core.throttling.UserRateThrottle on SQLite.
+"processes" then starts --processes workers that all hammer one client key with
+a limit of --limit requests, and counts how many got through: the shared bucket
+against DRF's throttle on a file cache, which every process can see.
+
+    python -m benchmarks.bench_throttle --repeat 5000 --processes 8 --limit 200
+"""
+import argparse
+import json
+import multiprocessing
+import tempfile
+
+from benchmarks import _django
+
+
+def request_for(user):
+    from rest_framework.test import APIRequestFactory, force_authenticate
+    from rest_framework.request import Request
+    request = APIRequestFactory().get('/api/posts/')
+    force_authenticate(request, user)
+    request = Request(request)
+    request.user = user
+    return request
+
+
+def hammer(args):
+    # Runs in a child process, returns how many of attempts were allowed
+    shared, user_id, rate, attempts, start = args
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from rest_framework import throttling as drf
+    from core import throttling
+    connection.close()  # Never share the parent's connection
+    throttle_class = throttling.UserRateThrottle if shared else drf.UserRateThrottle
+    request = request_for(User.objects.get(id=user_id))
+    start.wait()
+    allowed = 0
+    for _ in range(attempts):
+        throttle = throttle_class()
+        throttle.rate = rate
+        throttle.num_requests, throttle.duration = throttle.parse_rate(rate)
+        allowed += throttle.allow_request(request, None)
+    return allowed
+
+
+def race(shared, user_id, rate, processes, attempts):
+    with multiprocessing.Manager() as manager:
+        start = manager.Barrier(processes)
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            return sum(pool.map(hammer, [(shared, user_id, rate, attempts, start)] * processes))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5000)
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--limit', type=int, default=200)
+    args = parser.parse_args()
+
+    _django.setup()
+
+    from django.contrib.auth.models import User
+    from django.core.cache.backends.filebased import FileBasedCache
+    from django.db import connection
+    from rest_framework import throttling as drf
+    from core import throttling
+
+    user = User.objects.create_user(username='bench', password='bench-pass-123')
+    request = request_for(user)
+    huge = f'{args.repeat * 10}/day'
+
+    def check(throttle_class):
+        throttle = throttle_class()
+        throttle.rate = huge
+        throttle.num_requests, throttle.duration = throttle.parse_rate(huge)
+        return lambda: throttle.allow_request(request, None)
+
+    results = {
+        'check': {
+            'drf_locmem': _django.summary(_django.timed(check(drf.UserRateThrottle), args.repeat)),
+            'shared_bucket': _django.summary(_django.timed(check(throttling.UserRateThrottle), args.repeat)),
+        },
+        'processes': {'processes': args.processes, 'limit': args.limit, 'attempts': args.limit * 2},
+    }
+
+    # A limit no refill can add to within the run, so exactly limit requests may pass.
+    # Each race uses a fresh user, so it starts with a full bucket
+    rate = f'{args.limit}/day'
+    attempts = args.limit * 2 // args.processes
+    racers = [User.objects.create_user(username=f'racer{i}', password='bench-pass-123') for i in range(2)]
+    connection.close()
+    results['processes']['shared_bucket_allowed'] = race(True, racers[0].id, rate, args.processes, attempts)
+
+    drf.SimpleRateThrottle.cache = FileBasedCache(tempfile.mkdtemp(prefix='social_bench_throttle_'), {})
+    results['processes']['drf_file_cache_allowed'] = race(False, racers[1].id, rate, args.processes, attempts)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
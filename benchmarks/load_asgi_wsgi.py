@@ -0,0 +1,154 @@
+"""
+Load test of the feed, profile and post detail pages, ASGI versus WSGI.
+
+Seeds a throwaway SQLite database, then serves the same project twice, one
+process each: uvicorn on social_app.asgi and gunicorn (gthread) on social_app.wsgi.
+For every concurrency level, that many keep-alive clients request the three
+pages round robin for --duration seconds as a logged in user.
+
+"capacity" is the highest concurrency level with no errors and p99 under --slo-ms.
+Needs uvicorn and gunicorn installed; a server that is missing is skipped.
+
+    python -m benchmarks.load_asgi_wsgi --levels 1,16,64 --duration 10
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks import _django
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def seed(users, posts_per_user):
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from core.models import Post, Comment, Follow
+
+    reader = User.objects.create_user(username='reader', password='bench-pass-123')
+    authors = [User.objects.create_user(username=f'author{i}', password='bench-pass-123') for i in range(users)]
+    for author in authors:
+        Follow.objects.create(follower=reader, following=author)
+        for i in range(posts_per_user):
+            Post.objects.create(uploader=author, caption=f'Post {i} by {author.username}')
+    post = Post.objects.order_by('-id').first()
+    for i in range(20):
+        Comment.objects.create(user=reader, post=post, content=f'Comment {i}')
+
+    client = Client()
+    client.force_login(reader)
+    return client.cookies['sessionid'].value, ['/feed/', f'/profile/{authors[0].username}/', f'/post/{post.id}/']
+
+
+def load(port, urls, cookie, concurrency, duration):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def client(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        i = offset
+        mine = []
+        while time.monotonic() < stop:
+            url = urls[i % len(urls)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                conn.request('GET', url, headers={'Cookie': f'sessionid={cookie}'})
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            if ok:
+                mine.append((time.perf_counter() - start) * 1000)
+            else:
+                with lock:
+                    errors[0] += 1
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    result = {'concurrency': concurrency, 'requests': len(latencies), 'errors': errors[0],
+              'rps': round(len(latencies) / elapsed, 1)}
+    if latencies:
+        result.update(_django.summary(latencies))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--levels', default='1,8,32,64')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=20, help='Posts per user')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads for the WSGI server')
+    parser.add_argument('--slo-ms', type=float, default=1000)
+    args = parser.parse_args()
+
+    db_path = _django.setup()
+    cookie, urls = seed(args.users, args.posts)
+
+    env = dict(os.environ, DJ_DATABASE_URL=f'sqlite:///{db_path}', DEBUG='', ALLOWED_HOSTS='*')
+    servers = {
+        'asgi': ['uvicorn', 'social_app.asgi:application', '--log-level', 'warning', '--port'],
+        'wsgi': ['gunicorn', 'social_app.wsgi:application', '--worker-class', 'gthread',
+                 '--threads', str(args.threads), '--log-level', 'warning', '--bind'],
+    }
+    results = {'urls': urls, 'servers': {}}
+    for name, command in servers.items():
+        if shutil.which(command[0]) is None:
+            results['servers'][name] = {'skipped': f'{command[0]} is not installed'}
+            continue
+        port = free_port()
+        target = str(port) if name == 'asgi' else f'127.0.0.1:{port}'
+        process = subprocess.Popen(command + [target], env=env, stdout=subprocess.DEVNULL, stderr=sys.stderr)
+        try:
+            if not wait_for(port):
+                results['servers'][name] = {'skipped': 'server did not start'}
+                continue
+            load(port, urls, cookie, 1, 1)  # Warm up
+            levels = [load(port, urls, cookie, int(level), args.duration) for level in args.levels.split(',')]
+            capacity = max([run['concurrency'] for run in levels
+                            if run['errors'] == 0 and run.get('p99_ms', float('inf')) < args.slo_ms] or [0])
+            results['servers'][name] = {'levels': levels, 'capacity': capacity}
+        finally:
+            process.terminate()
+            process.wait()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""
+Load test of the API and pages under a read heavy, a write heavy and a mixed workload.
+
+Seeds a throwaway SQLite database with manage.py seed_social, adds one logged in
+user per client who follows the most followed seeded accounts, then serves the
+project with uvicorn (or gunicorn) in a separate process. For every workload,
+--concurrency keep-alive clients send requests picked by the workload's weights
+for --duration seconds:
+
+    feed          GET /feed/                      session
+    profile       GET /profile/<popular user>/    session
+    api_posts     GET /api/posts/                 JWT
+    api_comments  GET /api/comments/?post=<hot>   JWT
+    like_toggle   POST /post/<hot>/like/          session, toggles the like
+
+Reports RPS, errors and p50/p95/p99 latency per workload and endpoint. Queries
+per request are counted in this process with the test client against the same
+database, warm (the second of two identical requests), and averaged with the
+workload's weights. The throttle rates are raised for the server so it never
+refuses the load.
+
+Results are compared with the stored baseline (benchmarks/baselines/load_suite.json),
+RPS down or p99 up by more than --tolerance, or more queries per request, is
+listed under "regressions". Record a new baseline with --save-baseline, only
+compare numbers taken on the same machine.
+
+    python -m benchmarks.load_suite --concurrency 8 --duration 10
+    python -m benchmarks.load_suite --workloads mixed --fail-on-regression
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import platform
+import random
+import secrets
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from benchmarks import _django
+from benchmarks.load_asgi_wsgi import free_port, wait_for
+
+BASELINE = Path(__file__).resolve().parent / 'baselines' / 'load_suite.json'
+
+WORKLOADS = {
+    'read_heavy': {'feed': 4, 'api_posts': 2, 'api_comments': 2, 'profile': 2},
+    'write_heavy': {'like_toggle': 8, 'feed': 1, 'api_posts': 1},
+    'mixed': {'feed': 3, 'api_posts': 2, 'api_comments': 1, 'profile': 2, 'like_toggle': 2},
+}
+
+
+def prepare(args):
+    # Seeds the database and returns the clients' credentials and the targets
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.test import Client
+    from core.authentication import RefreshToken
+    from core.models import Follow, Post, Profile
+
+    call_command('seed_social', users=args.users, posts_per_user=args.posts_per_user,
+                 follows_per_user=args.follows_per_user, seed=args.seed, progress_every=10 ** 9,
+                 stdout=io.StringIO())
+    popular = list(Profile.objects.order_by('-follower_count').values_list('user_id', 'user__username')[:50])
+    hot = list(Post.objects.order_by('-like_count', '-id').values_list('id', flat=True)[:20])
+
+    clients = []
+    for n in range(args.concurrency):
+        user = User.objects.create_user(username=f'loadclient{n}', password='bench-pass-123')
+        for user_id, _ in popular:
+            Follow.objects.create(follower=user, following_id=user_id)  # Backfills the timeline
+        browser = Client()
+        browser.force_login(user)
+        clients.append({'user': user, 'session': browser.cookies['sessionid'].value,
+                        'csrf': secrets.token_hex(16),
+                        'jwt': str(RefreshToken.for_user(user).access_token)})
+    return clients, [username for _, username in popular[:20]], hot
+
+
+def request_for(name, client, rng, usernames, hot):
+    # (method, url, headers) of one request
+    session = {'Cookie': f"sessionid={client['session']}; csrftoken={client['csrf']}"}
+    jwt = {'Authorization': f"Bearer {client['jwt']}"}
+    if name == 'feed':
+        return 'GET', '/feed/', session
+    if name == 'profile':
+        return 'GET', f'/profile/{rng.choice(usernames)}/', session
+    if name == 'api_posts':
+        return 'GET', '/api/posts/', jwt
+    if name == 'api_comments':
+        return 'GET', f'/api/comments/?post={rng.choice(hot)}', jwt
+    if name == 'like_toggle':
+        return 'POST', f'/post/{rng.choice(hot)}/like/', dict(session, **{'X-CSRFToken': client['csrf'],
+                                                                          'Content-Length': '0'})
+    raise ValueError(name)
+
+
+def count_queries(clients, usernames, hot):
+    # Warm queries per request of every endpoint, run in this process
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    browser = Client()
+    browser.force_login(clients[0]['user'])
+    counts = {}
+    for name in sorted({name for weights in WORKLOADS.values() for name in weights}):
+        method, url, headers = request_for(name, clients[0], random.Random(0), usernames, hot)
+        extra = {'HTTP_AUTHORIZATION': headers['Authorization']} if 'Authorization' in headers else {}
+        send = browser.post if method == 'POST' else browser.get
+        send(url, **extra)
+        with CaptureQueriesContext(connection) as queries:
+            send(url, **extra)
+        counts[name] = len(queries)
+    return counts
+
+
+def run_workload(port, weights, clients, usernames, hot, duration, seed):
+    names, shares = zip(*weights.items())
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def worker(n, client):
+        rng = random.Random(seed + n)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine = {name: [] for name in names}
+        failed = {name: 0 for name in names}
+        while time.monotonic() < stop:
+            name = rng.choices(names, shares)[0]
+            method, url, headers = request_for(name, client, rng, usernames, hot)
+            start = time.perf_counter()
+            try:
+                conn.request(method, url, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status < 400  # The like toggle redirects
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            if ok:
+                mine[name].append((time.perf_counter() - start) * 1000)
+            else:
+                failed[name] += 1
+        conn.close()
+        with lock:
+            for name in names:
+                latencies[name].extend(mine[name])
+                errors[name] += failed[name]
+
+    threads = [threading.Thread(target=worker, args=(n, client)) for n, client in enumerate(clients)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    every = [latency for name in names for latency in latencies[name]]
+    result = {'requests': len(every), 'errors': sum(errors.values()), 'rps': round(len(every) / elapsed, 1)}
+    if every:
+        result.update(_django.summary(every))
+    result['endpoints'] = {name: dict(_django.summary(latencies[name]) if latencies[name] else {},
+                                      errors=errors[name]) for name in names}
+    return result
+
+
+def compare(results, baseline, tolerance):
+    # Change against the baseline per workload, and what got worse by more than tolerance
+    diff, regressions = {}, []
+    for name, run in results['workloads'].items():
+        before = baseline.get('workloads', {}).get(name)
+        if not before or 'rps' not in run or 'p99_ms' not in before:
+            continue
+        change = {
+            'rps_pct': round(100 * (run['rps'] - before['rps']) / before['rps'], 1) if before['rps'] else None,
+            'p99_pct': round(100 * (run['p99_ms'] - before['p99_ms']) / before['p99_ms'], 1) if before['p99_ms'] else None,
+            'queries_per_request': round(run['queries_per_request'] - before['queries_per_request'], 2),
+        }
+        diff[name] = change
+        if change['rps_pct'] is not None and change['rps_pct'] < -100 * tolerance:
+            regressions.append(f"{name}: rps {change['rps_pct']}%")
+        if change['p99_pct'] is not None and change['p99_pct'] > 100 * tolerance:
+            regressions.append(f"{name}: p99 +{change['p99_pct']}%")
+        if change['queries_per_request'] > 0:
+            regressions.append(f"{name}: +{change['queries_per_request']} queries per request")
+    return diff, regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workloads', default=','.join(WORKLOADS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per workload')
+    parser.add_argument('--users', type=int, default=2000, help='Seeded users')
+    parser.add_argument('--posts-per-user', type=float, default=5)
+    parser.add_argument('--follows-per-user', type=float, default=20)
+    parser.add_argument('--server', choices=['uvicorn', 'gunicorn'], default='uvicorn')
+    parser.add_argument('--workers', type=int, default=1, help='Server processes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed RPS and p99 change, 0.1 is 10%%')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 on a regression')
+    args = parser.parse_args()
+    workloads = args.workloads.split(',')
+
+    db_path = _django.setup()
+    clients, usernames, hot = prepare(args)
+    queries = count_queries(clients, usernames, hot)
+
+    if shutil.which(args.server) is None:
+        sys.exit(f'{args.server} is not installed')
+    port = free_port()
+    if args.server == 'uvicorn':
+        command = ['uvicorn', 'social_app.asgi:application', '--log-level', 'warning',
+                   '--workers', str(args.workers), '--port', str(port)]
+    else:
+        command = ['gunicorn', 'social_app.wsgi:application', '--worker-class', 'gthread', '--threads', '8',
+                   '--workers', str(args.workers), '--log-level', 'warning', '--bind', f'127.0.0.1:{port}']
+    env = dict(os.environ, DJ_DATABASE_URL=f'sqlite:///{db_path}', DEBUG='', ALLOWED_HOSTS='*',
+               THROTTLE_USER_RATE='1000000/s', THROTTLE_ANON_RATE='1000000/s', WEB_CONCURRENCY=str(args.workers))
+    results = {
+        'meta': {'commit': git_commit(), 'python': platform.python_version(), 'machine': platform.machine(),
+                 'cpus': os.cpu_count(), 'server': args.server, 'workers': args.workers,
+                 'concurrency': args.concurrency, 'duration': args.duration, 'users': args.users},
+        'queries': queries,
+        'workloads': {},
+    }
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=sys.stderr)
+    try:
+        if not wait_for(port):
+            sys.exit('The server did not start')
+        run_workload(port, WORKLOADS['read_heavy'], clients, usernames, hot, 1, args.seed)  # Warm up
+        for name in workloads:
+            weights = WORKLOADS[name]
+            run = run_workload(port, weights, clients, usernames, hot, args.duration, args.seed)
+            run['queries_per_request'] = round(
+                sum(queries[endpoint] * share for endpoint, share in weights.items()) / sum(weights.values()), 2)
+            results['workloads'][name] = run
+    finally:
+        process.terminate()
+        process.wait()
+
+    regressions = []
+    if args.baseline.exists() and not args.save_baseline:
+        results['diff'], regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        results['regressions'] = regressions
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(results, indent=2) + '\n')
+    print(json.dumps(results, indent=2))
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
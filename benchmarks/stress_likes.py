@@ -0,0 +1,72 @@
+"""
+Concurrency stress test for likes on one hot post.
+
+Many threads each double-click like and unlike on the same post through
+core.services.set_like, then the final like rows and like_count are checked.
+Runs against a SQLite file, where connections wait on each other's writes.
+
+    python -m benchmarks.stress_likes --threads 32 --rounds 50
+"""
+import argparse
+import json
+import threading
+import time
+
+from benchmarks import _django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    _django.setup()
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from core.models import Post, Like
+    from core import services
+
+    users = [User.objects.create_user(username=f'liker{i}', password='bench-pass-123') for i in range(args.threads)]
+    post = Post.objects.create(uploader=users[0], caption='Hot post')
+    barrier = threading.Barrier(args.threads)
+    errors = []
+
+    def hammer(user):
+        try:
+            barrier.wait()
+            for i in range(args.rounds):
+                services.set_like(user, post.id, True)
+                services.set_like(user, post.id, True)
+                if i < args.rounds - 1:
+                    services.set_like(user, post.id, False)
+                    services.set_like(user, post.id, False)
+        except Exception as error:
+            errors.append(repr(error))
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=hammer, args=(user,)) for user in users]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    post.refresh_from_db()
+    operations = args.threads * (4 * args.rounds - 2)
+    print(json.dumps({
+        'threads': args.threads,
+        'operations': operations,
+        'ops_per_second': round(operations / elapsed, 1),
+        'errors': errors,
+        'like_rows': Like.objects.filter(post=post).count(),
+        'like_count': post.like_count,
+        'expected': args.threads,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import Post, Comment, Profile, Follow
+from .models import Post, Comment, Profile, Follow, Job
 # Register your models here.
 admin.site.register(Post)
 admin.site.register(Comment)
 admin.site.register(Profile)
-admin.site.register(Follow)
\ No newline at end of file
+admin.site.register(Follow)
+admin.site.register(Job)
@@ -7,3 +7,4 @@ class CoreConfig(AppConfig):
 
     def ready(self):
         import core.signals
+        import core.instrumentation  # Hooks the SQL timing into every new connection
@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.utils.functional import cached_property
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt import authentication, serializers, tokens
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from .denylist import denylist
+from .models import Profile
+
+# JWT authentication without a User query on reads.
+# Tokens issued by the app (RefreshToken.for_user below, used by login_view and
+# the token endpoints) carry the claims the API needs about the user. With
+# JWT_STATELESS_AUTH (off unless a deployment opts in), GET/HEAD/OPTIONS requests
+# get a ClaimsUser built from them and never load the User row. Writes still load
+# it, so serializers and owner checks work on a real User and a deactivated
+# account cannot change anything.
+#
+# Claims are copied when the token is issued: a changed username shows up after
+# the next login, a deactivated user can read until the access token expires
+# (refreshing is refused). Every token is checked against the in-memory JTI
+# denylist, access tokens also by the jti of the refresh token they came from, so
+# blacklisting a refresh token on logout revokes its access tokens too.
+
+STATELESS = getattr(settings, 'JWT_STATELESS_AUTH', False)
+CLAIMS = ('username', 'is_active', 'profile_id')
+
+
+class RefreshToken(tokens.RefreshToken):
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token['username'] = user.get_username()
+        token['is_active'] = user.is_active
+        token['profile_id'] = Profile.objects.filter(user_id=user.pk).values_list('id', flat=True).first()
+        return token
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        access['rjti'] = self['jti']  # Lets the denylist revoke it with the refresh token
+        return access
+
+
+class TokenObtainPairSerializer(serializers.TokenObtainPairSerializer):
+    token_class = RefreshToken
+
+class TokenRefreshSerializer(serializers.TokenRefreshSerializer):
+    token_class = RefreshToken
+
+
+class ClaimsUser(TokenUser):
+    # request.user for stateless reads, only what the token says
+
+    @cached_property
+    def id(self):
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def pk(self):
+        return self.id
+
+    @cached_property
+    def is_active(self):
+        return self.token.get('is_active', False)
+
+    @cached_property
+    def profile_id(self):
+        return self.token.get('profile_id')
+
+
+def revoked(token):
+    return any(jti and jti in denylist for jti in (token.get('jti'), token.get('rjti')))
+
+
+class JWTAuthentication(authentication.JWTAuthentication):
+
+    def authenticate(self, request):
+        # DRF creates the authenticators per request, so this is not shared
+        self.stateless = STATELESS and request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if revoked(token):
+            raise InvalidToken({'detail': 'Token is revoked', 'code': 'token_not_valid'})
+        return token
+
+    def get_user(self, validated_token):
+        # Tokens issued before the claims were added fall back to the database
+        if not (self.stateless and all(claim in validated_token for claim in CLAIMS)):
+            return super().get_user(validated_token)
+        user = ClaimsUser(validated_token)
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
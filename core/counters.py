@@ -0,0 +1,42 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from .models import Profile, Post, Comment, Like, Follow
+
+# Denormalized counters and the rows they count.
+# Signals in core/signals.py keep them current with F() updates, the
+# repair_counters command recounts them here to find and fix any drift.
+# Each entry is (model, counter field, counted model, fk on counted model, model field the fk points at)
+COUNTERS = [
+    (Post, 'like_count', Like, 'post', 'pk'),
+    (Post, 'comment_count', Comment, 'post', 'pk'),
+    (Comment, 'like_count', Comment.likes.through, 'comment', 'pk'),
+    (Comment, 'dislike_count', Comment.dislikes.through, 'comment', 'pk'),
+    (Profile, 'follower_count', Follow, 'following', 'user_id'),
+    (Profile, 'following_count', Follow, 'follower', 'user_id'),
+]
+
+
+def actual_count(counted, fk, ref):
+    # Correlated COUNT of the counted rows for each outer row
+    rows = (counted.objects.filter(**{fk: OuterRef(ref)}).order_by()
+            .values(fk).annotate(total=Count('*')).values('total'))
+    return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+
+def repair_counter(model, field, counted, fk, ref, batch_size=1000, dry_run=False):
+    # Walks the table in primary key batches so no statement locks it for long.
+    # Returns the number of rows whose counter had drifted.
+    drifted = 0
+    last_pk = 0
+    while True:
+        pks = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return drifted
+        last_pk = pks[-1]
+        wrong = list(model.objects.filter(pk__in=pks)
+                     .annotate(actual=actual_count(counted, fk, ref))
+                     .exclude(**{field: F('actual')})
+                     .values_list('pk', flat=True))
+        drifted += len(wrong)
+        if wrong and not dry_run:
+            model.objects.filter(pk__in=wrong).update(**{field: actual_count(counted, fk, ref)})
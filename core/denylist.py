@@ -0,0 +1,126 @@
+import hashlib
+import math
+import threading
+import time
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+# In-memory denylist of revoked JWT ids (jti), so checking a token costs no query.
+# The source of truth is simplejwt's token_blacklist tables, written when a refresh
+# token is blacklisted (by logout_view).
+#
+# Each process keeps a Bloom filter of the revoked jtis, and the exact set of them
+# while there are at most EXACT_LIMIT. Almost every token is not revoked and is
+# answered by the filter alone. A filter hit is confirmed against the exact set,
+# or with one query once the set has grown past the limit and was dropped.
+#
+# Rows blacklisted since the last look are pulled every REFRESH_INTERVAL seconds,
+# one indexed query on the primary key. The whole list is rebuilt every
+# REBUILD_INTERVAL seconds, which also drops tokens that have expired anyway. A
+# refresh token's jti is kept for ACCESS_TOKEN_LIFETIME past its own expiry, the
+# access tokens it issued last (and carry it as rjti) can outlive it by that much.
+# A revocation therefore reaches every process within about REFRESH_INTERVAL.
+
+REFRESH_INTERVAL = getattr(settings, 'JWT_DENYLIST_REFRESH_INTERVAL', 30)
+REBUILD_INTERVAL = getattr(settings, 'JWT_DENYLIST_REBUILD_INTERVAL', 3600)
+EXACT_LIMIT = getattr(settings, 'JWT_DENYLIST_EXACT_LIMIT', 100000)  # jtis kept exactly, about 100 bytes each
+ERROR_RATE = 0.001  # Bloom false positive rate at capacity
+
+
+class BloomFilter:
+
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        self.capacity = max(capacity, 1)
+        self.size = max(64, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item):
+        # Double hashing, two 64 bit halves of one digest stand in for k hash functions
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+    def full(self):
+        return self.count > self.capacity
+
+
+class Denylist:
+
+    def __init__(self, refresh_interval=REFRESH_INTERVAL, rebuild_interval=REBUILD_INTERVAL, exact_limit=EXACT_LIMIT):
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.exact_limit = exact_limit
+        self.bloom = None
+        self.exact = None
+        self.last_id = 0  # Highest BlacklistedToken id seen
+        self.refreshed = self.built = 0.0
+        self.lock = threading.Lock()
+
+    def __contains__(self, jti):
+        self.refresh()
+        if jti not in self.bloom:
+            return False
+        if self.exact is not None:
+            return jti in self.exact
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+    def stale(self):
+        return self.bloom is None or time.monotonic() - self.refreshed >= self.refresh_interval
+
+    def refresh(self, force=False):
+        if not force and not self.stale():
+            return
+        # One thread refreshes, the others keep answering from the current filter
+        if not self.lock.acquire(blocking=self.bloom is None):
+            return
+        try:
+            if not force and not self.stale():
+                return  # Another thread finished the refresh while this one waited
+            if force or self.bloom is None or time.monotonic() - self.built >= self.rebuild_interval or self.bloom.full():
+                self.rebuild()
+            else:
+                for row_id, jti in BlacklistedToken.objects.filter(id__gt=self.last_id).values_list('id', 'token__jti'):
+                    self.add(jti)
+                    self.last_id = max(self.last_id, row_id)
+            self.refreshed = time.monotonic()
+        finally:
+            self.lock.release()
+
+    def rebuild(self):
+        # Rows added after last_id is read are picked up by the next refresh
+        last_id = BlacklistedToken.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        expired_before = timezone.now() - api_settings.ACCESS_TOKEN_LIFETIME
+        jtis = list(BlacklistedToken.objects.filter(id__lte=last_id, token__expires_at__gt=expired_before)
+                    .values_list('token__jti', flat=True))
+        # Room to grow until the next rebuild before the error rate degrades
+        bloom = BloomFilter(max(2 * len(jtis), 1024))
+        for jti in jtis:
+            bloom.add(jti)
+        exact = set(jtis) if len(jtis) <= self.exact_limit else None
+        self.bloom, self.exact, self.last_id = bloom, exact, last_id
+        self.built = time.monotonic()
+
+    def add(self, jti):
+        self.bloom.add(jti)
+        if self.exact is not None:
+            self.exact.add(jti)
+            if len(self.exact) > self.exact_limit:
+                self.exact = None
+
+    def nbytes(self):
+        return len(self.bloom.bits) if self.bloom else 0
+
+
+denylist = Denylist()
@@ -0,0 +1,12 @@
+import django_filters
+from .models import Comment
+
+
+# Filter comments by post id without loading the post first, the default
+# ModelChoiceFilter would spend a query validating it on every request
+class CommentFilter(django_filters.FilterSet):
+    post = django_filters.NumberFilter(field_name='post_id')
+
+    class Meta:
+        model = Comment
+        fields = ['post']
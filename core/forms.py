@@ -69,13 +69,7 @@ class PostForm(forms.ModelForm):
     class Meta:
         model = Post
         fields = ['caption', 'image']  # Fields to show in the form
-
-    #Custom validation for image type or size could go here
-    def clean_image(self):
-        image = self.cleaned_data.get('image')
-        if image and image.size > 5 * 1024 * 1024:  # limit: 5MB
-            raise forms.ValidationError("Image size should not exceed 5MB.")
-        return image
+    # The 5MB size limit is checked by the media worker, see core/media.py
     
 #Form for comment
 class CommentForm(forms.ModelForm):
@@ -0,0 +1,246 @@
+import bisect
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_templates
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework import renderers
+
+# Per-request timing of where the time goes:
+#   db         - every SQL statement, through a wrapper on each database connection
+#   render     - templates (TEMPLATES backend below) and DRF JSON (JSONRenderer below)
+#   cloudinary - uploads in core/media.py
+# Time inside a template that runs a query counts for both render and db.
+#
+# RequestTimingMiddleware adds them to per-route histograms, route being the URL
+# name, and with METRICS_SERVER_TIMING (off by default, it tells anyone how many
+# queries a page runs) sends them back in a Server-Timing header that browser dev
+# tools show. The histograms live in each process and are served in the Prometheus
+# text format at /internal/metrics/, scrape every worker process. Only staff users,
+# requests bearing METRICS_TOKEN and METRICS_ALLOWED_IPS get them: the list is empty
+# by default because behind a reverse proxy on the same host every request comes
+# from 127.0.0.1. Outside a request nothing is recorded and the hooks cost one
+# ContextVar lookup.
+
+ENABLED = getattr(settings, 'METRICS_ENABLED', True)
+SERVER_TIMING = getattr(settings, 'METRICS_SERVER_TIMING', False)
+ALLOWED_IPS = getattr(settings, 'METRICS_ALLOWED_IPS', [])
+TOKEN = getattr(settings, 'METRICS_TOKEN', None)
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+KINDS = ('db', 'render', 'cloudinary')
+METHODS = {'GET', 'HEAD', 'OPTIONS', 'POST', 'PUT', 'PATCH', 'DELETE'}
+
+_current = ContextVar('request_timings', default=None)
+
+
+class Timings:
+    # sync_to_async threads of one async request add to the same Timings, += is not atomic
+    __slots__ = ('counts', 'seconds', 'lock')
+
+    def __init__(self):
+        self.counts = dict.fromkeys(KINDS, 0)
+        self.seconds = dict.fromkeys(KINDS, 0.0)
+        self.lock = threading.Lock()
+
+    def add(self, kind, seconds):
+        with self.lock:
+            self.counts[kind] += 1
+            self.seconds[kind] += seconds
+
+
+@contextmanager
+def track():
+    # Collects the timings of everything run inside, the middleware wraps each request in it
+    timings = Timings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(kind):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(kind, time.perf_counter() - start)
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add('db', time.perf_counter() - start)
+
+def install(sender, connection, **kwargs):
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+connection_created.connect(install)
+
+
+class Template(django_templates.Template):
+
+    def render(self, context=None, request=None):
+        with timed('render'):
+            return super().render(context, request)
+
+class DjangoTemplates(django_templates.DjangoTemplates):
+    # TEMPLATES backend, the Django one with timed rendering
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_templates.reraise(exc, self)
+
+
+class JSONRenderer(renderers.JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    # metric name -> (help, buckets), observed per (route, method)
+    METRICS = {
+        'app_request_duration_seconds': ('Time to handle the request', SECONDS_BUCKETS),
+        'app_request_db_seconds': ('Time spent in SQL per request', SECONDS_BUCKETS),
+        'app_request_db_queries': ('SQL statements per request', QUERY_BUCKETS),
+        'app_request_render_seconds': ('Time spent rendering templates and JSON per request', SECONDS_BUCKETS),
+        'app_request_cloudinary_seconds': ('Time spent in Cloudinary calls per request', SECONDS_BUCKETS),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.histograms = {name: {} for name in self.METRICS}
+        self.requests = {}  # (route, method, status) -> count
+
+    def observe(self, route, method, status, duration, timings):
+        values = {
+            'app_request_duration_seconds': duration,
+            'app_request_db_seconds': timings.seconds['db'],
+            'app_request_db_queries': timings.counts['db'],
+            'app_request_render_seconds': timings.seconds['render'],
+            'app_request_cloudinary_seconds': timings.seconds['cloudinary'],
+        }
+        with self.lock:
+            for name, value in values.items():
+                histogram = self.histograms[name].get((route, method))
+                if histogram is None:
+                    histogram = self.histograms[name][(route, method)] = Histogram(self.METRICS[name][1])
+                histogram.observe(value)
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def export(self):
+        # Prometheus text exposition format
+        lines = ['# HELP app_requests_total Requests handled', '# TYPE app_requests_total counter']
+        with self.lock:
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append(f'app_requests_total{{route="{escape(route)}",method="{method}",status="{status}"}} {count}')
+            for name, (help_text, buckets) in self.METRICS.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for (route, method), histogram in sorted(self.histograms[name].items()):
+                    labels = f'route="{escape(route)}",method="{method}"'
+                    cumulative = 0
+                    for le, count in zip([*buckets, '+Inf'], histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+registry = Registry()
+
+
+def server_timing(timings, duration):
+    parts = [f'{kind};dur={timings.seconds[kind] * 1000:.1f};desc="{timings.counts[kind]}"'
+             for kind in KINDS if timings.counts[kind]]
+    parts.append(f'total;dur={duration * 1000:.1f}')
+    return ', '.join(parts)
+
+def finish(request, response, timings, start):
+    duration = time.perf_counter() - start
+    match = request.resolver_match
+    # URL names keep the label set small, unmatched paths share one label
+    route = (match.view_name or match.route) if match else 'unmatched'
+    method = request.method if request.method in METHODS else 'OTHER'
+    registry.observe(route, method, response.status_code, duration, timings)
+    if SERVER_TIMING:
+        response['Server-Timing'] = server_timing(timings, duration)
+    return response
+
+
+@sync_and_async_middleware
+def RequestTimingMiddleware(get_response):
+    if not ENABLED:
+        raise MiddlewareNotUsed
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            start = time.perf_counter()
+            with track() as timings:
+                response = await get_response(request)
+            return finish(request, response, timings, start)
+    else:
+        def middleware(request):
+            start = time.perf_counter()
+            with track() as timings:
+                response = get_response(request)
+            return finish(request, response, timings, start)
+    return middleware
+
+
+def allowed(request):
+    if request.user.is_staff or request.META.get('REMOTE_ADDR') in ALLOWED_IPS:
+        return True
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(TOKEN) and scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), TOKEN.encode())
+
+def metrics_view(request):
+    if not allowed(request):
+        raise Http404
+    return HttpResponse(registry.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
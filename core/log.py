@@ -0,0 +1,131 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+from datetime import datetime, timezone
+
+# Structured logging that never blocks a request on I/O.
+# LOGGING in settings sends records to QueueHandler below. In the request
+# thread a record only goes through the filters and onto an in-memory queue,
+# a QueueListener thread formats it as one JSON line and writes it. When the
+# queue is full the record is dropped and counted instead of waiting.
+#
+# The filters run in the request thread, sampling first so a dropped record
+# costs nothing more:
+#   SamplingFilter  - keeps this fraction of a logger's records below WARNING,
+#                     per logger name (the longest matching prefix wins)
+#   RedactingFilter - replaces JWTs anywhere in the message, its arguments or
+#                     extra fields, and values under keys that name secrets
+
+SECRET_KEYS = re.compile(r'token|password|secret|authorization|cookie|sessionid|jwt', re.IGNORECASE)
+JWT = re.compile(r'eyJ[\w-]+\.[\w-]+\.[\w-]*')
+REDACTED = '[REDACTED]'
+# Attributes every LogRecord has, anything else came in through extra=
+RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+def redact(value, key=None):
+    if key is not None and SECRET_KEYS.search(str(key)):
+        return REDACTED
+    if isinstance(value, str):
+        return JWT.sub(REDACTED, value)
+    if isinstance(value, dict):
+        return {k: redact(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(v) for v in value)
+    return value
+
+
+class SamplingFilter(logging.Filter):
+
+    def __init__(self, rates=None):
+        super().__init__()
+        # Longest prefix first so 'core.views' beats 'core'
+        self.rates = sorted((rates or {}).items(), key=lambda item: -len(item[0]))
+
+    def rate(self, name):
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + '.'):
+                return rate
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1 or random.random() < rate
+
+
+class RedactingFilter(logging.Filter):
+
+    def filter(self, record):
+        record.msg = redact(record.msg)
+        if isinstance(record.args, dict):
+            record.args = redact(record.args)
+        elif record.args:
+            record.args = tuple(redact(arg) for arg in record.args)
+        for key, value in list(vars(record).items()):
+            if key not in RECORD_FIELDS:
+                setattr(record, key, redact(value, key))
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in RECORD_FIELDS)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    # Writes JSON lines to stream from a background thread
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        target = logging.StreamHandler(stream or sys.stderr)
+        target.setFormatter(JSONFormatter())
+        self.dropped = 0
+        self.listener = logging.handlers.QueueListener(self.queue, target)
+        self.listener.start()  # Stopped by close(), which logging.shutdown() calls at exit
+
+    def prepare(self, record):
+        # Done in the request thread: the message is merged with its arguments
+        # and the traceback turned into text, so nothing on the queue refers to
+        # objects the request may still change
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        # Waits until the listener has written everything queued so far
+        if self.listener._thread is not None:
+            self.queue.join()
+
+    def close(self):
+        # Writes what is still queued and stops the listener
+        if self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
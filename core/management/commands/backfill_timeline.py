@@ -0,0 +1,41 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Follow
+from core import timeline
+
+
+class Command(BaseCommand):
+    help = "Backfill home timelines from the Follow graph and trim them to TIMELINE_MAX_LENGTH"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--follower', help='Only backfill this username\'s timeline')
+        parser.add_argument('--following', help='Only backfill posts from this username')
+        parser.add_argument('--limit', type=int, default=timeline.MAX_LENGTH, help='Posts copied per follow')
+
+    def get_user(self, username):
+        user = User.objects.filter(username=username).first()
+        if user is None:
+            raise CommandError(f"User '{username}' does not exist")
+        return user
+
+    def handle(self, *args, **options):
+        follows = Follow.objects.order_by('id')
+        if options['follower']:
+            follows = follows.filter(follower=self.get_user(options['follower']))
+        if options['following']:
+            follows = follows.filter(following=self.get_user(options['following']))
+
+        total = 0
+        # Users see their own posts on their timeline too
+        if not options['following']:
+            users = User.objects.order_by('id')
+            if options['follower']:
+                users = users.filter(username=options['follower'])
+            for user_id in users.values_list('id', flat=True).iterator(chunk_size=timeline.BATCH_SIZE):
+                total += timeline.backfill_timeline(user_id, user_id, limit=options['limit'])
+
+        pairs = follows.values_list('follower_id', 'following_id')
+        for follower_id, following_id in pairs.iterator(chunk_size=timeline.BATCH_SIZE):
+            total += timeline.backfill_timeline(follower_id, following_id, limit=options['limit'])
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {total} timeline entries"))
@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from core import suggestions
+
+
+class Command(BaseCommand):
+    help = "Rebuild every user's friend-of-friend follow suggestions from the Follow graph"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=suggestions.TOP_K, help='Suggestions stored per user')
+        parser.add_argument('--max-degree', type=int, default=suggestions.MAX_DEGREE,
+                            help='Follows of one account looked at per hop')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        graph = suggestions.FollowGraph.from_db()
+        loaded = time.monotonic()
+        self.stdout.write(f"Loaded {len(graph)} users and {len(graph.targets)} follows "
+                          f"({graph.nbytes() / 1024 / 1024:.1f}MB) in {loaded - start:.1f}s")
+
+        written = suggestions.build(options['top_k'], options['max_degree'], graph=graph)
+        elapsed = time.monotonic() - loaded
+        rate = len(graph) / elapsed if elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored suggestions for {written} users in {elapsed:.1f}s ({rate:.0f} users/s)"))
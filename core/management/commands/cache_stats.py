@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from core import response_cache
+
+
+class Command(BaseCommand):
+    help = "Show the API response cache hit and miss counts"
+
+    def handle(self, *args, **options):
+        stats = response_cache.stats()
+        self.stdout.write(f"hits: {stats['hits']}")
+        self.stdout.write(f"misses: {stats['misses']}")
+        self.stdout.write(f"hit rate: {stats['hit_rate']:.2%}")
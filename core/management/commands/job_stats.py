@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from core import tasks
+
+
+class Command(BaseCommand):
+    help = "Show queued, running and failed background jobs per queue"
+
+    def handle(self, *args, **options):
+        stats = tasks.stats()
+        if not stats:
+            self.stdout.write("No jobs")
+        for queue, counts in sorted(stats.items()):
+            self.stdout.write(f"{queue}: queued {counts['queued']}, running {counts['running']}, "
+                              f"failed {counts['failed']}, lag {counts['lag_seconds']}s")
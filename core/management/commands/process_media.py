@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from core.models import Post, Profile
+from core import media
+
+
+class Command(BaseCommand):
+    help = "Process post images and profile pictures still waiting for the media worker, e.g. after a restart or a storage outage"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--post', type=int, help='Only process this post id')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.filter(media_state=Post.PROCESSING).order_by('id')
+        if options['post']:
+            posts = posts.filter(pk=options['post'])
+
+        outcomes = {Post.READY: 0, Post.FAILED: 0}
+        for post_id in posts.values_list('id', flat=True).iterator():
+            try:
+                state = media.process_post(post_id)
+            except Exception as error:
+                # Storage errors leave the post PROCESSING for the next run
+                self.stderr.write(f"Post {post_id}: {error}")
+                continue
+            if state in outcomes:
+                outcomes[state] += 1
+
+        pictures = 0
+        if not options['post']:
+            staged = Profile.objects.exclude(staged_picture='').order_by('id').values_list('id', 'staged_picture')
+            for profile_id, name in staged.iterator():
+                try:
+                    pictures += bool(media.process_profile_picture(profile_id, name))
+                except Exception as error:
+                    self.stderr.write(f"Profile {profile_id}: {error}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{outcomes[Post.READY]} posts ready, {outcomes[Post.FAILED]} failed, {pictures} profile pictures stored"))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from core import purge
+
+
+class Command(BaseCommand):
+    help = "Delete expired JWTs (outstanding and blacklisted) and sessions in small chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only count the expired rows, delete nothing')
+        parser.add_argument('--only', choices=list(purge.TARGETS), action='append', help='Only purge these tables')
+        parser.add_argument('--chunk-size', type=int, default=purge.CHUNK_SIZE, help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=purge.PAUSE, help='Seconds to sleep between chunks')
+        parser.add_argument('--progress-every', type=int, default=10, help='Print progress every this many chunks')
+        parser.add_argument('--schedule', action='store_true',
+                            help='Also queue the recurring purge job, run by manage.py runworker')
+
+    def handle(self, *args, **options):
+        every = max(options['progress_every'], 1)
+
+        def progress(name, rows, chunks, seconds):
+            if chunks % every == 0:
+                self.stdout.write(f"{name}: {rows} rows in {chunks} chunks ({rows / seconds if seconds else 0:.0f} rows/s)")
+
+        results = purge.purge(options['only'], options['chunk_size'], options['dry_run'], options['pause'], progress)
+        action = 'expired' if options['dry_run'] else 'deleted'
+        for name, metrics in results.items():
+            self.stdout.write(self.style.SUCCESS(
+                f"{name}: {metrics['rows']} {action} in {metrics['chunks']} chunks, "
+                f"{metrics['seconds']:.1f}s ({metrics['rows_per_sec']:.0f} rows/s)"))
+
+        if options['schedule']:
+            job = purge.schedule()
+            self.stdout.write("Scheduled the purge job" if job else "The purge job is already scheduled")
@@ -0,0 +1,36 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from core.models import Post
+from core import search
+
+
+class Command(BaseCommand):
+    help = "Index every user and post for full-text search"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Documents written per batch')
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        batch_size = options['batch_size']
+
+        users = User.objects.order_by('id').values_list('id', 'username', 'profile__bio')
+        posts = Post.objects.order_by('id').values_list('id', 'caption')
+        sources = [
+            (search.USER, users, lambda row: (row[0], f"{row[1]} {row[2] or ''}".strip())),
+            (search.POST, posts, lambda row: (row[0], row[1] or '')),
+        ]
+        for kind, rows, document in sources:
+            batch, total = [], 0
+            for row in rows.iterator(chunk_size=batch_size):
+                batch.append(document(row))
+                if len(batch) == batch_size:
+                    backend.index_many(kind, batch)
+                    total += len(batch)
+                    batch = []
+            if batch:
+                backend.index_many(kind, batch)
+                total += len(batch)
+            self.stdout.write(f"Indexed {total} {kind} documents")
+
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
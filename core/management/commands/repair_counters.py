@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from core.counters import COUNTERS, repair_counter
+
+
+class Command(BaseCommand):
+    help = "Find and fix drift in the denormalized like, comment and follow counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drift, do not fix it')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows checked per statement')
+
+    def handle(self, *args, **options):
+        total = 0
+        for model, field, counted, fk, ref in COUNTERS:
+            drifted = repair_counter(model, field, counted, fk, ref,
+                                     batch_size=options['batch_size'], dry_run=options['dry_run'])
+            total += drifted
+            self.stdout.write(f"{model.__name__}.{field}: {drifted} drifted")
+
+        action = 'found' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS(f"{total} counters {action}"))
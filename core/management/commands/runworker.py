@@ -0,0 +1,64 @@
+import threading
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from core import tasks
+
+
+class Command(BaseCommand):
+    help = "Run background jobs from the database queue until interrupted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queues', default=','.join(tasks.QUEUES), help='Comma separated queues to serve, in priority order')
+        parser.add_argument('--threads', type=int, default=1, help='Jobs run at once by this process')
+        parser.add_argument('--batch', type=int, default=10, help='Jobs claimed per query')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds to wait when no job is runnable')
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is runnable')
+        parser.add_argument('--stats-interval', type=float, default=60.0, help='Seconds between throughput lines')
+
+    def handle(self, *args, **options):
+        queues = [queue.strip() for queue in options['queues'].split(',') if queue.strip()]
+        if not queues or options['threads'] < 1 or options['batch'] < 1:
+            raise CommandError("Need at least one queue, thread and batch")
+
+        stop = threading.Event()
+        workers = [tasks.Worker(queues, batch=options['batch']) for _ in range(options['threads'])]
+        started = time.monotonic()
+
+        def serve(worker):
+            try:
+                worker.run(stop, burst=options['burst'], poll_interval=options['poll'])
+            finally:
+                connections.close_all()
+
+        def report_periodically():
+            while not stop.wait(options['stats_interval']):
+                self.report(workers, started)
+
+        # The first worker runs on the main thread, the others on their own threads
+        threads = [threading.Thread(target=serve, args=(worker,), daemon=True) for worker in workers[1:]]
+        self.stdout.write(f"Serving {', '.join(queues)} with {len(workers)} thread(s)")
+        for thread in threads:
+            thread.start()
+        threading.Thread(target=report_periodically, daemon=True).start()
+        try:
+            workers[0].run(stop, burst=options['burst'], poll_interval=options['poll'])
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            # Let the other threads finish their current job, unclaimed jobs stay queued
+            stop.set()
+            for thread in threads:
+                thread.join()
+        stop.set()
+        self.report(workers, started)
+
+    def report(self, workers, started):
+        counts = {'done': 0, 'retry': 0, 'failed': 0}
+        for worker in workers:
+            for outcome, count in worker.counts.items():
+                counts[outcome] += count
+        elapsed = time.monotonic() - started
+        rate = sum(counts.values()) / elapsed if elapsed else 0.0
+        self.stdout.write(f"done: {counts['done']} retried: {counts['retry']} failed: {counts['failed']} "
+                          f"({rate:.1f} jobs/s)")
@@ -0,0 +1,52 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from core import seed
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic dataset (users, profiles, follows, posts, comments, likes) for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts-per-user', type=float, default=5, help='Mean posts per user')
+        parser.add_argument('--follows-per-user', type=float, default=20, help='Mean accounts each user follows')
+        parser.add_argument('--comments-per-post', type=float, default=2, help='Mean comments per post')
+        parser.add_argument('--likes-per-post', type=float, default=5, help='Mean likes per post')
+        parser.add_argument('--exponent', type=float, default=1.0,
+                            help='Power law exponent of who gets followed, higher concentrates follows on fewer users')
+        parser.add_argument('--days', type=int, default=365, help='Timestamps are spread over this many days')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows inserted per transaction')
+        parser.add_argument('--prefix', default='seed', help='Usernames are this prefix and a number')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same dataset')
+        parser.add_argument('--progress-every', type=int, default=20, help='Print progress every this many batches')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username=f"{options['prefix']}0").exists():
+            raise CommandError(f"Users named {options['prefix']}N already exist, pass another --prefix")
+        every = max(options['progress_every'], 1)
+
+        def progress(name, rows, batches, seconds):
+            if batches % every == 0:
+                self.stdout.write(f"{name}: {rows} rows in {seconds:.1f}s ({rows / seconds if seconds else 0:.0f} rows/s)")
+
+        seeder = seed.Seeder(
+            users=options['users'], posts_per_user=options['posts_per_user'],
+            follows_per_user=options['follows_per_user'], comments_per_post=options['comments_per_post'],
+            likes_per_post=options['likes_per_post'], exponent=options['exponent'], days=options['days'],
+            batch_size=options['batch_size'], prefix=options['prefix'], seed=options['seed'], progress=progress)
+        start = time.monotonic()
+        try:
+            results = seeder.run()
+        except RuntimeError as error:
+            raise CommandError(str(error))
+
+        seconds = time.monotonic() - start
+        for name, metrics in results.items():
+            self.stdout.write(f"{name}: {metrics['rows']} rows in {metrics['seconds']:.1f}s "
+                              f"({metrics['rows_per_sec']:.0f} rows/s)")
+        # Posts, comments and likes are written interleaved, their times overlap
+        total = sum(metrics['rows'] for name, metrics in results.items() if name != 'counters')
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {total} rows in {seconds:.1f}s ({total / seconds if seconds else 0:.0f} rows/s). "
+            f"Run manage.py backfill_timeline and rebuild_search_index to build timelines and search"))
@@ -0,0 +1,271 @@
+import io
+import os
+import shutil
+import uuid
+import urllib3
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+from . import instrumentation, tasks
+
+# Responsive image derivatives for post images and profile pictures.
+# An upload is decoded once with Pillow, resized to each fixed width and written
+# as WebP and JPEG through a storage backend. The resulting URLs are kept on the
+# model (Post.image_derivatives, Profile.picture_derivatives) so the API and the
+# pages never send the full-size original to a 300px card.
+#
+# Storage backends, picked with settings.MEDIA_STORAGE:
+#   cloudinary - uploads with cloudinary.uploader under the derivative's name, over the
+#                SDK's own keep-alive connection pool with OUTBOUND_HTTP_TIMEOUT
+#   local      - files under MEDIA_ROOT served from MEDIA_URL, an offline stand-in for Cloudinary
+#
+# Uploads are processed in the background. The request only copies the upload
+# to MEDIA_STAGING_ROOT and saves the post as PROCESSING; the process_post job
+# validates it, stores it and marks the post READY (or FAILED). A new profile picture
+# is staged the same way and process_profile_picture swaps it in, the profile shows
+# its previous picture meanwhile. MEDIA_STAGING_ROOT must be shared by the web and
+# worker processes.
+
+DERIVATIVES = (('thumb', 150), ('card', 320), ('full', 1080))  # Name and width in pixels, smallest first
+FORMATS = (('webp', 'WEBP'), ('jpeg', 'JPEG'))
+QUALITY = 80
+MAX_UPLOAD_SIZE = getattr(settings, 'MEDIA_MAX_UPLOAD_SIZE', 5 * 1024 * 1024)
+HTTP_TIMEOUT = getattr(settings, 'OUTBOUND_HTTP_TIMEOUT', (3.05, 10))  # (connect, read) seconds
+
+
+class LocalStorage:
+
+    def __init__(self, location=None, base_url=None):
+        self.location = str(location or settings.MEDIA_ROOT)
+        self.base_url = base_url or settings.MEDIA_URL
+
+    def save(self, name, data):
+        # Writes the bytes under name and returns their public URL
+        path = os.path.join(self.location, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as handle:
+            handle.write(data)
+        return self.url(name)
+
+    def url(self, name):
+        return self.base_url.rstrip('/') + '/' + name
+
+    def delete_folder(self, folder):
+        shutil.rmtree(os.path.join(self.location, folder), ignore_errors=True)
+
+
+class CloudinaryStorage:
+
+    def save(self, name, data):
+        from cloudinary import uploader
+        public_id, ext = os.path.splitext(name)
+        with instrumentation.timed('cloudinary'):
+            result = uploader.upload(io.BytesIO(data), public_id=public_id, format=ext.lstrip('.') or None,
+                                     resource_type='image', overwrite=True,
+                                     timeout=urllib3.Timeout(connect=HTTP_TIMEOUT[0], read=HTTP_TIMEOUT[1]))
+        return result['secure_url']
+
+    def delete_folder(self, folder):
+        from cloudinary import api
+        api.delete_resources_by_prefix(folder + '/', resource_type='image')
+
+
+STORAGES = {
+    'local': LocalStorage,
+    'cloudinary': CloudinaryStorage,
+}
+
+def get_storage():
+    return STORAGES[getattr(settings, 'MEDIA_STORAGE', 'local')]()
+
+
+def is_image(upload):
+    # Cheap header check, upload is a file object or bytes
+    if isinstance(upload, bytes):
+        upload = io.BytesIO(upload)
+    try:
+        upload.seek(0)
+        with Image.open(upload) as image:
+            image.verify()
+        return True
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        return False
+    finally:
+        upload.seek(0)
+
+def validation_error(upload):
+    # Returns why an upload (bytes or an uploaded file) cannot be used, or None
+    size = len(upload) if isinstance(upload, bytes) else upload.size
+    if size > MAX_UPLOAD_SIZE:
+        return f"Image size should not exceed {MAX_UPLOAD_SIZE // (1024 * 1024)}MB."
+    if not is_image(upload):
+        return "Upload a valid image."
+    return None
+
+
+def encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no alpha, flatten transparent images onto white
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    image.save(buffer, fmt, quality=QUALITY, optimize=fmt == 'JPEG', progressive=fmt == 'JPEG')
+    return buffer.getvalue()
+
+def render(data):
+    # Returns {name: (width, {format: bytes})} for every derivative of one image
+    image = Image.open(io.BytesIO(data))
+    # Let the JPEG decoder scale down while decoding, far cheaper than a full decode.
+    # Only the width matters, the decoder keeps the image at least this wide
+    image.draft('RGB', (DERIVATIVES[-1][1], 1))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    rendered = {}
+    # Largest first, each size is resized from the previous one instead of the original
+    source = image
+    for name, width in reversed(DERIVATIVES):
+        width = min(width, source.width)  # Never upscale
+        height = max(1, round(source.height * width / source.width))
+        if (width, height) != source.size:
+            source = source.resize((width, height), Image.LANCZOS)
+        rendered[name] = (width, {ext: encode(source, fmt) for ext, fmt in FORMATS})
+    return rendered
+
+
+def store_upload(upload, prefix, storage=None):
+    # Stores the original and its derivatives, returns (original name, derivatives)
+    upload.seek(0)
+    return store(upload.read(), upload.name, prefix, storage)
+
+def store(data, filename, prefix, storage=None):
+    # Everything goes in one new folder, discard() deletes it
+    storage = storage or get_storage()
+    folder = f'{prefix}/{uuid.uuid4().hex}'
+    ext = os.path.splitext(filename or '')[1].lower() or '.jpg'
+    name = f'{folder}/original{ext}'
+    storage.save(name, data)
+
+    derivatives = {}
+    for derivative, (width, files) in render(data).items():
+        derivatives[derivative] = {'width': width}
+        for ext, content in files.items():
+            derivatives[derivative][ext] = storage.save(f'{folder}/{derivative}.{ext}', content)
+    return name, derivatives
+
+def discard(name, storage=None):
+    # Deletes an original stored by store() and its derivatives
+    (storage or get_storage()).delete_folder(os.path.dirname(name))
+
+
+def srcset(derivatives, ext):
+    # "url 150w, url 320w, ..." for one format, narrow originals share a width so keep one URL per width
+    entries = {}
+    for name, _ in DERIVATIVES:
+        entry = (derivatives or {}).get(name)
+        if entry and ext in entry:
+            entries.setdefault(entry['width'], entry[ext])
+    return ', '.join(f'{url} {width}w' for width, url in entries.items())
+
+def srcsets(derivatives):
+    if not derivatives:
+        return None
+    return {ext: srcset(derivatives, ext) for ext, _ in FORMATS}
+
+
+# Background processing of post images and profile pictures
+def staging_path(name):
+    return os.path.join(str(getattr(settings, 'MEDIA_STAGING_ROOT', None) or os.path.join(settings.MEDIA_ROOT, 'incoming')), name)
+
+def stage_upload(upload):
+    # Copies the upload to local disk for the worker, returns the staged name.
+    # Only a local write happens in the request, no decoding and no remote upload
+    ext = os.path.splitext(upload.name or '')[1].lower()[:10]
+    name = f'{uuid.uuid4().hex}{ext}'
+    path = staging_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as handle:
+        for chunk in upload.chunks():
+            handle.write(chunk)
+    return name
+
+
+@tasks.task(queue='media')
+def process_post(post_id):
+    # Turns a PROCESSING post into READY or FAILED. Safe to run again for the same post,
+    # a storage error leaves it PROCESSING and the job queue retries it. The upload was
+    # validated before it was staged, the check here covers files changed since
+    from .models import Post
+    post = Post.objects.filter(pk=post_id, media_state=Post.PROCESSING).first()
+    if post is None or not post.staged_upload:
+        return None
+    path = staging_path(post.staged_upload)
+    try:
+        with open(path, 'rb') as handle:
+            data = handle.read()
+    except FileNotFoundError:
+        data = None
+
+    error = "The upload is no longer available." if data is None else validation_error(data)
+    stored = None
+    if error:
+        post.media_state = Post.FAILED
+    else:
+        stored, post.image_derivatives = store(data, post.staged_upload, 'posts')
+        post.image = stored
+        post.media_state = Post.READY
+    post.staged_upload = ''
+    try:
+        with transaction.atomic():
+            post.save(update_fields=['image', 'image_derivatives', 'media_state', 'staged_upload', 'updated_at'])
+    except DatabaseError:
+        if Post.objects.filter(pk=post_id).exists():
+            raise
+        # Deleted while it was processed, nothing refers to the stored files
+        if stored:
+            discard(stored)
+        post.media_state = None
+    if data is not None:
+        os.remove(path)
+    return post.media_state
+
+
+@tasks.task(queue='media')
+def process_profile_picture(profile_id, staged):
+    # Stores a staged profile picture, returns its stored name or None. Only applies
+    # while the profile still points at this upload, a newer upload or a deleted
+    # profile leaves nothing behind
+    from .models import Profile
+    path = staging_path(staged)
+    if not Profile.objects.filter(pk=profile_id, staged_picture=staged).exists():
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    try:
+        with open(path, 'rb') as handle:
+            data = handle.read()
+    except FileNotFoundError:
+        data = None
+
+    # A bad upload keeps the previous picture
+    stored = None
+    if data is not None and not validation_error(data):
+        stored, derivatives = store(data, staged, 'profiles')
+    with transaction.atomic():
+        profile = Profile.objects.select_for_update().filter(pk=profile_id, staged_picture=staged).first()
+        if profile is not None:
+            fields = ['staged_picture']
+            if stored:
+                profile.profile_picture, profile.picture_derivatives = stored, derivatives
+                fields += ['profile_picture', 'picture_derivatives']
+            profile.staged_picture = ''
+            profile.save(update_fields=fields)
+    if profile is None and stored:
+        discard(stored)
+        stored = None
+    if data is not None:
+        os.remove(path)
+    return stored
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:13
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    # Start the new counters from the rows that already exist
+    Profile = apps.get_model('core', 'Profile')
+    Post = apps.get_model('core', 'Post')
+    Comment = apps.get_model('core', 'Comment')
+    Like = apps.get_model('core', 'Like')
+    Follow = apps.get_model('core', 'Follow')
+
+    def count(model, fk, ref='pk'):
+        rows = model.objects.filter(**{fk: OuterRef(ref)}).order_by().values(fk).annotate(total=Count('*')).values('total')
+        return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+    Post.objects.update(like_count=count(Like, 'post'), comment_count=count(Comment, 'post'))
+    Comment.objects.update(like_count=count(Comment.likes.through, 'comment'),
+                           dislike_count=count(Comment.dislikes.through, 'comment'))
+    Profile.objects.update(follower_count=count(Follow, 'following', 'user_id'),
+                           following_count=count(Follow, 'follower', 'user_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_cursor_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='dislike_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+
+# The search index lives in vendor specific tables that the ORM does not manage,
+# see core/search.py. Other databases fall back to the basic icontains backend.
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS core_search_fts "
+            "USING fts5(body, tokenize='unicode61', prefix='2 3')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE IF NOT EXISTS core_search_document ("
+            "kind varchar(10) NOT NULL, "
+            "object_id bigint NOT NULL, "
+            "body text NOT NULL, "
+            "vector tsvector GENERATED ALWAYS AS (to_tsvector('simple', body)) STORED, "
+            "PRIMARY KEY (kind, object_id))"
+        )
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS core_search_document_vector_idx "
+            "ON core_search_document USING GIN (vector)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS core_search_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS core_search_document")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
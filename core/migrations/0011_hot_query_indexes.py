@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 21:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_throttle_buckets'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['following', '-followed_at', '-id'], name='follow_following_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['post', 'user'], name='like_post_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['uploader', '-created_at', '-id'], name='post_uploader_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['-created_at', '-id'], name='profile_recent_idx'),
+        ),
+        # Cursor pages of /api/users/ are keyed on (date_joined, id). auth_user
+        # belongs to django.contrib.auth, so its index is created here by hand
+        migrations.RunSQL(
+            'CREATE INDEX auth_user_joined_idx ON auth_user (date_joined DESC, id DESC)',
+            'DROP INDEX auth_user_joined_idx',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 22:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='staged_picture',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
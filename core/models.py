@@ -7,20 +7,47 @@ from cloudinary.models import CloudinaryField
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE) #one profile per user
     profile_picture = CloudinaryField('image', default='default_profile_image')# Cloudinary-hosted profile image
+    picture_derivatives = models.JSONField(default=dict, blank=True)  # Resized copies of the picture, see core/media.py
+    staged_picture = models.CharField(max_length=255, blank=True)  # New picture waiting for the media worker
     bio = models.TextField(blank=True, null=True)  # Optional bio field
     age = models.PositiveIntegerField(blank=True, null=True)  # Optional age field
     created_at = models.DateTimeField(auto_now_add=True)  # Timestamp when profile was created
+    is_high_fanout = models.BooleanField(default=False)  # Too many followers to push posts to, followers pull them at read time
+    follower_count = models.PositiveIntegerField(default=0)  # Users following this user, kept up to date by signals
+    following_count = models.PositiveIntegerField(default=0)  # Users this user follows, kept up to date by signals
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='profile_recent_idx'),  # Cursor pages of all profiles
+        ]
 
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
 # Model for post
 class Post(models.Model):
+    # Media states, a post with an uploaded image stays PROCESSING until the media worker has run
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    MEDIA_STATES = [(PROCESSING, 'Processing'), (READY, 'Ready'), (FAILED, 'Failed')]
+
     uploader = models.ForeignKey(User,on_delete=models.CASCADE, related_name='posts') # Author of the post
     image = CloudinaryField('image', blank=True, null=True) # image to a post
+    image_derivatives = models.JSONField(default=dict, blank=True) # Resized copies of the image, see core/media.py
+    media_state = models.CharField(max_length=10, choices=MEDIA_STATES, default=READY) # Only READY posts show up in feeds
+    staged_upload = models.CharField(max_length=255, blank=True) # Upload waiting for the media worker
     caption = models.TextField() # Caption text on a post
     created_at = models.DateTimeField(auto_now_add=True) # Timestamp for creation of post
     updated_at = models.DateTimeField(auto_now=True) # Timestamp of last update
+    like_count = models.PositiveIntegerField(default=0) # Number of likes, kept up to date by signals
+    comment_count = models.PositiveIntegerField(default=0) # Number of comments, kept up to date by signals
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='post_recent_idx'),  # Cursor pages of all posts
+            models.Index(fields=['uploader', '-created_at', '-id'], name='post_uploader_recent_idx'),  # A user's posts, profile pages
+        ]
 
     def __str__(self):
         return f"{self.uploader.username}'s Post - {self.created_at.strftime('%Y-%m-%d')}"
@@ -34,12 +61,20 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True) #Timestamp for creation of comment
     likes = models.ManyToManyField(User, related_name='liked_photos', blank=True)
     dislikes = models.ManyToManyField(User, related_name='disliked_photos', blank=True)
+    like_count = models.PositiveIntegerField(default=0) # Number of likes, kept up to date by signals
+    dislike_count = models.PositiveIntegerField(default=0) # Number of dislikes, kept up to date by signals
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='comment_recent_idx'),  # Cursor pages of all comments
+            models.Index(fields=['post', '-created_at', '-id'], name='comment_post_recent_idx'),  # Cursor pages of a post's comments
+        ]
 
     def total_likes(self):
-            return self.likes.count()
+            return self.like_count
         
     def total_dislikes(self):
-            return self.dislikes.count()
+            return self.dislike_count
     def __str__(self):
         return  f"Comment by {self.user.username} on Post {self.post.id}"
 
@@ -51,6 +86,9 @@ class Like(models.Model):
 
     class Meta:
         unique_together = ('user', 'post')  # Prevent duplicate likes on the same post by the same user
+        indexes = [
+            models.Index(fields=['post', 'user'], name='like_post_user_idx'),  # Likes of a post, counter repairs
+        ]
 
     def __str__(self):
         return f"{self.user.username} liked Post {self.post.id}"
@@ -63,8 +101,70 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ('follower', 'following')  # Prevent duplicate follows
+        indexes = [
+            models.Index(fields=['-followed_at', '-id'], name='follow_recent_idx'),  # Cursor pages of follows
+            models.Index(fields=['following', '-followed_at', '-id'], name='follow_following_recent_idx'),  # Followers of a user, newest first
+        ]
 
     def __str__(self):
         return f"{self.follower.username} follows {self.following.username}"
-    
 
+# Timeline entry model - materialized home timeline, one row per post per reader
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')  # Whose timeline this is
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')  # Post pushed to the timeline
+    created_at = models.DateTimeField()  # Copy of post.created_at so a page is one index range read
+
+    class Meta:
+        unique_together = ('user', 'post')  # A post shows up once per timeline
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"Post {self.post_id} on {self.user_id}'s timeline"
+
+# Precomputed follow suggestions, rebuilt in batch by core/suggestions.py
+class FollowSuggestion(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='follow_suggestion')
+    suggestions = models.JSONField(default=list)  # [[user id, mutual follow count], ...] best first
+    computed_at = models.DateTimeField(auto_now=True)  # When the batch that wrote this row ran
+
+    def __str__(self):
+        return f"Suggestions for {self.user_id}"
+
+# Background job, queued with core.tasks.defer and run by manage.py runworker
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    queue = models.CharField(max_length=50, default='default')  # Workers pick the queues they serve
+    name = models.CharField(max_length=200)  # Dotted path of the task function
+    args = models.JSONField(default=list)  # Positional arguments for the task
+    state = models.CharField(max_length=10, choices=STATES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)  # Runs started so far
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)  # Not claimed before this, pushed back on retries
+    locked_by = models.CharField(max_length=100, blank=True)  # Worker running the job
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['queue', 'state', 'run_at'], name='job_claim_idx'),  # Next runnable jobs of a queue
+        ]
+
+    def __str__(self):
+        return f"{self.name} on {self.queue} ({self.state})"
+
+# Token bucket of one throttled client, shared by every process, see core/throttling.py
+class ThrottleBucket(models.Model):
+    key = models.CharField(max_length=200, primary_key=True)  # DRF throttle cache key, scope plus user id or IP
+    tokens = models.FloatField()  # Requests left, refilled at the scope's rate
+    updated = models.FloatField()  # Unix time tokens was last computed
+
+    def __str__(self):
+        return f"{self.key}: {self.tokens:.2f} tokens"
@@ -0,0 +1,158 @@
+import base64
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Keyset (cursor) pagination on (timestamp, id), newest first.
+# A page is an index range read that starts right after the last row of the
+# previous page, so there is no COUNT(*) and no OFFSET scan, and new rows
+# arriving at the top do not shift the pages.
+
+PAGE_SIZE = settings.REST_FRAMEWORK.get('PAGE_SIZE', 10)
+
+
+def encode_cursor(value, pk, reverse=False):
+    # The cursor is opaque to clients, it just carries the position
+    raw = f"{'p' if reverse else 'n'}|{value.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    # Returns (value, pk, reverse), raises ValueError for a malformed cursor
+    padded = cursor + '=' * (-len(cursor) % 4)
+    direction, value, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+    if direction not in ('n', 'p'):
+        raise ValueError('Unknown cursor direction')
+    return datetime.fromisoformat(value), int(pk), direction == 'p'
+
+
+def keyset_filter(queryset, field, value, pk, reverse=False):
+    # Rows after (value, pk) in newest first order, or before it when reverse is set.
+    # The plain bound on field lets the database use it as the index range start.
+    if reverse:
+        queryset = queryset.filter(**{f'{field}__gte': value})
+        queryset = queryset.filter(Q(**{f'{field}__gt': value}) | Q(pk__gt=pk))
+        return queryset.order_by(field, 'pk')
+    queryset = queryset.filter(**{f'{field}__lte': value})
+    queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(pk__lt=pk))
+    return queryset.order_by(f'-{field}', '-pk')
+
+
+def keyset_slice(queryset, field, cursor, page_size):
+    # The rows of one page plus one extra to tell whether there is a next page
+    if cursor:
+        try:
+            value, pk, _ = decode_cursor(cursor)
+        except (ValueError, TypeError):
+            raise NotFound('Invalid cursor')
+        queryset = keyset_filter(queryset, field, value, pk)
+    else:
+        queryset = queryset.order_by(f'-{field}', '-pk')
+    return queryset[:page_size + 1]
+
+def keyset_page(queryset, field='created_at', cursor=None, page_size=PAGE_SIZE):
+    # Forward only helper for the HTML pages, returns (rows, next_cursor)
+    rows = list(keyset_slice(queryset, field, cursor, page_size))
+    return page_of(rows, field, page_size)
+
+async def akeyset_page(queryset, field='created_at', cursor=None, page_size=PAGE_SIZE):
+    # keyset_page for async views, the rows are fetched with the async ORM
+    rows = [row async for row in keyset_slice(queryset, field, cursor, page_size)]
+    return page_of(rows, field, page_size)
+
+def page_of(rows, field, page_size):
+    # Trims the extra row fetched to find out whether there is a next page
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, field), last.pk)
+
+
+class KeysetCursorPagination(BasePagination):
+    # Views can set cursor_field to the timestamp they are ordered by
+    page_size = PAGE_SIZE
+    cursor_query_param = 'cursor'
+    cursor_field = 'created_at'
+
+    def get_field(self, view):
+        return getattr(view, 'cursor_field', self.cursor_field)
+
+    def get_position(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            return decode_cursor(cursor)
+        except (ValueError, TypeError):
+            raise NotFound('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.field = self.get_field(view)
+        position = self.get_position(request)
+        reverse = bool(position and position[2])
+        if position:
+            queryset = keyset_filter(queryset, self.field, position[0], position[1], reverse)
+        else:
+            queryset = queryset.order_by(f'-{self.field}', '-pk')
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        # Going forward there is a previous page whenever we started from a cursor,
+        # going back there is always a next page (the one we came from)
+        self.has_next = has_more if not reverse else True
+        self.has_previous = bool(position) if not reverse else has_more
+        self.rows = rows
+        return rows
+
+    def paginate_list(self, rows, request, view=None):
+        # For results built outside a queryset (the timeline), fetched with
+        # page_size + 1 rows after get_position(); only moves forward
+        self.request = request
+        self.field = self.get_field(view)
+        self.rows, _ = page_of(rows, self.field, self.page_size)
+        self.has_next = len(rows) > self.page_size
+        self.has_previous = False
+        return self.rows
+
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        last = self.rows[-1]
+        return self.link(encode_cursor(getattr(last, self.field), last.pk))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.rows:
+            return None
+        first = self.rows[0]
+        return self.link(encode_cursor(getattr(first, self.field), first.pk, reverse=True))
+
+    def link(self, cursor):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -11,4 +11,6 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
             return True
 
         # Write permissions are only allowed to the owner of the object.
-        return obj.uploader == request.user or obj.commenter == request.user
\ No newline at end of file
+        # Posts store the owner in uploader, comments and profiles in user
+        owner = getattr(obj, 'uploader', None) or getattr(obj, 'user', None)
+        return owner == request.user
\ No newline at end of file
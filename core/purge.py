@@ -0,0 +1,102 @@
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from .models import Job
+from . import tasks
+
+# Deletes rows that can never be used again, so these tables stop growing:
+#   tokens   - OutstandingToken rows past expires_at (one per login), their
+#              BlacklistedToken rows (one per logout) go with them
+#   sessions - django_session rows past expire_date
+#
+# Rows are walked in primary key order and deleted CHUNK_SIZE at a time, each
+# chunk in its own short transaction found by a range read on the primary key,
+# with a PAUSE between chunks so live requests get the write lock in between.
+# The walk continues after the last key seen, so it never rescans what it kept.
+#
+# manage.py purge_expired runs it once, with --dry-run to only count.
+# scheduled_purge is a job that runs it and queues itself again INTERVAL later,
+# start it once with manage.py purge_expired --schedule. Only a successful run
+# queues the next one: a failing run is retried by the queue as the same job, and
+# once it has used up its attempts it stays FAILED and --schedule starts it again.
+
+CHUNK_SIZE = getattr(settings, 'PURGE_CHUNK_SIZE', 1000)
+PAUSE = getattr(settings, 'PURGE_PAUSE', 0.05)  # Seconds between chunks
+INTERVAL = getattr(settings, 'PURGE_INTERVAL', 3600)  # Seconds between scheduled runs
+
+logger = logging.getLogger(__name__)
+
+
+def expired_tokens(now):
+    return OutstandingToken.objects.filter(expires_at__lt=now)
+
+def expired_sessions(now):
+    return Session.objects.filter(expire_date__lt=now)
+
+TARGETS = {
+    'tokens': expired_tokens,
+    'sessions': expired_sessions,
+}
+
+
+def purge_queryset(queryset, chunk_size=CHUNK_SIZE, dry_run=False, pause=PAUSE, progress=None):
+    # Deletes (or with dry_run counts) the rows of queryset chunk by chunk.
+    # progress(rows, chunks, seconds) is called after every chunk
+    model = queryset.model
+    start = time.monotonic()
+    last = None
+    rows = chunks = 0
+    while True:
+        with transaction.atomic():
+            page = queryset.order_by('pk')
+            if last is not None:
+                page = page.filter(pk__gt=last)
+            keys = list(page.values_list('pk', flat=True)[:chunk_size])
+            if not keys:
+                break
+            if not dry_run:
+                # Cascades (BlacklistedToken) are removed in the same transaction
+                model.objects.filter(pk__in=keys).delete()
+        last = keys[-1]
+        rows += len(keys)
+        chunks += 1
+        if progress:
+            progress(rows, chunks, time.monotonic() - start)
+        if len(keys) < chunk_size:
+            break
+        if pause:
+            time.sleep(pause)
+    seconds = time.monotonic() - start
+    return {'rows': rows, 'chunks': chunks, 'seconds': round(seconds, 3),
+            'rows_per_sec': round(rows / seconds, 1) if seconds else 0.0}
+
+
+def purge(targets=None, chunk_size=CHUNK_SIZE, dry_run=False, pause=PAUSE, progress=None):
+    # Returns {target: metrics}. progress(target, rows, chunks, seconds)
+    now = timezone.now()
+    results = {}
+    for name in targets or TARGETS:
+        report = (lambda *args, name=name: progress(name, *args)) if progress else None
+        results[name] = purge_queryset(TARGETS[name](now), chunk_size, dry_run, pause, report)
+        logger.info("Purged %s expired %s in %s chunks (%.1fs)%s", results[name]['rows'], name,
+                    results[name]['chunks'], results[name]['seconds'], ' [dry run]' if dry_run else '')
+    return results
+
+
+@tasks.task()
+def scheduled_purge():
+    purge()
+    schedule()
+
+def schedule(delay=INTERVAL):
+    # Queues the next scheduled_purge unless one is already waiting
+    if getattr(settings, 'BACKGROUND_TASKS_EAGER', False):
+        return None  # Eager jobs run at once, there is no later to queue for
+    if Job.objects.filter(name=scheduled_purge.task_name, state=Job.QUEUED).exists():
+        return None
+    return tasks.defer(scheduled_purge, run_at=timezone.now() + timedelta(seconds=delay))
@@ -0,0 +1,95 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.utils.decorators import sync_and_async_middleware
+
+# Primary/replica routing. Writes always go to the primary ('default'). Reads go
+# to one of DATABASE_REPLICAS only while a request allows it, which
+# ReplicaMiddleware does for GET/HEAD/OPTIONS requests. Anything else (writes,
+# management commands, job workers) reads from the primary.
+#
+# Read your writes: a request that writes (any other method) sets the PIN_COOKIE
+# cookie, and for READ_YOUR_WRITES seconds after that the client's reads stay on
+# the primary, long enough for the replicas to catch up. Reads inside a
+# transaction, and select_for_update, stay on the primary too.
+
+REPLICAS = getattr(settings, 'DATABASE_REPLICAS', [])
+READ_YOUR_WRITES = getattr(settings, 'READ_YOUR_WRITES_SECONDS', 5)
+PIN_COOKIE = 'db_pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if not REPLICAS or not _replica_reads.get() or connections['default'].in_atomic_block:
+            return 'default'
+        return random.choice(REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db not in REPLICAS
+
+
+@contextmanager
+def use_primary():
+    # For code in a safe request that must see the latest data
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def start(request):
+    allowed = request.method in SAFE_METHODS and not pinned(request)
+    return _replica_reads.set(allowed)
+
+def finish(request, response, token):
+    _replica_reads.reset(token)
+    if request.method not in SAFE_METHODS and response.status_code < 400 and REPLICAS:
+        response.set_cookie(PIN_COOKIE, str(time.time() + READ_YOUR_WRITES), max_age=READ_YOUR_WRITES,
+                            httponly=True, samesite='Lax')
+    return response
+
+
+@sync_and_async_middleware
+def ReplicaMiddleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = start(request)
+            try:
+                response = await get_response(request)
+            except BaseException:
+                _replica_reads.reset(token)
+                raise
+            return finish(request, response, token)
+    else:
+        def middleware(request):
+            token = start(request)
+            try:
+                response = get_response(request)
+            except BaseException:
+                _replica_reads.reset(token)
+                raise
+            return finish(request, response, token)
+    return middleware
@@ -0,0 +1,156 @@
+import hashlib
+import time
+from contextlib import nullcontext
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+from . import replicas
+
+# Response cache for the public read endpoints.
+# Cached entries are keyed by path, query string, renderer and auth scope plus the
+# current version of every namespace the response depends on. Signals in
+# core/signals.py bump the versions of the namespaces a write touches, so only
+# the affected entries stop matching and everything else stays cached.
+#
+# Namespaces: 'posts' (every post list), 'post:<id>', 'profiles' (profile lists),
+# 'profile:<username>', 'comments' (unfiltered comment lists and every comment)
+# and 'comments:<post id>'.
+#
+# The key also serves as the ETag: it names the same content for as long as the
+# versions stay put. A GET whose If-None-Match has it gets a 304 before the cache
+# or the database is read and before anything is serialized. If-None-Match: * only
+# gets a 304 once the resource is known to exist (a cached body or a 200).
+#
+# Versions only move in the cache the write ran against, so the cache must be
+# shared by every worker. RESPONSE_CACHE_ENABLED is off in settings for a locmem
+# cache with several workers, and then every GET is built and sent without an ETag.
+#
+# A version is the time of the last write to its namespace, and the versions are
+# read before a miss is built, so the entry is stored under what was current
+# before the read. A miss is built from a replica unless one of its namespaces
+# changed within READ_YOUR_WRITES_SECONDS, the replica lag allowed for in
+# core/replicas.py; then the replica may not have the write yet and its stale
+# body would be cached (and its ETag answered with 304) under the new version.
+
+ENABLED = getattr(settings, 'RESPONSE_CACHE_ENABLED', True)
+TIMEOUT = getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+PREFIX = 'rc'
+
+
+def get_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def version_key(namespace):
+    return f'{PREFIX}:v:{namespace}'
+
+def bump(*namespaces):
+    # The new version is the clock, so it also says when the namespace last changed.
+    # Two bumps racing both leave a version no cached entry was stored under
+    get_cache().set_many({version_key(namespace): time.time_ns() for namespace in namespaces}, None)
+
+
+def get_versions(namespaces):
+    # A missing version (evicted, or never bumped) starts from the clock, so entries
+    # written before it was evicted can never match again
+    cache = get_cache()
+    keys = [version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    for key in missing:
+        cache.add(key, time.time_ns(), None)
+    if missing:
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in keys]
+
+def recently_changed(versions):
+    # Whether a replica may still be missing one of the writes behind these versions
+    since = time.time_ns() - replicas.READ_YOUR_WRITES * 10 ** 9
+    return any(version is None or version > since for version in versions)
+
+
+def make_key(request, namespaces, renderer='', versions=None):
+    if versions is None:
+        versions = get_versions(namespaces)
+    user = request.user
+    scope = f'u{user.pk}' if user and user.is_authenticated else 'anon'
+    raw = '|'.join([request.path, request.META.get('QUERY_STRING', ''), renderer, scope]
+                   + [str(version) for version in versions])
+    return f'{PREFIX}:r:{hashlib.sha1(raw.encode()).hexdigest()}'
+
+
+def etag(key):
+    # Weak, the same content may not come back byte for byte once rebuilt
+    return f'W/"{key.rsplit(":", 1)[-1]}"'
+
+def not_modified(request, tag, exists=False):
+    # '*' matches any current representation, so only one that exists
+    tags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if '*' in tags:
+        return exists
+    return tag.removeprefix('W/') in (t.removeprefix('W/') for t in tags)
+
+
+def record(outcome):
+    # Shared hit and miss counters, read back with stats()
+    cache = get_cache()
+    key = f'{PREFIX}:stats:{outcome}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+def stats():
+    cache = get_cache()
+    counts = cache.get_many([f'{PREFIX}:stats:hit', f'{PREFIX}:stats:miss'])
+    hits = counts.get(f'{PREFIX}:stats:hit', 0)
+    misses = counts.get(f'{PREFIX}:stats:miss', 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': round(hits / total, 4) if total else 0.0}
+
+
+class CachedResponseMixin:
+    # Viewsets return the namespaces a GET depends on from get_cache_namespaces,
+    # or None when the response should not be cached
+
+    def get_cache_namespaces(self):
+        return None
+
+    def cached(self, request, build):
+        namespaces = self.get_cache_namespaces()
+        if not ENABLED or request.method != 'GET' or namespaces is None:
+            return build()
+        renderer = self.perform_content_negotiation(request)[0].format
+        versions = get_versions(namespaces)
+        key = make_key(request, namespaces, renderer, versions)
+        tag = etag(key)
+        if not_modified(request, tag):
+            record('hit')
+            return Response(status=304, headers={'ETag': tag})
+
+        cache = get_cache()
+        data = cache.get(key)
+        if data is not None:
+            record('hit')
+            if not_modified(request, tag, exists=True):
+                return Response(status=304, headers={'ETag': tag})
+            return Response(data, headers={'X-Cache': 'HIT', 'ETag': tag})
+
+        record('miss')
+        with replicas.use_primary() if recently_changed(versions) else nullcontext():
+            response = build()
+        if response.status_code == 200:
+            cache.set(key, response.data, TIMEOUT)
+            if not_modified(request, tag, exists=True):
+                return Response(status=304, headers={'ETag': tag})
+            response['ETag'] = tag
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(request, lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(request, lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs))
@@ -0,0 +1,163 @@
+import re
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.contrib.auth.models import User
+from .models import Profile, Post
+
+# Full-text search over usernames, profile bios and post captions.
+# Every searchable object is one document: users are indexed with their bio,
+# posts with their caption. The index is kept current by signals in core/signals.py
+# and can be rebuilt with manage.py rebuild_search_index.
+#
+# Backends:
+#   sqlite   - FTS5 virtual table core_search_fts, ranked with bm25
+#   postgres - core_search_document with a generated tsvector column and a GIN index
+#   basic    - icontains scan, used on any other database
+
+USER = 'user'
+POST = 'post'
+KINDS = (USER, POST)
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokens(query):
+    # Only word characters reach the engines, so user input cannot inject query syntax
+    return TOKEN_RE.findall(query or '')[:10]
+
+def user_document(user, bio=None):
+    if bio is None:
+        bio = Profile.objects.filter(user=user).values_list('bio', flat=True).first()
+    return f"{user.username} {bio or ''}".strip()
+
+
+class BasicBackend:
+    # Fallback without an index, matches every token anywhere in the text
+
+    def index(self, kind, object_id, body):
+        pass
+
+    def index_many(self, kind, rows):
+        pass
+
+    def remove(self, kind, object_id):
+        pass
+
+    def search(self, kind, query, limit, offset=0):
+        words = tokens(query)
+        if not words:
+            return []
+        if kind == USER:
+            rows = User.objects.all()
+            for word in words:
+                rows = rows.filter(Q(username__icontains=word) | Q(profile__bio__icontains=word))
+            rows = rows.order_by('username')
+        else:
+            rows = Post.objects.all()
+            for word in words:
+                rows = rows.filter(caption__icontains=word)
+            rows = rows.order_by('-created_at')
+        return list(rows.values_list('id', flat=True)[offset:offset + limit])
+
+
+class SQLiteBackend(BasicBackend):
+    # The FTS5 rowid encodes the document, so updates and deletes are rowid lookups
+    table = 'core_search_fts'
+
+    def rowid(self, kind, object_id):
+        return object_id * 2 + KINDS.index(kind)
+
+    def index(self, kind, object_id, body):
+        self.index_many(kind, [(object_id, body)])
+
+    def index_many(self, kind, rows):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (rowid, body) VALUES (%s, %s)",
+                [(self.rowid(kind, object_id), body) for object_id, body in rows],
+            )
+
+    def remove(self, kind, object_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [self.rowid(kind, object_id)])
+
+    def search(self, kind, query, limit, offset=0):
+        words = tokens(query)
+        if not words:
+            return []
+        # Every word must match, the last one as a prefix so results update while typing
+        match = ' '.join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s AND rowid %% 2 = %s "
+                f"ORDER BY rank LIMIT %s OFFSET %s",
+                [match.strip(), KINDS.index(kind), limit, offset],
+            )
+            return [row[0] // 2 for row in cursor.fetchall()]
+
+
+class PostgresBackend(BasicBackend):
+    table = 'core_search_document'
+
+    def index(self, kind, object_id, body):
+        self.index_many(kind, [(object_id, body)])
+
+    def index_many(self, kind, rows):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {self.table} (kind, object_id, body) VALUES (%s, %s, %s) "
+                f"ON CONFLICT (kind, object_id) DO UPDATE SET body = EXCLUDED.body",
+                [(kind, object_id, body) for object_id, body in rows],
+            )
+
+    def remove(self, kind, object_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE kind = %s AND object_id = %s", [kind, object_id])
+
+    def search(self, kind, query, limit, offset=0):
+        words = tokens(query)
+        if not words:
+            return []
+        match = ' & '.join(words[:-1] + [f'{words[-1]}:*'])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT object_id FROM {self.table}, to_tsquery('simple', %s) query "
+                f"WHERE kind = %s AND vector @@ query "
+                f"ORDER BY ts_rank(vector, query) DESC, object_id DESC LIMIT %s OFFSET %s",
+                [match, kind, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'postgresql': PostgresBackend,
+    'basic': BasicBackend,
+}
+
+def get_backend():
+    # SEARCH_BACKEND picks a backend by name, by default it follows the database vendor
+    name = getattr(settings, 'SEARCH_BACKEND', None) or connection.vendor
+    return BACKENDS.get(name, BasicBackend)()
+
+
+# Index maintenance, called from the signals
+def index_user(user, bio=None):
+    get_backend().index(USER, user.id, user_document(user, bio))
+
+def index_post(post):
+    get_backend().index(POST, post.id, post.caption or '')
+
+def remove(kind, object_id):
+    get_backend().remove(kind, object_id)
+
+
+def search_users(query, limit=10, offset=0):
+    ids = get_backend().search(USER, query, limit, offset)
+    users = User.objects.select_related('profile').in_bulk(ids)
+    return [users[i] for i in ids if i in users]
+
+def search_posts(query, limit=10, offset=0):
+    ids = get_backend().search(POST, query, limit, offset)
+    posts = Post.objects.select_related('uploader').filter(media_state=Post.READY).in_bulk(ids)
+    return [posts[i] for i in ids if i in posts]
@@ -0,0 +1,236 @@
+import random
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import timedelta
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from .counters import repair_counter
+from .models import Profile, Post, Comment, Like, Follow
+from . import response_cache, timeline
+
+# Synthetic dataset for load testing, run with manage.py seed_social.
+#
+# Rows go in with bulk_create, batch_size at a time, each batch in its own
+# transaction. bulk_create sends no post_save signals, so none of the per-row
+# work in core/signals.py runs: profiles are created here, post counters are
+# filled in before the insert (the likes and comments of a post are generated
+# with it) and the follow counters are recounted at the end with
+# core/counters.py. Timelines and the search index are left to
+# manage.py backfill_timeline and rebuild_search_index, they take longer than
+# the seeding itself at scale.
+#
+# Popularity is heavy tailed like a real network: who gets followed follows a
+# power law over the users (exponent sets how steep), and the follows a user
+# makes and the likes and comments a post gets are Pareto distributed around
+# their means. Timestamps are spread over the last `days` days in causal order,
+# a post is never older than its author and a like never older than its post.
+# The same seed gives the same dataset.
+
+WORDS = ('sunset beach coffee morning city night friends travel music food weekend '
+         'mountain river photo art book garden rain summer winter walk road trip '
+         'dinner family dog cat street market light happy new old day home').split()
+
+
+@contextmanager
+def manual_timestamps():
+    # auto_now/auto_now_add would stamp every row with the same insert time
+    fields = [Profile._meta.get_field('created_at'), Post._meta.get_field('created_at'),
+              Post._meta.get_field('updated_at'), Comment._meta.get_field('created_at'),
+              Like._meta.get_field('created_at'), Follow._meta.get_field('followed_at')]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Phase:
+    # Rows written by one step of the seeding, reported after every batch
+
+    def __init__(self, name, progress):
+        self.name = name
+        self.progress = progress
+        self.rows = self.batches = 0
+        self.start = time.monotonic()
+
+    def add(self, rows):
+        self.rows += rows
+        self.batches += 1
+        if self.progress:
+            self.progress(self.name, self.rows, self.batches, time.monotonic() - self.start)
+
+    def metrics(self):
+        seconds = time.monotonic() - self.start
+        return {'rows': self.rows, 'seconds': round(seconds, 3),
+                'rows_per_sec': round(self.rows / seconds, 1) if seconds else 0.0}
+
+
+class Seeder:
+
+    def __init__(self, users=1000, posts_per_user=5, follows_per_user=20, comments_per_post=2,
+                 likes_per_post=5, exponent=1.0, days=365, batch_size=5000, prefix='seed', seed=0,
+                 progress=None):
+        self.users = users
+        self.posts_per_user = posts_per_user
+        self.follows_per_user = follows_per_user
+        self.comments_per_post = comments_per_post
+        self.likes_per_post = likes_per_post
+        self.exponent = exponent
+        self.days = days
+        self.batch_size = batch_size
+        self.prefix = prefix
+        self.progress = progress
+        self.random = random.Random(seed)
+        self.now = timezone.now()
+        self.user_ids = array('q')  # 8 bytes per user, ten million users take 80MB
+        self.joined = array('d')  # Seconds before now each user joined
+        self.ranked = array('q')  # Positions in user_ids in popularity order, most followed first
+
+    # Random helpers
+
+    def count(self, mean, cap):
+        # Pareto distributed with the given mean, alpha 2 keeps a long tail
+        if mean <= 0:
+            return 0
+        return min(cap, int(mean / 2 * self.random.paretovariate(2)))
+
+    def popular(self):
+        # Index into ranked, rank r is picked with probability ~ 1 / (r + 1) ** exponent
+        n, s, u = len(self.ranked), self.exponent, self.random.random()
+        if s == 1:
+            x = (n + 1) ** u
+        else:
+            x = (((n + 1) ** (1 - s) - 1) * u + 1) ** (1 / (1 - s))
+        return min(int(x) - 1, n - 1)
+
+    def after(self, age):
+        # A time between `age` seconds ago and now
+        return self.now - timedelta(seconds=self.random.uniform(0, age))
+
+    def text(self, low, high):
+        return ' '.join(self.random.choices(WORDS, k=self.random.randint(low, high)))
+
+    # Steps
+
+    def run(self):
+        if not connection.features.can_return_rows_from_bulk_insert:
+            raise RuntimeError(f'{connection.vendor} does not return ids from bulk inserts')
+        results = {}
+        with manual_timestamps():
+            results['users'] = self.create_users()
+            results['follows'] = self.create_follows()
+            results['posts'], results['comments'], results['likes'] = self.create_posts()
+        results['counters'] = self.recount()
+        response_cache.bump('posts', 'profiles', 'comments')
+        return results
+
+    def create_users(self):
+        phase = Phase('users', self.progress)
+        password = make_password(None)  # Unusable, hashing one per user would take longer than the rest
+        age = self.days * 86400
+        for start in range(0, self.users, self.batch_size):
+            batch = []
+            for number in range(start, min(start + self.batch_size, self.users)):
+                joined = self.random.uniform(0, age)
+                self.joined.append(joined)
+                batch.append(User(username=f'{self.prefix}{number}', password=password,
+                                  date_joined=self.now - timedelta(seconds=joined)))
+            with transaction.atomic():
+                users = User.objects.bulk_create(batch)
+                Profile.objects.bulk_create(
+                    [Profile(user_id=user.pk, created_at=user.date_joined,
+                             bio=self.text(3, 12) if self.random.random() < 0.5 else None,
+                             age=self.random.randint(16, 70) if self.random.random() < 0.5 else None)
+                     for user in users])
+            self.user_ids.extend(user.pk for user in users)
+            phase.add(len(users) * 2)
+        self.ranked = array('q', range(len(self.user_ids)))
+        self.random.shuffle(self.ranked)
+        return phase.metrics()
+
+    def create_follows(self):
+        phase = Phase('follows', self.progress)
+        batch = []
+        for i, follower in enumerate(self.user_ids):
+            wanted = self.count(self.follows_per_user, len(self.user_ids) - 1)
+            targets = set()
+            for _ in range(wanted * 3):  # Popular targets repeat, give up after a few misses
+                if len(targets) == wanted:
+                    break
+                target = self.ranked[self.popular()]
+                if target != i:
+                    targets.add(target)
+            for target in targets:
+                since = min(self.joined[i], self.joined[target])
+                batch.append(Follow(follower_id=follower, following_id=self.user_ids[target],
+                                    followed_at=self.after(since)))
+            if len(batch) >= self.batch_size:
+                phase.add(self.flush(Follow, batch))
+                batch = []
+        if batch:
+            phase.add(self.flush(Follow, batch))
+        return phase.metrics()
+
+    def create_posts(self):
+        posts, comments, likes = (Phase(name, self.progress) for name in ('posts', 'comments', 'likes'))
+        users = len(self.user_ids)
+        batch = []
+        for i, uploader in enumerate(self.user_ids):
+            for _ in range(self.count(self.posts_per_user, 10 * self.posts_per_user)):
+                created = self.after(self.joined[i])
+                batch.append(Post(uploader_id=uploader, caption=self.text(4, 16), created_at=created,
+                                  updated_at=created, media_state=Post.READY,
+                                  like_count=self.count(self.likes_per_post, users),
+                                  comment_count=self.count(self.comments_per_post, 100 * self.comments_per_post)))
+            if len(batch) >= self.batch_size:
+                self.create_post_batch(batch, posts, comments, likes)
+                batch = []
+        if batch:
+            self.create_post_batch(batch, posts, comments, likes)
+        return posts.metrics(), comments.metrics(), likes.metrics()
+
+    def create_post_batch(self, batch, posts, comments, likes):
+        with transaction.atomic():
+            batch = Post.objects.bulk_create(batch)
+        posts.add(len(batch))
+        comment_rows, like_rows = [], []
+        for post in batch:
+            age = (self.now - post.created_at).total_seconds()
+            for _ in range(post.comment_count):
+                comment_rows.append(Comment(post_id=post.pk, user_id=self.random.choice(self.user_ids),
+                                            content=self.text(2, 12), created_at=self.after(age)))
+            likers = set()
+            while len(likers) < post.like_count:
+                likers.add(self.user_ids[self.ranked[self.popular()]] if self.random.random() < 0.5
+                           else self.random.choice(self.user_ids))
+            like_rows.extend(Like(post_id=post.pk, user_id=user_id, created_at=self.after(age)) for user_id in likers)
+            if len(comment_rows) >= self.batch_size:
+                comments.add(self.flush(Comment, comment_rows))
+                comment_rows = []
+            if len(like_rows) >= self.batch_size:
+                likes.add(self.flush(Like, like_rows))
+                like_rows = []
+        if comment_rows:
+            comments.add(self.flush(Comment, comment_rows))
+        if like_rows:
+            likes.add(self.flush(Like, like_rows))
+
+    def flush(self, model, rows):
+        with transaction.atomic():
+            model.objects.bulk_create(rows, batch_size=self.batch_size)
+        return len(rows)
+
+    def recount(self):
+        # The follow counters and the fan-out flag of the seeded profiles
+        phase = Phase('counters', self.progress)
+        for field, fk in (('follower_count', 'following'), ('following_count', 'follower')):
+            phase.add(repair_counter(Profile, field, Follow, fk, 'user_id', batch_size=self.batch_size))
+        Profile.objects.filter(user__username__startswith=self.prefix,
+                               follower_count__gt=timeline.FANOUT_LIMIT).update(is_high_fanout=True)
+        return phase.metrics()
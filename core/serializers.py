@@ -2,25 +2,52 @@
 from rest_framework import serializers
 from .models import Post, Profile, Comment, Follow
 from django.contrib.auth.models import User
+from django.core.files.uploadedfile import UploadedFile
+from . import media
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username']
 
+def validate_upload(value):
+    # Uploads are decoded by core/media.py after the request, reject anything too
+    # large or that Pillow cannot read before it is staged
+    error = media.validation_error(value) if isinstance(value, UploadedFile) else None
+    if error:
+        raise serializers.ValidationError(error)
+    return value
+
 class ProfileSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
+    picture_srcset = serializers.SerializerMethodField()  # {'webp': srcset, 'jpeg': srcset} or None
 
     class Meta:
         model = Profile
-        fields = '__all__'
+        exclude = ['staged_picture']
+        read_only_fields = ['is_high_fanout', 'follower_count', 'following_count', 'picture_derivatives']
+
+    def get_picture_srcset(self, obj):
+        return media.srcsets(obj.picture_derivatives)
+
+    def validate_profile_picture(self, value):
+        return validate_upload(value)
 
 class PostSerializer(serializers.ModelSerializer):
     uploader = UserSerializer(read_only=True)
+    image_srcset = serializers.SerializerMethodField()  # {'webp': srcset, 'jpeg': srcset} or None
 
     class Meta:
         model = Post
-        fields = '__all__'
+        exclude = ['staged_upload']
+        # Post images are stored by the media worker, media_state reports the outcome
+        read_only_fields = ['like_count', 'comment_count', 'image_derivatives', 'media_state']
+
+    def get_image_srcset(self, obj):
+        return media.srcsets(obj.image_derivatives)
+
+    def validate_image(self, value):
+        return validate_upload(value)
 
 class CommentSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
@@ -28,6 +55,7 @@ class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = '__all__'
+        read_only_fields = ['like_count', 'dislike_count']
 
 class FollowSerializer(serializers.ModelSerializer):
     follower = UserSerializer(read_only=True)
@@ -0,0 +1,212 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import connections, router, transaction
+from django.db.models import Prefetch
+from django.core.files.uploadedfile import UploadedFile
+from django.utils import timezone
+from .models import Profile, Post, Comment, Follow, Like
+from .serializers import ProfileSerializer, PostSerializer, CommentSerializer
+from .pagination import PAGE_SIZE, keyset_page, akeyset_page, page_of, decode_cursor
+from . import media, response_cache, tasks, timeline
+from rest_framework.exceptions import NotFound
+
+# Service layer shared by the API viewsets and the HTML views.
+# The HTML views used to call our own API over HTTP, now both sides call these
+# functions in-process so they get the same querysets, serializers and rules.
+
+# Querysets used by the viewsets and the pages
+def profile_queryset():
+    return Profile.objects.select_related('user')
+
+def post_queryset():
+    return Post.objects.select_related('uploader').order_by('-created_at')
+
+def published_posts():
+    # Posts whose media is ready, the only ones listed in feeds
+    return post_queryset().filter(media_state=Post.READY)
+
+def comment_queryset():
+    # The serializer lists the ids of users who reacted, fetch them in one query per page
+    reactors = User.objects.only('id')
+    return (Comment.objects.select_related('user')
+            .prefetch_related(Prefetch('likes', queryset=reactors), Prefetch('dislikes', queryset=reactors))
+            .order_by('-created_at'))
+
+def follow_queryset():
+    return Follow.objects.select_related('follower', 'following')
+
+
+# Read helpers, these return the same serialized data the API returns
+def get_profile(username):
+    profile = profile_queryset().filter(user__username=username).first()
+    return ProfileSerializer(profile).data if profile else None
+
+# The list helpers return (data, next_cursor) using the same keyset cursors as the API
+def list_posts(uploader_username=None, cursor=None):
+    posts = published_posts()
+    if uploader_username:
+        posts = posts.filter(uploader__username=uploader_username)
+    posts, next_cursor = keyset_page(posts, 'created_at', cursor)
+    return PostSerializer(posts, many=True).data, next_cursor
+
+def home_timeline(user, cursor=None):
+    # Posts from the user and the accounts they follow, newest first
+    before = None
+    if cursor:
+        try:
+            before = decode_cursor(cursor)[:2]
+        except (ValueError, TypeError):
+            raise NotFound('Invalid cursor')
+    posts = timeline.timeline_posts(user, limit=PAGE_SIZE + 1, before=before)
+    posts, next_cursor = page_of(posts, 'created_at', PAGE_SIZE)
+    return PostSerializer(posts, many=True).data, next_cursor
+
+def get_post(pk):
+    post = post_queryset().filter(pk=pk).first()
+    return PostSerializer(post).data if post else None
+
+def list_comments(post_id, cursor=None):
+    comments = comment_queryset().filter(post_id=post_id)
+    comments, next_cursor = keyset_page(comments, 'created_at', cursor)
+    return CommentSerializer(comments, many=True).data, next_cursor
+
+
+# Async read helpers for the pages served over ASGI. They return the same data as
+# the helpers above; serializing is pure Python since every relation they touch
+# is loaded by the querysets.
+async def aget_profile(username):
+    profile = await profile_queryset().filter(user__username=username).afirst()
+    return ProfileSerializer(profile).data if profile else None
+
+async def alist_posts(uploader_username=None, cursor=None):
+    posts = published_posts()
+    if uploader_username:
+        posts = posts.filter(uploader__username=uploader_username)
+    posts, next_cursor = await akeyset_page(posts, 'created_at', cursor)
+    return PostSerializer(posts, many=True).data, next_cursor
+
+async def ahome_timeline(user, cursor=None):
+    # The timeline merge runs several dependent queries, it stays one sync call
+    return await sync_to_async(home_timeline)(user, cursor)
+
+async def aget_post(pk):
+    post = await post_queryset().filter(pk=pk).afirst()
+    return PostSerializer(post).data if post else None
+
+async def alist_comments(post_id, cursor=None):
+    comments = comment_queryset().filter(post_id=post_id)
+    comments, next_cursor = await akeyset_page(comments, 'created_at', cursor)
+    return CommentSerializer(comments, many=True).data, next_cursor
+
+
+# Write helpers, the viewsets call the save_* functions from perform_create
+# Uploaded images are only staged here and stored by the media jobs, so
+# CloudinaryField only ever sees the stored name and never uploads the original by itself
+def save_profile(serializer, user):
+    # The profile keeps its current picture until media.process_profile_picture
+    # has stored the new one after the request
+    upload = serializer.validated_data.get('profile_picture')
+    if not isinstance(upload, UploadedFile):
+        return serializer.save(user=user)
+    del serializer.validated_data['profile_picture']
+    profile = serializer.save(user=user, staged_picture=media.stage_upload(upload))
+    tasks.defer(media.process_profile_picture, profile.pk, profile.staged_picture)
+    return profile
+
+def save_post(serializer, user):
+    # A post image is only staged here, the post is saved as PROCESSING and
+    # media.process_post validates and stores the image after the request
+    upload = serializer.validated_data.get('image')
+    if not isinstance(upload, UploadedFile):
+        return serializer.save(uploader=user)
+    post = serializer.save(uploader=user, image=None, image_derivatives={},
+                           staged_upload=media.stage_upload(upload), media_state=Post.PROCESSING)
+    tasks.defer(media.process_post, post.id)
+    return post
+
+def save_comment(serializer, user):
+    return serializer.save(user=user)
+
+def create_post(user, data):
+    # Returns the serializer so callers can read .data or .errors
+    serializer = PostSerializer(data=data)
+    if serializer.is_valid():
+        save_post(serializer, user)
+    return serializer
+
+def create_comment(user, post_id, content):
+    serializer = CommentSerializer(data={'content': content, 'post': post_id})
+    if serializer.is_valid():
+        save_comment(serializer, user)
+    return serializer
+
+def update_profile(user, data):
+    # Users can only update their own profile from the pages
+    profile = profile_queryset().get(user=user)
+    serializer = ProfileSerializer(profile, data=data, partial=True)
+    if serializer.is_valid():
+        save_profile(serializer, user)
+    return serializer
+
+# Likes. A change is two statements in one transaction: INSERT ... ON CONFLICT DO
+# NOTHING (or DELETE), then UPDATE ... RETURNING that moves like_count by the rows
+# actually inserted or deleted and returns it. A concurrent double click inserts
+# nothing instead of raising IntegrityError, and the count comes back without a
+# SELECT. Both need SQLite 3.35+ or PostgreSQL. The rows skip the ORM, so the
+# Like signals do not fire, the response cache is bumped here once it commits.
+def _like_sql(connection):
+    quote = connection.ops.quote_name
+    like, post = quote(Like._meta.db_table), quote(Post._meta.db_table)
+    return {
+        'insert': f'INSERT INTO {like} (user_id, post_id, created_at) VALUES (%s, %s, %s) '
+                  f'ON CONFLICT (user_id, post_id) DO NOTHING',
+        'delete': f'DELETE FROM {like} WHERE user_id = %s AND post_id = %s',
+        # Never pushes the counter below zero, like the signals in core/signals.py
+        'count': f'UPDATE {post} SET like_count = CASE WHEN like_count + %s < 0 THEN 0 ELSE like_count + %s END '
+                 f'WHERE id = %s RETURNING like_count',
+    }
+
+def _change_like(user, post_id, liked=None):
+    # liked=None toggles. Returns (liked, like_count) or raises Post.DoesNotExist
+    post_id = int(post_id)
+    using = router.db_for_write(Like)
+    connection = connections[using]
+    sql = _like_sql(connection)
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        delta = 0
+        if liked is not True:
+            cursor.execute(sql['delete'], [user.pk, post_id])
+            delta = -cursor.rowcount
+        if liked is None:
+            liked = not delta  # Nothing to unlike, so like
+        if liked:
+            cursor.execute(sql['insert'], [user.pk, post_id, connection.ops.adapt_datetimefield_value(timezone.now())])
+            delta = cursor.rowcount
+        cursor.execute(sql['count'], [delta, delta, post_id])
+        row = cursor.fetchone()
+        if row is None:
+            # Rolls back the INSERT, whose foreign key would only fail at commit
+            raise Post.DoesNotExist(f'Post {post_id} does not exist')
+        if delta:
+            # After commit, or a GET in between would cache the old count under the new version
+            transaction.on_commit(lambda: response_cache.bump('posts', f'post:{post_id}'), using=using)
+    return liked, row[0]
+
+def set_like(user, post_id, liked):
+    # Idempotent like/unlike, returns (liked, like_count) or raises Post.DoesNotExist
+    return _change_like(user, post_id, liked)
+
+def toggle_like(user, post_id):
+    # Unlikes when there is a like to delete, likes otherwise
+    return _change_like(user, post_id)
+
+def toggle_follow(user, username):
+    # Follows or unfollows a user, returns True when user now follows them
+    target = User.objects.filter(username=username).first()
+    if target is None or target == user:
+        return None
+    deleted, _ = Follow.objects.filter(follower=user, following=target).delete()
+    if deleted:
+        return False
+    Follow.objects.get_or_create(follower=user, following=target)
+    return True
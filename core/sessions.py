@@ -0,0 +1,59 @@
+from asgiref.sync import sync_to_async
+from django.contrib.sessions.backends import cached_db
+from django.utils import timezone
+from . import purge
+
+# Session engine for the pages. Every page load reads the session, login_view
+# keeps the JWT access and refresh tokens in it for logout to revoke.
+#
+# Reads come from the cache (SESSION_CACHE_ALIAS) and only fall back to the
+# session table on a miss, writes go to both (Django's cached_db). On top of that:
+#   - assigning a value equal to the one loaded from storage does not mark it
+#     modified, so SessionMiddleware skips the save entirely. Values are compared
+#     serialized against a copy taken at load, so a list or dict changed in place
+#     and assigned back still counts as a change
+#   - clear_expired (manage.py clearsessions) deletes expired rows in small
+#     batches, each its own short transaction, instead of one long DELETE
+#     (see core/purge.py, which also purges expired JWTs)
+#
+# The cache must be shared (CACHE_BACKEND=file or db), or a logout in one process
+# is not seen by the others until their copy expires. Settings only select this
+# engine then, with locmem the pages use Django's plain database sessions.
+
+CLEAR_BATCH_SIZE = 1000  # Expired sessions deleted per transaction
+
+
+class SessionStore(cached_db.SessionStore):
+    cache_key_prefix = 'core.sessions'
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._loaded = {}  # key -> serialized value as loaded from storage
+
+    def _snapshot(self, data):
+        dumps = self.serializer().dumps
+        self._loaded = {key: dumps(value) for key, value in data.items()}
+        return data
+
+    def load(self):
+        return self._snapshot(super().load())
+
+    async def aload(self):
+        return self._snapshot(await super().aload())
+
+    def __setitem__(self, key, value):
+        session = self._session
+        if key in self._loaded and self._loaded[key] == self.serializer().dumps(value):
+            session[key] = value  # Same as in storage, if another change was made it is saved anyway
+            return
+        super().__setitem__(key, value)
+
+    @classmethod
+    def clear_expired(cls, batch_size=CLEAR_BATCH_SIZE):
+        # Returns how many expired sessions were deleted
+        expired = cls.get_model_class().objects.filter(expire_date__lt=timezone.now())
+        return purge.purge_queryset(expired, batch_size, pause=0)['rows']
+
+    @classmethod
+    async def aclear_expired(cls, batch_size=CLEAR_BATCH_SIZE):
+        return await sync_to_async(cls.clear_expired)(batch_size)
@@ -1,7 +1,9 @@
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from .models import Profile
+from .models import Profile, Post, Comment, Like, Follow
+from . import response_cache, search, timeline
 
 # Signal to create Profile automatically when a User is created
 @receiver(post_save, sender=User)
@@ -13,3 +15,168 @@ def create_user_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
+
+# Signals to keep the search index current. Saving a user also saves the
+# profile (above), so the profile signal covers username and bio changes.
+@receiver(post_save, sender=Profile)
+def index_profile(sender, instance, **kwargs):
+    search.index_user(instance.user, instance.bio)
+
+@receiver(post_delete, sender=Profile)
+def unindex_profile(sender, instance, **kwargs):
+    search.remove(search.USER, instance.user_id)
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    search.index_post(instance)
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.remove(search.POST, instance.id)
+
+# Signal to push a new post to the author's and followers' timelines.
+# Posts with an image are pushed when the media worker marks them READY.
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, update_fields=None, **kwargs):
+    if instance.media_state != Post.READY:
+        return
+    if created or (update_fields and 'media_state' in update_fields):
+        timeline.fan_out_post(instance)
+
+# Signal to backfill the follower's timeline when a follow is added
+@receiver(post_save, sender=Follow)
+def backfill_on_follow(sender, instance, created, **kwargs):
+    if created:
+        timeline.backfill_timeline(instance.follower_id, instance.following_id)
+
+# Signal to drop the unfollowed user's posts from the timeline
+@receiver(post_delete, sender=Follow)
+def remove_on_unfollow(sender, instance, **kwargs):
+    timeline.remove_from_timeline(instance.follower_id, instance.following_id)
+
+
+# Counter signals. Each one is a single UPDATE with an F() expression so concurrent
+# requests never overwrite each other. post_delete also fires for queryset deletes
+# and cascades, which keeps the counts right when a user or post is removed.
+def bump(model, field, delta, **lookup):
+    if delta < 0:
+        lookup[f'{field}__gte'] = -delta  # never push a positive counter below zero
+    model.objects.filter(**lookup).update(**{field: F(field) + delta})
+
+# Signals to count likes on a post
+@receiver(post_save, sender=Like)
+def count_like(sender, instance, created, **kwargs):
+    if created:
+        bump(Post, 'like_count', 1, pk=instance.post_id)
+
+@receiver(post_delete, sender=Like)
+def uncount_like(sender, instance, **kwargs):
+    bump(Post, 'like_count', -1, pk=instance.post_id)
+
+# Signals to count comments on a post
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        bump(Post, 'comment_count', 1, pk=instance.post_id)
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    bump(Post, 'comment_count', -1, pk=instance.post_id)
+
+# Signals to count followers and followings on both profiles
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    if created:
+        bump(Profile, 'follower_count', 1, user_id=instance.following_id)
+        bump(Profile, 'following_count', 1, user_id=instance.follower_id)
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    bump(Profile, 'follower_count', -1, user_id=instance.following_id)
+    bump(Profile, 'following_count', -1, user_id=instance.follower_id)
+
+# Signals to count comment reactions. Django sends no post_delete for the auto-created
+# through rows, so removals are counted from m2m_changed before the rows go, and
+# a deleted user's reactions are uncounted before the cascade removes them.
+REACTION_COUNTERS = {
+    Comment.likes.through: 'like_count',
+    Comment.dislikes.through: 'dislike_count',
+}
+
+@receiver(m2m_changed, sender=Comment.likes.through)
+@receiver(m2m_changed, sender=Comment.dislikes.through)
+def count_reactions(sender, instance, action, reverse, pk_set, **kwargs):
+    field = REACTION_COUNTERS[sender]
+    if action == 'post_add' and pk_set:
+        # pk_set only holds the ids that were actually added
+        if reverse:
+            bump(Comment, field, 1, pk__in=pk_set)  # user.liked_photos.add(...)
+        else:
+            bump(Comment, field, len(pk_set), pk=instance.pk)
+    elif action in ('pre_remove', 'pre_clear'):
+        # pk_set can name rows that do not exist, so count what will really be deleted
+        rows = sender.objects.filter(**{'user' if reverse else 'comment': instance})
+        if action == 'pre_remove':
+            rows = rows.filter(**{'comment_id__in' if reverse else 'user_id__in': pk_set})
+        if reverse:
+            bump(Comment, field, -1, pk__in=list(rows.values_list('comment_id', flat=True)))
+        else:
+            removed = rows.count()
+            if removed:
+                bump(Comment, field, -removed, pk=instance.pk)
+
+@receiver(pre_delete, sender=User)
+def uncount_user_reactions(sender, instance, **kwargs):
+    for through, field in REACTION_COUNTERS.items():
+        bump(Comment, field, -1, pk__in=list(through.objects.filter(user=instance).values_list('comment_id', flat=True)))
+
+
+# Signals to invalidate cached API responses. Each write bumps only the
+# namespaces whose JSON it changes, see core/response_cache.py.
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post(sender, instance, **kwargs):
+    response_cache.bump('posts', f'post:{instance.id}')
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def invalidate_like(sender, instance, **kwargs):
+    response_cache.bump('posts', f'post:{instance.post_id}')
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment(sender, instance, **kwargs):
+    # comment_count on the post changes too
+    response_cache.bump('comments', f'comments:{instance.post_id}', 'posts', f'post:{instance.post_id}')
+
+@receiver(m2m_changed, sender=Comment.likes.through)
+@receiver(m2m_changed, sender=Comment.dislikes.through)
+def invalidate_reactions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            response_cache.bump('comments', f'comments:{instance.post_id}')
+        return
+    # user.liked_photos changed, find the posts of the comments involved
+    if action == 'post_add':
+        comments = Comment.objects.filter(pk__in=pk_set or [])
+    elif action in ('pre_remove', 'pre_clear'):
+        comments = Comment.objects.filter(pk__in=sender.objects.filter(user=instance).values('comment_id'))
+        if action == 'pre_remove':
+            comments = comments.filter(pk__in=pk_set)
+    else:
+        return
+    post_ids = set(comments.values_list('post_id', flat=True))
+    response_cache.bump('comments', *[f'comments:{post_id}' for post_id in post_ids])
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow(sender, instance, **kwargs):
+    # follower and following counts change on both profiles
+    usernames = User.objects.filter(pk__in=[instance.follower_id, instance.following_id]).values_list('username', flat=True)
+    response_cache.bump('profiles', *[f'profile:{username}' for username in usernames])
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_profile(sender, instance, **kwargs):
+    username = User.objects.filter(pk=instance.user_id).values_list('username', flat=True).first()
+    response_cache.bump('profiles', *([f'profile:{username}'] if username else []))
@@ -0,0 +1,200 @@
+import logging
+import os
+import random
+import socket
+import time
+import traceback
+import uuid
+import zlib
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Job
+
+# Background job queue stored in the main database, no broker needed.
+# Functions decorated with @task are queued with defer(fn, *args), which writes a
+# Job row inside the caller's transaction, so a rolled back request never leaves a
+# job behind. manage.py runworker claims and runs them.
+#
+# Claiming:
+#   postgresql - SELECT ... FOR UPDATE SKIP LOCKED, workers never wait on each other's rows
+#   other      - a conditional UPDATE that only takes rows still queued, safe without row locks
+# Queues with a concurrency limit in JOB_QUEUES count their running jobs before
+# claiming, under a per-queue advisory lock on PostgreSQL (SQLite serializes writers).
+#
+# A failing job is retried with exponential backoff until max_attempts, then kept
+# as FAILED with its last error. Finished jobs are deleted, one query per batch.
+# Delivery is at least once: a job whose worker dies is run again after TIMEOUT.
+
+QUEUES = getattr(settings, 'JOB_QUEUES', {'default': {}})
+MAX_ATTEMPTS = getattr(settings, 'JOB_MAX_ATTEMPTS', 5)
+BACKOFF = getattr(settings, 'JOB_RETRY_BACKOFF', 5)  # Seconds before the first retry, doubled for each attempt
+BACKOFF_MAX = getattr(settings, 'JOB_RETRY_BACKOFF_MAX', 600)
+TIMEOUT = getattr(settings, 'JOB_TIMEOUT', 600)  # Running jobs older than this are assumed lost and queued again
+
+logger = logging.getLogger(__name__)
+
+
+def task(queue='default', max_attempts=None):
+    # Marks a module level function as a job, its arguments must be JSON serializable
+    def decorate(fn):
+        fn.task_name = f'{fn.__module__}.{fn.__qualname__}'
+        fn.queue = queue
+        fn.max_attempts = max_attempts or MAX_ATTEMPTS
+        return fn
+    return decorate
+
+
+def defer(fn, *args, run_at=None):
+    # With BACKGROUND_TASKS_EAGER the job runs inline once the transaction commits
+    if getattr(settings, 'BACKGROUND_TASKS_EAGER', False):
+        transaction.on_commit(lambda: fn(*args))
+        return None
+    return Job.objects.create(queue=fn.queue, name=fn.task_name, args=list(args),
+                              max_attempts=fn.max_attempts, run_at=run_at or timezone.now())
+
+def defer_many(fn, arg_lists, batch_size=1000):
+    now = timezone.now()
+    return Job.objects.bulk_create(
+        (Job(queue=fn.queue, name=fn.task_name, args=list(args), max_attempts=fn.max_attempts, run_at=now)
+         for args in arg_lists),
+        batch_size=batch_size,
+    )
+
+
+def concurrency(queue):
+    return (QUEUES.get(queue) or {}).get('concurrency')
+
+def backoff(attempts):
+    # 5s, 10s, 20s ... capped, with jitter so retries of a burst do not line up
+    return min(BACKOFF * 2 ** max(attempts - 1, 0), BACKOFF_MAX) * random.uniform(0.8, 1.2)
+
+
+def lock_queue(queue):
+    # Serializes claims on a limited queue until the transaction ends
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [zlib.crc32(f'job:{queue}'.encode())])
+
+def claim(queues, worker, limit=1):
+    # Marks up to limit runnable jobs as RUNNING for this worker and returns them
+    now = timezone.now()
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    ids = []
+    for queue in queues:
+        slots = limit - len(ids)
+        if slots <= 0:
+            break
+        with transaction.atomic():
+            cap = concurrency(queue)
+            if cap:
+                lock_queue(queue)
+                slots = min(slots, cap - Job.objects.filter(queue=queue, state=Job.RUNNING).count())
+                if slots <= 0:
+                    continue
+            runnable = Job.objects.filter(queue=queue, state=Job.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+            if skip_locked:
+                runnable = runnable.select_for_update(skip_locked=True)
+            candidates = list(runnable.values_list('id', flat=True)[:slots])
+            if not candidates:
+                continue
+            Job.objects.filter(id__in=candidates, state=Job.QUEUED).update(
+                state=Job.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1)
+            # Without row locks another worker may have taken some of them first
+            ids.extend(Job.objects.filter(id__in=candidates, state=Job.RUNNING, locked_by=worker, locked_at=now)
+                       .values_list('id', flat=True))
+    return list(Job.objects.filter(id__in=ids).order_by('run_at', 'id')) if ids else []
+
+
+def run_job(job):
+    # Returns 'done', 'retry' or 'failed'. Done jobs are left for the caller to delete
+    try:
+        fn = import_string(job.name)
+        if getattr(fn, 'task_name', None) != job.name:
+            raise ImportError(f"{job.name} is not a task")
+    except ImportError as error:
+        return fail(job, error, retry=False)
+    try:
+        fn(*job.args)
+    except Exception as error:
+        logger.warning("Job %s (%s) failed on attempt %s: %s", job.id, job.name, job.attempts, error)
+        return fail(job, error)
+    return 'done'
+
+def fail(job, error, retry=True):
+    message = ''.join(traceback.format_exception_only(type(error), error)).strip()[:2000]
+    if retry and job.attempts < job.max_attempts:
+        state, outcome = Job.QUEUED, 'retry'
+        run_at = timezone.now() + timedelta(seconds=backoff(job.attempts))
+    else:
+        state, outcome, run_at = Job.FAILED, 'failed', job.run_at
+    Job.objects.filter(pk=job.pk).update(state=state, run_at=run_at, last_error=message, locked_by='', locked_at=None)
+    return outcome
+
+
+def requeue_stale(timeout=TIMEOUT):
+    # Jobs whose worker died mid-run are queued again, or failed once out of attempts
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    stale = Job.objects.filter(state=Job.RUNNING, locked_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        state=Job.FAILED, last_error='Worker lost', locked_by='', locked_at=None)
+    requeued = stale.update(state=Job.QUEUED, run_at=timezone.now(), locked_by='', locked_at=None)
+    return requeued + failed
+
+
+def stats():
+    # Jobs per queue and state, and how long the oldest runnable job has waited
+    now = timezone.now()
+    rows = Job.objects.values('queue', 'state').annotate(count=Count('id'), oldest=Min('run_at'))
+    result = {}
+    for row in rows:
+        queue = result.setdefault(row['queue'], {'queued': 0, 'running': 0, 'failed': 0, 'lag_seconds': 0.0})
+        queue[row['state']] = row['count']
+        if row['state'] == Job.QUEUED and row['oldest'] <= now:
+            queue['lag_seconds'] = round((now - row['oldest']).total_seconds(), 3)
+    return result
+
+
+class Worker:
+    # One claim-and-run loop. manage.py runworker starts one per thread
+
+    def __init__(self, queues, batch=1, name=None):
+        self.queues = list(queues)
+        self.batch = batch
+        # Claims are matched back by worker name, so every worker needs its own
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.counts = {'done': 0, 'retry': 0, 'failed': 0}
+        self.started = time.monotonic()
+
+    def run_once(self):
+        # Claims and runs one batch, returns how many jobs ran
+        jobs = claim(self.queues, self.name, self.batch)
+        done = []
+        for job in jobs:
+            outcome = run_job(job)
+            self.counts[outcome] += 1
+            if outcome == 'done':
+                done.append(job.id)
+        if done:
+            Job.objects.filter(id__in=done).delete()
+        return len(jobs)
+
+    def run(self, stop, burst=False, poll_interval=1.0):
+        # Runs until stop is set, or until nothing is runnable in burst mode
+        last_check = 0
+        while not stop.is_set():
+            if time.monotonic() - last_check > TIMEOUT / 10:
+                requeue_stale()
+                last_check = time.monotonic()
+            if self.run_once():
+                continue
+            if burst:
+                break
+            stop.wait(poll_interval)
+
+    def throughput(self):
+        elapsed = time.monotonic() - self.started
+        return sum(self.counts.values()) / elapsed if elapsed else 0.0
@@ -1,9 +1,34 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.db import connection, connections, transaction
+from django.conf import settings
+from django.core.cache import cache
+from django.test.utils import CaptureQueriesContext, override_settings
+import contextlib
+import io
+import json
+import logging
+import os
+import queue
+import runpy
+import tempfile
+import threading
+from PIL import Image
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
 from rest_framework.test import APITestCase
 from rest_framework import status
-from rest_framework_simplejwt.tokens import RefreshToken
-from .models import Post, Comment, Follow
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from .models import Profile, Post, Comment, Follow, Like, TimelineEntry, Job, ThrottleBucket, FollowSuggestion
+from . import authentication, counters, denylist, instrumentation, log, media, purge, replicas, response_cache, search, seed, services, sessions, suggestions, tasks, throttling, timeline
+from unittest import SkipTest, mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import F
+from datetime import timedelta
+from django.utils import timezone
 
 # Create your tests here.
 class BaseTestCase(APITestCase):
@@ -73,3 +98,1465 @@ class BaseTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         # confirm at least one post is returned in paginated results
         self.assertTrue(len(response.data['results']) >= 1)
+
+
+# Tests for the pages, these render through the service layer without a running API server
+class PageViewTestCase(APITestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass1234')
+        self.user2 = User.objects.create_user(username='user2', password='pass5678')
+        self.post = Post.objects.create(uploader=self.user2, caption='Page post')
+        self.client.force_login(self.user1)
+
+    # Test case for the feed page listing posts from followed users
+    def test_feed_page_lists_posts(self):
+        Follow.objects.create(follower=self.user1, following=self.user2)
+        response = self.client.get('/feed/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, 'Page post')
+
+    # Test case for the profile and post detail pages
+    def test_profile_and_post_detail_pages(self):
+        response = self.client.get('/profile/user2/')
+        self.assertContains(response, 'Page post')
+        Comment.objects.create(user=self.user1, post=self.post, content='Nice one')
+        response = self.client.get(f'/post/{self.post.id}/')
+        self.assertContains(response, 'Nice one')
+
+    # Test case for the async pages served through the ASGI handler
+    async def test_pages_over_asgi(self):
+        await Follow.objects.acreate(follower=self.user1, following=self.user2)
+        await Comment.objects.acreate(user=self.user1, post=self.post, content='Async comment')
+        await self.async_client.aforce_login(self.user1)
+        for url, text in [('/feed/', 'Page post'), ('/profile/user2/', 'Page post'), (f'/post/{self.post.id}/', 'Async comment')]:
+            response = await self.async_client.get(url)
+            self.assertContains(response, text)
+        response = await self.async_client.get('/profile/nobody/')
+        self.assertContains(response, 'Profile not found')
+        response = await self.async_client.post('/profile/user2/')
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(await Follow.objects.filter(follower=self.user1, following=self.user2).aexists())
+
+    # Test case for adding a comment from the page
+    def test_add_comment_page(self):
+        response = self.client.post(f'/post/{self.post.id}/comment/', {'content': 'From the page'})
+        self.assertRedirects(response, f'/post/{self.post.id}/', fetch_redirect_response=False)
+        self.assertTrue(Comment.objects.filter(post=self.post, user=self.user1, content='From the page').exists())
+
+    # Test case for following and unfollowing from the profile page
+    def test_follow_toggle_from_profile(self):
+        self.client.post('/profile/user2/')
+        self.assertTrue(Follow.objects.filter(follower=self.user1, following=self.user2).exists())
+        self.client.post('/profile/user2/')
+        self.assertFalse(Follow.objects.filter(follower=self.user1, following=self.user2).exists())
+
+    # Test case for editing your own profile
+    def test_edit_profile_page(self):
+        response = self.client.post('/edit_profile/', {'bio': 'Updated bio'})
+        self.assertRedirects(response, '/profile/user1/', fetch_redirect_response=False)
+        self.user1.profile.refresh_from_db()
+        self.assertEqual(self.user1.profile.bio, 'Updated bio')
+
+
+# Tests for the fan-out on write home timeline
+class TimelineTestCase(APITestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass1234')
+        self.user2 = User.objects.create_user(username='user2', password='pass5678')
+        self.user3 = User.objects.create_user(username='user3', password='pass9012')
+        Follow.objects.create(follower=self.user1, following=self.user2)
+
+    # Test case for a new post being pushed to the author and their followers
+    def test_post_is_pushed_to_followers(self):
+        post = Post.objects.create(uploader=self.user2, caption='Pushed')
+        self.assertTrue(TimelineEntry.objects.filter(user=self.user1, post=post).exists())
+        self.assertTrue(TimelineEntry.objects.filter(user=self.user2, post=post).exists())
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user3, post=post).exists())
+
+    # Test case for following and unfollowing updating the timeline
+    def test_follow_backfills_and_unfollow_removes(self):
+        post = Post.objects.create(uploader=self.user3, caption='Older post')
+        Follow.objects.create(follower=self.user1, following=self.user3)
+        self.assertIn(post, timeline.timeline_posts(self.user1))
+        Follow.objects.filter(follower=self.user1, following=self.user3).delete()
+        self.assertNotIn(post, timeline.timeline_posts(self.user1))
+
+    # Test case for posts from high fan-out accounts being pulled at read time
+    def test_high_fanout_posts_are_pulled(self):
+        with mock.patch.object(timeline, 'FANOUT_LIMIT', 0):
+            post = Post.objects.create(uploader=self.user2, caption='Pulled')
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user1, post=post).exists())
+        self.assertEqual(timeline.timeline_posts(self.user1), [post])
+
+    # Test case for posts published while high fan-out being pushed once the author drops under the limit
+    def test_high_fanout_posts_backfilled_when_flag_drops(self):
+        with mock.patch.object(timeline, 'FANOUT_LIMIT', 0):
+            pulled = Post.objects.create(uploader=self.user2, caption='Pulled')
+        with self.settings(BACKGROUND_TASKS_EAGER=True), self.captureOnCommitCallbacks(execute=True):
+            pushed = Post.objects.create(uploader=self.user2, caption='Pushed')
+        self.assertFalse(Profile.objects.get(user=self.user2).is_high_fanout)
+        self.assertEqual(set(TimelineEntry.objects.filter(user=self.user1).values_list('post_id', flat=True)), {pulled.id, pushed.id})
+        self.assertEqual(timeline.timeline_posts(self.user1), [pushed, pulled])
+
+    # Test case for the timeline being trimmed to its maximum length
+    def test_timeline_is_trimmed(self):
+        posts = [Post.objects.create(uploader=self.user2, caption=f'Post {i}') for i in range(5)]
+        timeline.trim_timeline(self.user1.id, max_length=3)
+        self.assertEqual(timeline.timeline_posts(self.user1), posts[:1:-1])
+
+    # Test case for the timeline API endpoint and the backfill command
+    def test_timeline_endpoint_and_backfill_command(self):
+        post = Post.objects.create(uploader=self.user2, caption='Timeline post')
+        TimelineEntry.objects.all().delete()
+        call_command('backfill_timeline', stdout=mock.MagicMock())
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user1).access_token}")
+        response = self.client.get('/api/posts/timeline/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data['results']], [post.id])
+
+
+# Tests for the keyset cursor pagination
+class CursorPaginationTestCase(APITestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass1234')
+        self.posts = [Post.objects.create(uploader=self.user1, caption=f'Post {i}') for i in range(15)]
+        self.client.force_login(self.user1)
+
+    # Test case for walking every page without skipping or repeating posts while new ones arrive
+    def test_pages_are_stable_under_inserts(self):
+        response = self.client.get('/api/posts/')
+        self.assertNotIn('count', response.data)
+        seen = [item['id'] for item in response.data['results']]
+        Post.objects.create(uploader=self.user1, caption='Arrived late')
+        response = self.client.get(response.data['next'])
+        seen += [item['id'] for item in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(seen, [post.id for post in reversed(self.posts)])
+
+        # The previous link leads back to the first page
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([item['id'] for item in response.data['results']], seen[:10])
+
+    # Test case for a malformed cursor
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/posts/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    # Test case for the pages following the next cursor
+    def test_profile_page_follows_next_cursor(self):
+        response = self.client.get('/profile/user1/')
+        self.assertContains(response, 'Post 14')
+        self.assertNotContains(response, 'Post 4<')
+        response = self.client.get('/profile/user1/', {'cursor': response.context['next_cursor']})
+        self.assertContains(response, 'Post 4<')
+        self.assertIsNone(response.context['next_cursor'])
+
+
+# Tests for the denormalized counters
+class CounterTestCase(APITestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass1234')
+        self.user2 = User.objects.create_user(username='user2', password='pass5678')
+        self.post = Post.objects.create(uploader=self.user1, caption='Counted')
+
+    def counts(self, obj, *fields):
+        obj.refresh_from_db()
+        return tuple(getattr(obj, field) for field in fields)
+
+    # Test case for post like and comment counts following creates, deletes and cascades
+    def test_post_counters(self):
+        Like.objects.create(user=self.user1, post=self.post)
+        Like.objects.create(user=self.user2, post=self.post)
+        Comment.objects.create(user=self.user2, post=self.post, content='Hi')
+        self.assertEqual(self.counts(self.post, 'like_count', 'comment_count'), (2, 1))
+        Like.objects.filter(post=self.post).delete()
+        self.assertEqual(self.counts(self.post, 'like_count', 'comment_count'), (0, 1))
+        self.user2.delete()  # cascades to the comment
+        self.assertEqual(self.counts(self.post, 'like_count', 'comment_count'), (0, 0))
+
+    # Test case for comment reaction counts
+    def test_comment_reaction_counters(self):
+        comment = Comment.objects.create(user=self.user2, post=self.post, content='Hi')
+        comment.likes.add(self.user1, self.user2)
+        comment.likes.add(self.user1)  # already there, not counted again
+        self.user1.disliked_photos.add(comment)
+        self.assertEqual(self.counts(comment, 'like_count', 'dislike_count'), (2, 1))
+        self.assertEqual(comment.total_likes(), 2)
+        comment.likes.remove(self.user1)
+        comment.dislikes.clear()
+        self.assertEqual(self.counts(comment, 'like_count', 'dislike_count'), (1, 0))
+        # Deleting a user uncounts their reactions
+        user3 = User.objects.create_user(username='user3', password='pass9012')
+        comment.likes.add(user3)
+        user3.delete()
+        self.assertEqual(self.counts(comment, 'like_count', 'dislike_count'), (1, 0))
+
+    # Test case for follower and following counts
+    def test_follow_counters(self):
+        Follow.objects.create(follower=self.user1, following=self.user2)
+        self.assertEqual(self.counts(self.user2.profile, 'follower_count', 'following_count'), (1, 0))
+        self.assertEqual(self.counts(self.user1.profile, 'follower_count', 'following_count'), (0, 1))
+        self.user1.delete()
+        self.assertEqual(self.counts(self.user2.profile, 'follower_count', 'following_count'), (0, 0))
+
+    # Test case for the repair command fixing drift
+    def test_repair_counters_command(self):
+        Like.objects.create(user=self.user2, post=self.post)
+        Post.objects.filter(pk=self.post.pk).update(like_count=7)
+        call_command('repair_counters', '--dry-run', stdout=mock.MagicMock())
+        self.assertEqual(self.counts(self.post, 'like_count'), (7,))
+        call_command('repair_counters', stdout=mock.MagicMock())
+        self.assertEqual(self.counts(self.post, 'like_count'), (1,))
+
+    # Test case for the counts in the API response
+    def test_counts_in_serializer(self):
+        Like.objects.create(user=self.user2, post=self.post)
+        response = self.client.get(f'/api/posts/{self.post.id}/')
+        self.assertEqual(response.data['like_count'], 1)
+        self.assertEqual(response.data['comment_count'], 0)
+
+
+# Tests for liking and unliking posts
+class LikeTestCase(APITestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass1234')
+        self.user2 = User.objects.create_user(username='user2', password='pass5678')
+        self.post = Post.objects.create(uploader=self.user2, caption='Likeable')
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user1).access_token}")
+
+    # Test case for like and unlike being idempotent and returning the new state
+    def test_like_and_unlike_are_idempotent(self):
+        for _ in range(2):
+            response = self.client.post(f'/api/posts/{self.post.id}/like/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data, {'liked': True, 'like_count': 1})
+        for _ in range(2):
+            response = self.client.post(f'/api/posts/{self.post.id}/unlike/')
+            self.assertEqual(response.data, {'liked': False, 'like_count': 0})
+        response = self.client.post('/api/posts/999999/like/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    # Test case for a like change being an INSERT or DELETE plus one UPDATE returning the count
+    def test_like_is_two_statements(self):
+        for liked, first in ((True, 'INSERT'), (False, 'DELETE')):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(services.set_like(self.user1, self.post.id, liked), (liked, int(liked)))
+            statements = [q['sql'] for q in queries if 'SAVEPOINT' not in q['sql']]
+            self.assertEqual([sql.split()[0] for sql in statements], [first, 'UPDATE'])
+            self.assertIn('RETURNING', statements[1])
+
+    # Test case for the cached post changing only once the like commits
+    def test_like_bumps_cache_after_commit(self):
+        cache.clear()
+        url = f'/api/posts/{self.post.id}/'
+        self.assertEqual(self.client.get(url).data['like_count'], 0)
+        with self.captureOnCommitCallbacks() as callbacks:
+            services.set_like(self.user1, self.post.id, True)
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')  # Not bumped before commit
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        response = self.client.get(url)
+        self.assertEqual((response['X-Cache'], response.data['like_count']), ('MISS', 1))
+
+    # Test case for the toggle from the pages
+    def test_toggle_like_view(self):
+        self.client.force_login(self.user1)
+        self.client.post(f'/post/{self.post.id}/like/')
+        self.assertTrue(Like.objects.filter(user=self.user1, post=self.post).exists())
+        self.client.post(f'/post/{self.post.id}/like/')
+        self.assertFalse(Like.objects.filter(user=self.user1, post=self.post).exists())
+
+
+# Stress test for many threads liking one hot post at the same time.
+# The SQLite test database is a file (see settings), so each thread has its own connection.
+class LikeConcurrencyTestCase(TransactionTestCase):
+    threads = 8
+    rounds = 10
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise SkipTest('An in-memory SQLite database is shared by every thread')
+
+    def test_concurrent_likes_on_hot_post(self):
+        users = [User.objects.create_user(username=f'liker{i}', password='pass1234') for i in range(self.threads)]
+        post = Post.objects.create(uploader=users[0], caption='Hot post')
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def hammer(user):
+            try:
+                barrier.wait()
+                for i in range(self.rounds):
+                    # Double clicks: the same like twice, then the same unlike twice
+                    services.set_like(user, post.id, True)
+                    services.set_like(user, post.id, True)
+                    if i < self.rounds - 1:
+                        services.set_like(user, post.id, False)
+                        services.set_like(user, post.id, False)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=hammer, args=(user,)) for user in users]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        post.refresh_from_db()
+        self.assertEqual(post.like_count, self.threads)
+        self.assertEqual(Like.objects.filter(post=post).count(), self.threads)
+
+
+# Tests for full-text search
+class SearchTestCase(APITestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='alice', password='pass1234')
+        self.user2 = User.objects.create_user(username='bob', password='pass5678')
+        self.user2.profile.bio = 'Mountain photographer'
+        self.user2.profile.save()
+        self.post = Post.objects.create(uploader=self.user1, caption='Sunset over the harbour')
+
+    # Test case for matching usernames, bios and captions with prefixes
+    def test_search_users_and_posts(self):
+        self.assertEqual(search.search_users('ali'), [self.user1])
+        self.assertEqual(search.search_users('photo'), [self.user2])
+        self.assertEqual(search.search_posts('harb'), [self.post])
+        self.assertEqual(search.search_posts('sunset harbour'), [self.post])
+        self.assertEqual(search.search_posts('sunset*) "('), [self.post])
+
+    # Test case for the index following updates and deletes
+    def test_index_is_kept_current(self):
+        self.post.caption = 'Sunrise'
+        self.post.save()
+        self.assertEqual(search.search_posts('harbour'), [])
+        self.assertEqual(search.search_posts('sunrise'), [self.post])
+        self.post.delete()
+        self.assertEqual(search.search_posts('sunrise'), [])
+
+    # Test case for the search page with paging
+    def test_search_page(self):
+        for i in range(12):
+            Post.objects.create(uploader=self.user1, caption=f'Harbour view {i}')
+        response = self.client.get('/search/', {'q': 'harbour'})
+        self.assertEqual(len(response.context['posts']), 10)
+        self.assertEqual(response.context['next_page'], 2)
+        response = self.client.get('/search/', {'q': 'harbour', 'page': 2})
+        self.assertEqual(len(response.context['posts']), 3)
+        self.assertIsNone(response.context['next_page'])
+
+    # Test case for the rebuild command
+    def test_rebuild_search_index_command(self):
+        search.remove(search.POST, self.post.id)
+        call_command('rebuild_search_index', stdout=mock.MagicMock())
+        self.assertEqual(search.search_posts('sunset'), [self.post])
+
+
+# Query budget tests. Every endpoint must run a fixed number of queries no matter
+# how many rows are on the page, so an N+1 regression fails here.
+@override_settings(SESSION_ENGINE='core.sessions')
+class QueryBudgetTestCase(APITestCase):
+    # Maximum queries per request. API requests spend one on the shared throttle
+    # (the user comes from the JWT claims, with JWT_STATELESS_AUTH turned on below,
+    # without it they spend one more), pages spend one on the logged in user (the
+    # session is read from the cache, the engine settings pick with a shared cache).
+    budgets = {
+        '/api/users/': 2,
+        '/api/profiles/': 2,
+        '/api/profiles/author/': 2,
+        '/api/posts/': 2,
+        '/api/posts/{post}/': 2,
+        '/api/posts/timeline/': 3,
+        '/api/comments/?post={post}': 4,
+        '/api/comments/{comment}/': 4,
+        '/api/follows/': 2,
+        '/api/follows/{follow}/': 2,
+        '/feed/': 3,
+        '/profile/author/': 3,
+        '/post/{post}/': 5,
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='reader', password='pass1234')
+        self.author = User.objects.create_user(username='author', password='pass5678')
+        self.post = Post.objects.create(uploader=self.author, caption='Budget post')
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {authentication.RefreshToken.for_user(self.reader).access_token}")
+        self.client.force_login(self.reader)
+        self.add_rows(1)
+        patcher = mock.patch.object(authentication, 'STATELESS', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Load the JTI denylist now so its refresh is not counted against an endpoint
+        patcher = mock.patch.object(denylist.denylist, 'refresh_interval', 3600)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        denylist.denylist.refresh(force=True)
+
+    def add_rows(self, count):
+        # Each round adds a user who follows, posts, comments and reacts
+        for i in range(count):
+            user = User.objects.create_user(username=f'extra{User.objects.count()}', password='pass1234')
+            follow = Follow.objects.create(follower=self.reader, following=user)
+            Follow.objects.create(follower=user, following=self.author)
+            Post.objects.create(uploader=self.author, caption=f'Author post {i}')
+            Post.objects.create(uploader=user, caption=f'Extra post {i}')
+            comment = Comment.objects.create(user=user, post=self.post, content=f'Comment {i}')
+            comment.likes.add(user, self.reader)
+            comment.dislikes.add(self.author)
+        self.comment = comment
+        self.follow = follow
+
+    def count_queries(self):
+        counts = {}
+        for url, budget in self.budgets.items():
+            url = url.format(post=self.post.id, comment=self.comment.id, follow=self.follow.id)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+            counts[url] = len(queries)
+        return counts
+
+    def test_query_counts_do_not_grow_with_page_size(self):
+        small = self.count_queries()
+        self.add_rows(12)
+        full = self.count_queries()
+        for (url, budget), count in zip(self.budgets.items(), full.values()):
+            self.assertLessEqual(count, budget, f'{url} ran {count} queries')
+        self.assertEqual(list(small.values()), list(full.values()))
+
+
+# Query plan regression tests. Every read behind the API endpoints and pages is
+# run against a seeded dataset and EXPLAINed, a full table scan or a sort step
+# means a query lost its index and fails here.
+class QueryPlanTestCase(APITestCase):
+    urls = [
+        '/api/users/',
+        '/api/profiles/',
+        '/api/profiles/{username}/',
+        '/api/posts/',
+        '/api/posts/?uploader__username={username}',
+        '/api/posts/{post}/',
+        '/api/posts/timeline/',
+        '/api/comments/',
+        '/api/comments/?post={post}',
+        '/api/comments/{comment}/',
+        '/api/follows/',
+        '/api/follows/{follow}/',
+        '/feed/',
+        '/profile/{username}/',
+        '/post/{post}/',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        # Bulk inserts skip the signals, the plans only need realistic table sizes
+        users = User.objects.bulk_create(User(username=f'user{i}', password='!') for i in range(200))
+        Profile.objects.bulk_create(Profile(user=user) for user in users)
+        posts = Post.objects.bulk_create(Post(uploader=users[i % 200], caption=f'Post {i}') for i in range(2000))
+        Follow.objects.bulk_create(Follow(follower=users[i], following=users[(i + 1 + k * 17) % 200])
+                                   for i in range(200) for k in range(7))
+        Comment.objects.bulk_create(Comment(user=users[i % 200], post=posts[i % 50], content=f'Comment {i}') for i in range(3000))
+        Like.objects.bulk_create(Like(user=users[i % 200], post=posts[i % 200 + i // 200]) for i in range(3000))
+        TimelineEntry.objects.bulk_create(TimelineEntry(user=users[0], post=post, created_at=post.created_at)
+                                          for post in posts[::4])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.reader, cls.author, cls.post = users[0], users[1], posts[0]
+        cls.comment = Comment.objects.filter(post=cls.post).first()
+        cls.follow = Follow.objects.first()
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {authentication.RefreshToken.for_user(self.reader).access_token}")
+        self.client.force_login(self.reader)
+        # The denylist refresh is periodic, not part of any request
+        patcher = mock.patch.object(denylist.denylist, 'refresh_interval', 3600)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        denylist.denylist.refresh(force=True)
+        if connection.vendor == 'postgresql':
+            # On tables this small a sequential scan can win on cost, only fail when no index path exists
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def explain(self, sql):
+        # The plan as a list of steps
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+                nodes, steps = [cursor.fetchone()[0][0]['Plan']], []
+                while nodes:
+                    node = nodes.pop()
+                    steps.append(f"{node['Node Type']} {node.get('Relation Name', '')}".strip())
+                    nodes.extend(node.get('Plans', []))
+                return steps
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    @staticmethod
+    def bad_steps(steps):
+        # SQLite: SCAN without an index is a full table scan, TEMP B-TREE is a sort
+        # PostgreSQL: Seq Scan and Sort nodes
+        return [step for step in steps if
+                (step.startswith('SCAN ') and 'INDEX' not in step) or 'TEMP B-TREE' in step
+                or step.startswith(('Seq Scan', 'Sort', 'Incremental Sort'))]
+
+    def selects(self, fn):
+        cache.clear()  # A cached response would run no queries
+        with CaptureQueriesContext(connection) as queries:
+            result = fn()
+        return result, [q['sql'] for q in queries if q['sql'].startswith('SELECT')]
+
+    def url_selects(self, url):
+        # The SELECTs behind url and behind its next page
+        response, sqls = self.selects(lambda: self.client.get(url))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+        data = getattr(response, 'data', None)
+        if isinstance(data, dict) and data.get('next'):
+            sqls += self.selects(lambda: self.client.get(data['next']))[1]
+        return sqls
+
+    def hot_reads(self):
+        # Reads outside the viewsets that run on every post or like
+        return {
+            'fan_out': lambda: list(Follow.objects.filter(following_id=self.author.id).values_list('follower_id', flat=True)),
+            'followers_page': lambda: list(Follow.objects.filter(following=self.author).order_by('-followed_at', '-id')[:10]),
+            'post_likers': lambda: list(Like.objects.filter(post=self.post).values_list('user_id', flat=True)),
+            'liked': lambda: Like.objects.filter(user=self.reader, post=self.post).exists(),
+        }
+
+    @skipUnlessDBFeature('supports_explaining_query_execution')
+    def test_hot_queries_use_indexes(self):
+        captured = []
+        for url in self.urls:
+            url = url.format(username=self.author.username, post=self.post.id,
+                             comment=self.comment.id, follow=self.follow.id)
+            captured += [(url, sql) for sql in self.url_selects(url)]
+        for name, read in self.hot_reads().items():
+            captured += [(name, sql) for sql in self.selects(read)[1]]
+
+        failures = []
+        for source, sql in captured:
+            steps = self.explain(sql)
+            if self.bad_steps(steps):
+                failures.append(f"{source}: {self.bad_steps(steps)}\n  {sql}\n  {steps}")
+        self.assertFalse(failures, '\n'.join(failures))
+
+
+# Tests for the API response cache
+class ResponseCacheTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='pass1234')
+        self.user2 = User.objects.create_user(username='user2', password='pass5678')
+        self.post = Post.objects.create(uploader=self.user1, caption='Cached post')
+        self.other = Post.objects.create(uploader=self.user2, caption='Other post')
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    # Test case for a repeated GET being served from the cache
+    def test_repeated_get_is_a_hit(self):
+        self.assertEqual(self.get('/api/posts/')['X-Cache'], 'MISS')
+        # Only the shared throttle runs, anonymous requests are checked by the user and anon scopes
+        with self.assertNumQueries(2):
+            response = self.get('/api/posts/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response_cache.stats()['hits'], 1)
+        # A different query string or auth scope is a different entry
+        self.assertEqual(self.get('/api/posts/?uploader__username=user1')['X-Cache'], 'MISS')
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user1).access_token}")
+        self.assertEqual(self.get('/api/posts/')['X-Cache'], 'MISS')
+
+    # Test case for writes invalidating only the affected entries
+    def test_writes_bump_affected_keys(self):
+        post_url = f'/api/posts/{self.post.id}/'
+        other_url = f'/api/posts/{self.other.id}/'
+        comments_url = f'/api/comments/?post={self.post.id}'
+        for url in (post_url, other_url, comments_url, '/api/profiles/user2/'):
+            self.get(url)
+
+        Like.objects.create(user=self.user2, post=self.post)
+        response = self.get(post_url)
+        self.assertEqual((response['X-Cache'], response.data['like_count']), ('MISS', 1))
+        self.assertEqual(self.get(other_url)['X-Cache'], 'HIT')
+
+        Comment.objects.create(user=self.user2, post=self.post, content='New comment')
+        response = self.get(comments_url)
+        self.assertEqual((response['X-Cache'], len(response.data['results'])), ('MISS', 1))
+
+        Follow.objects.create(follower=self.user1, following=self.user2)
+        response = self.get('/api/profiles/user2/')
+        self.assertEqual((response['X-Cache'], response.data['follower_count']), ('MISS', 1))
+
+    # Test case for a GET with a matching If-None-Match getting an empty 304
+    def test_conditional_get_not_modified(self):
+        comment = Comment.objects.create(user=self.user2, post=self.post, content='A comment')
+        urls = ['/api/posts/', f'/api/posts/{self.post.id}/', '/api/profiles/', '/api/profiles/user1/',
+                f'/api/comments/?post={self.post.id}', f'/api/comments/{comment.id}/']
+        for url in urls:
+            tag = self.get(url)['ETag']
+            cache.delete(f'{response_cache.PREFIX}:r:{tag[3:-1]}')  # The 304 must not need the cached body either
+            # Only the shared throttle runs, nothing is loaded or serialized
+            with self.assertNumQueries(2):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=tag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED, url)
+            self.assertEqual((response['ETag'], response.content), (tag, b''))
+
+    # Test case for If-None-Match: * only matching a resource that exists
+    def test_if_none_match_any(self):
+        url = f'/api/posts/{self.post.id}/'
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='*').status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='*').status_code, status.HTTP_304_NOT_MODIFIED)
+        self.post.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='*').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/posts/999999/', HTTP_IF_NONE_MATCH='*').status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    # Test case for the cache staying off when workers would each have their own locmem cache
+    def test_disabled_without_a_shared_cache(self):
+        with mock.patch.object(response_cache, 'ENABLED', False):
+            for _ in range(2):
+                response = self.get('/api/posts/')
+                self.assertNotIn('X-Cache', response)
+                self.assertNotIn('ETag', response)
+
+    # Test case for writes changing the ETag of the responses they change
+    def test_writes_change_etag(self):
+        post_url = f'/api/posts/{self.post.id}/'
+        post_tag, other_tag, profiles_tag = (self.get(url)['ETag'] for url in (
+            post_url, f'/api/posts/{self.other.id}/', '/api/profiles/'))
+        Like.objects.create(user=self.user2, post=self.post)
+        profile = self.user1.profile
+        profile.bio = 'New bio'
+        profile.save()
+
+        response = self.client.get(post_url, HTTP_IF_NONE_MATCH=post_tag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], post_tag)
+        response = self.client.get(f'/api/posts/{self.other.id}/', HTTP_IF_NONE_MATCH=other_tag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get('/api/profiles/', HTTP_IF_NONE_MATCH=profiles_tag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    # Test case for the cache working on the locmem, file and database backends
+    def test_cache_backends(self):
+        backends = {
+            'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'file': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tempfile.mkdtemp()},
+            'db': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'test_response_cache'},
+        }
+        for name, backend in backends.items():
+            with self.subTest(backend=name), override_settings(CACHES={'default': backend}):
+                if name == 'db':
+                    call_command('createcachetable', verbosity=0)
+                self.assertEqual(self.get('/api/posts/')['X-Cache'], 'MISS')
+                self.assertEqual(self.get('/api/posts/')['X-Cache'], 'HIT')
+                Post.objects.create(uploader=self.user1, caption=f'New on {name}')
+                response = self.get('/api/posts/')
+                self.assertEqual((response['X-Cache'], response.data['results'][0]['caption']), ('MISS', f'New on {name}'))
+
+
+def image_upload(size, mode='RGB', fmt='JPEG', name='photo.jpg'):
+    buffer = io.BytesIO()
+    Image.new(mode, size, (200, 30, 30, 128) if mode == 'RGBA' else (200, 30, 30)).save(buffer, fmt)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{fmt.lower()}')
+
+class MediaTestCase(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        settings = override_settings(MEDIA_STORAGE='local', MEDIA_ROOT=self.media_root, BACKGROUND_TASKS_EAGER=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user1 = User.objects.create_user(username='user1', password='pass1234')
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user1).access_token}")
+
+    def stored(self, url):
+        return os.path.join(self.media_root, url[len('/media/'):])
+
+    def upload_post(self, image, caption='Photo'):
+        # The media worker runs when the request's transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/posts/', {'caption': caption, 'image': image}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['media_state'], Post.PROCESSING)
+        return Post.objects.get(pk=response.data['id'])
+
+    # Test case for an upload producing every derivative in WebP and JPEG
+    def test_post_upload_creates_derivatives(self):
+        post = self.upload_post(image_upload((2400, 1200)))
+        response = self.client.get(f'/api/posts/{post.id}/')
+        self.assertEqual(response.data['media_state'], Post.READY)
+        derivatives = response.data['image_derivatives']
+        self.assertEqual({name: entry['width'] for name, entry in derivatives.items()}, {'thumb': 150, 'card': 320, 'full': 1080})
+        with Image.open(self.stored(derivatives['card']['webp'])) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (320, 160)))
+        with Image.open(self.stored(derivatives['full']['jpeg'])) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (1080, 540)))
+        self.assertEqual(response.data['image_srcset']['webp'].count('w,'), 2)
+        self.assertIn(f"{derivatives['thumb']['jpeg']} 150w", response.data['image_srcset']['jpeg'])
+        self.assertTrue(os.path.exists(self.stored('/media/' + str(Post.objects.get().image.public_id) + '.jpg')))
+        self.assertEqual(os.listdir(media.staging_path('')), [])
+
+    # Test case for small transparent images, which are never upscaled and lose their alpha in JPEG
+    def test_small_transparent_image(self):
+        name, derivatives = media.store_upload(image_upload((100, 40), 'RGBA', 'PNG', 'logo.png'), 'posts')
+        self.assertTrue(name.endswith('/original.png'))
+        self.assertEqual({entry['width'] for entry in derivatives.values()}, {100})
+        self.assertEqual(media.srcset(derivatives, 'webp'), f"{derivatives['thumb']['webp']} 100w")
+        with Image.open(self.stored(derivatives['thumb']['jpeg'])) as image:
+            self.assertEqual(image.mode, 'RGB')
+
+    # Test case for profile pictures, which are still processed in the request
+    def test_profile_picture(self):
+        # Stored by the media job after the request, the response still has the old picture
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/api/profiles/user1/', {'profile_picture': image_upload((600, 600))}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['picture_derivatives'], response.data['picture_srcset']), ({}, None))
+        self.assertNotIn('staged_picture', response.data)
+        response = self.client.get('/api/profiles/user1/')
+        self.assertEqual(response.data['picture_derivatives']['card']['width'], 320)
+        self.assertIn('webp', response.data['picture_srcset'])
+        self.assertEqual(Profile.objects.get(user=self.user1).staged_picture, '')
+        # Posts without an image are ready at once and have no srcset
+        response = self.client.post('/api/posts/', {'caption': 'Text only'}, format='multipart')
+        self.assertEqual((response.data['media_state'], response.data['image_srcset']), (Post.READY, None))
+
+    # Test case for invalid and oversized uploads being refused before they are staged
+    def test_invalid_uploads_fail(self):
+        uploads = [SimpleUploadedFile('fake.jpg', b'not an image', content_type='image/jpeg'), image_upload((400, 400))]
+        with mock.patch.object(media, 'MAX_UPLOAD_SIZE', 100):
+            for upload in uploads:
+                response = self.client.post('/api/posts/', {'caption': 'Bad', 'image': upload}, format='multipart')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn('image', response.data)
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(os.path.exists(media.staging_path('')))
+
+        # A staged file gone by the time the worker runs fails the post
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/posts/', {'caption': 'Gone', 'image': image_upload((40, 40))}, format='multipart')
+        post = Post.objects.get()
+        os.remove(media.staging_path(post.staged_upload))
+        callbacks[0]()
+        post.refresh_from_db()
+        self.assertEqual((post.media_state, post.image_derivatives, post.staged_upload), (Post.FAILED, {}, ''))
+
+    # Test case for a profile picture replaced before its job ran leaving no stored files
+    def test_superseded_profile_picture(self):
+        with self.captureOnCommitCallbacks() as first:
+            self.client.patch('/api/profiles/user1/', {'profile_picture': image_upload((300, 300))}, format='multipart')
+        with self.captureOnCommitCallbacks() as second:
+            self.client.patch('/api/profiles/user1/', {'profile_picture': image_upload((200, 200))}, format='multipart')
+        first[0]()
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'profiles')))
+        second[0]()
+        profile = Profile.objects.get(user=self.user1)
+        self.assertEqual(profile.picture_derivatives['full']['width'], 200)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'profiles'))), 1)
+        self.assertEqual(os.listdir(media.staging_path('')), [])
+
+    # Test case for a post deleted while its image was processed leaving no stored files
+    def test_post_deleted_during_processing(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post('/api/posts/', {'caption': 'Deleted', 'image': image_upload((400, 300))}, format='multipart')
+        post = Post.objects.get()
+        store = media.store
+
+        def store_then_delete(*args, **kwargs):
+            stored = store(*args, **kwargs)
+            Post.objects.filter(pk=post.pk).delete()
+            return stored
+
+        with mock.patch.object(media, 'store', store_then_delete):
+            self.assertIsNone(media.process_post(post.pk))
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'posts')), [])
+        self.assertEqual(os.listdir(media.staging_path('')), [])
+
+    # Test case for processing posts being left out of feeds until their media is ready
+    def test_processing_posts_are_hidden(self):
+        follower = User.objects.create_user(username='follower', password='pass1234')
+        Follow.objects.create(follower=follower, following=self.user1)
+        # Without the commit hook the worker has not run yet
+        response = self.client.post('/api/posts/', {'caption': 'Later', 'image': image_upload((400, 300))}, format='multipart')
+        post = Post.objects.get(pk=response.data['id'])
+        self.assertEqual(self.client.get('/api/posts/').data['results'], [])
+        self.assertEqual(timeline.timeline_posts(follower), [])
+        self.assertEqual(search.search_posts('Later'), [])
+
+        call_command('process_media', stdout=io.StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.media_state, Post.READY)
+        self.assertEqual([p['id'] for p in self.client.get('/api/posts/').data['results']], [post.id])
+        self.assertEqual(timeline.timeline_posts(follower), [post])
+
+
+# Tasks used by the job queue tests
+task_calls = []
+
+@tasks.task()
+def record_call(value):
+    task_calls.append(value)
+
+@tasks.task(max_attempts=2)
+def always_fails():
+    raise RuntimeError('boom')
+
+class JobQueueTestCase(APITestCase):
+    def setUp(self):
+        task_calls.clear()
+        self.worker = tasks.Worker(['default', 'media'], batch=10, name='test-worker')
+
+    # Test case for jobs being queued, claimed once and deleted when done
+    def test_defer_and_run(self):
+        for value in range(3):
+            tasks.defer(record_call, value)
+        self.assertEqual(Job.objects.filter(state=Job.QUEUED).count(), 3)
+        self.assertEqual(self.worker.run_once(), 3)
+        self.assertEqual(task_calls, [0, 1, 2])
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(self.worker.run_once(), 0)
+
+        # Delayed jobs wait for run_at, unknown task names fail without retries
+        tasks.defer(record_call, 'later', run_at=timezone.now() + timedelta(minutes=5))
+        Job.objects.create(name='core.tests.missing_task')
+        self.assertEqual(self.worker.run_once(), 1)
+        self.assertEqual(Job.objects.get(name='core.tests.missing_task').state, Job.FAILED)
+
+    # Test case for retries with backoff, then FAILED with the last error
+    def test_retry_with_backoff(self):
+        job = tasks.defer(always_fails)
+        with self.assertLogs('core.tasks', 'WARNING'):
+            self.worker.run_once()
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=3))
+        self.assertIn('RuntimeError: boom', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('core.tasks', 'WARNING'):
+            self.worker.run_once()
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts), (Job.FAILED, 2))
+        self.assertEqual(self.worker.counts, {'done': 0, 'retry': 1, 'failed': 1})
+
+    # Test case for per-queue concurrency limits and lost jobs being requeued
+    def test_concurrency_limit_and_stale_jobs(self):
+        with mock.patch.dict(tasks.QUEUES, {'media': {'concurrency': 1}}):
+            Job.objects.create(queue='media', name=record_call.task_name, args=['running'], state=Job.RUNNING,
+                               locked_by='other', locked_at=timezone.now() - timedelta(hours=1), attempts=1)
+            Job.objects.create(queue='media', name=record_call.task_name, args=['waiting'])
+            self.assertEqual(tasks.claim(['media'], 'test-worker', 10), [])
+            self.assertEqual(tasks.stats()['media']['running'], 1)
+
+            self.assertEqual(tasks.requeue_stale(), 1)
+            self.assertEqual(self.worker.run_once(), 1)
+            self.assertEqual(self.worker.run_once(), 1)
+        self.assertEqual(sorted(task_calls), ['running', 'waiting'])
+
+    # Test case for post images going through the queue and manage.py runworker
+    def test_runworker_processes_media(self):
+        with override_settings(MEDIA_STORAGE='local', MEDIA_ROOT=tempfile.mkdtemp()):
+            self.client.force_authenticate(User.objects.create_user(username='user1', password='pass1234'))
+            response = self.client.post('/api/posts/', {'caption': 'Queued', 'image': image_upload((400, 300))}, format='multipart')
+            job = Job.objects.get()
+            self.assertEqual((job.queue, job.args), ('media', [response.data['id']]))
+
+            out = io.StringIO()
+            call_command('job_stats', stdout=out)
+            self.assertIn('media: queued 1', out.getvalue())
+            call_command('runworker', '--burst', stdout=out)
+        self.assertIn('done: 1', out.getvalue())
+        self.assertEqual(Post.objects.get().media_state, Post.READY)
+
+    # Test case for logout blacklisting the refresh token without a job
+    def test_logout_blacklists_inline(self):
+        user = User.objects.create_user(username='user1', password='pass1234')
+        self.client.login(username='user1', password='pass1234')
+        session = self.client.session
+        session['refresh_token'] = str(RefreshToken.for_user(user))
+        session.save()
+        self.assertEqual(self.client.get('/logout/').status_code, 302)
+        self.assertFalse(Job.objects.exists())  # The token never lands in Job.args
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+
+
+# Tests for the friend-of-friend follow suggestions
+class SuggestionTestCase(APITestCase):
+    def setUp(self):
+        self.users = {name: User.objects.create_user(username=name, password='pass1234') for name in 'abcdef'}
+        for follower, following in ['ab', 'ac', 'bd', 'be', 'cd', 'ca', 'db']:
+            Follow.objects.create(follower=self.users[follower], following=self.users[following])
+
+    # Test case for the CSR layout and the mutual follow scores
+    def test_graph_and_scores(self):
+        graph = suggestions.FollowGraph.from_edges([3, 7, 9, 20], [(3, 7), (3, 20), (9, 3), (9, 7), (9, 20)])
+        self.assertEqual(list(graph.offsets), [0, 2, 2, 5, 5])
+        self.assertEqual(list(graph.following(2)), [0, 1, 3])
+        self.assertEqual(graph.suggest(1), [])
+        self.assertEqual(graph.suggest(0), [])
+
+        graph = suggestions.FollowGraph.from_db()
+        index = {user.id: i for i, user in enumerate(sorted(self.users.values(), key=lambda user: user.id))}
+        # a follows b and c, both follow d, only b follows e, a itself and b are left out
+        u = self.users
+        self.assertEqual(graph.suggest(index[u['a'].id]), [(u['d'].id, 2), (u['e'].id, 1)])
+        self.assertEqual(graph.suggest(index[u['a'].id], k=1), [(u['d'].id, 2)])
+        # c follows d and a, who both follow b
+        self.assertEqual(graph.suggest(index[u['c'].id]), [(u['b'].id, 2)])
+
+    # Test case for follows of users the graph does not know, deleted between the two queries
+    def test_graph_skips_unknown_users(self):
+        graph = suggestions.FollowGraph.from_edges([1, 2, 3], [(1, 2), (2, 3), (2, 4), (3, 1)])
+        self.assertEqual(list(graph.offsets), [0, 1, 2, 3])
+        self.assertEqual(graph.suggest(0), [(3, 1)])
+        graph = suggestions.FollowGraph.from_edges([1, 3], [(1, 2), (1, 3), (2, 3)])
+        self.assertEqual(list(graph.offsets), [0, 1, 1])
+        self.assertEqual(list(graph.following(0)), [1])
+
+    # Test case for a user deleted after the graph was read not aborting the build
+    def test_build_skips_deleted_users(self):
+        graph = suggestions.FollowGraph.from_db()
+        self.users['a'].delete()
+        self.assertEqual(suggestions.build(graph=graph, batch_size=2), 2)
+        self.assertEqual(sorted(FollowSuggestion.objects.values_list('user__username', flat=True)), ['c', 'd'])
+
+    # Test case for the batch build and the endpoint
+    def test_build_command_and_endpoint(self):
+        out = io.StringIO()
+        call_command('build_suggestions', stdout=out)
+        self.assertIn('Loaded 6 users and 7 follows', out.getvalue())
+        a = self.users['a']
+        self.client.force_authenticate(a)
+        url = f'/api/users/{a.id}/suggestions/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(row['user']['username'], row['mutual_count']) for row in response.data['results']], [('d', 2), ('e', 1)])
+
+        # Following a suggestion hides it before the next build
+        Follow.objects.create(follower=a, following=self.users['d'])
+        with self.assertNumQueries(3):  # Throttle, stored row, users
+            response = self.client.get(url)
+        self.assertEqual([row['user']['username'] for row in response.data['results']], ['e'])
+        self.assertEqual(self.client.get(f"/api/users/{self.users['b'].id}/suggestions/").status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(self.users['f'])
+        self.assertEqual(self.client.get(f"/api/users/{self.users['f'].id}/suggestions/").data['results'], [])
+
+
+# Tests for the shared token bucket throttle
+class ThrottleTestCase(APITestCase):
+    rates = {'user': '1000/day', 'anon': '3/min'}
+
+    # Test case for a bucket allowing its capacity, then refilling at the rate
+    def test_bucket_refills_at_rate(self):
+        now = 1000.0
+        self.assertEqual([throttling.take('k', 3, 0.5, now) for _ in range(4)], [True, True, True, False])
+        self.assertAlmostEqual(throttling.wait('k', 3, 0.5, now), 2.0)
+        self.assertFalse(throttling.take('k', 3, 0.5, now + 1.9))
+        self.assertTrue(throttling.take('k', 3, 0.5, now + 2))
+        # A long idle bucket is full again but never above capacity
+        self.assertEqual([throttling.take('k', 3, 0.5, now + 1000) for _ in range(4)], [True, True, True, False])
+        self.assertEqual(throttling.wait('other', 3, 0.5, now), 0.0)
+
+    # Test case for idle buckets being culled
+    def test_cull_drops_idle_buckets(self):
+        throttling.take('old', 3, 0.5, 1000.0)
+        throttling.take('new', 3, 0.5, 1000.0 + throttling.MAX_AGE)
+        self.assertEqual(throttling.cull(1001.0 + throttling.MAX_AGE), 1)
+        self.assertEqual(list(ThrottleBucket.objects.values_list('key', flat=True)), ['new'])
+
+    # Test case for the API answering 429 with Retry-After once the anon rate is spent
+    def test_api_returns_429(self):
+        with mock.patch('rest_framework.throttling.SimpleRateThrottle.THROTTLE_RATES', self.rates):
+            codes = [self.client.get('/api/posts/').status_code for _ in range(4)]
+            self.assertEqual(codes, [200, 200, 200, 429])
+            response = self.client.get('/api/posts/')
+            self.assertGreaterEqual(int(response['Retry-After']), 19)
+            # Authenticated users have their own bucket
+            user = User.objects.create_user(username='user1', password='pass1234')
+            self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+            self.assertEqual(self.client.get('/api/posts/').status_code, status.HTTP_200_OK)
+        self.assertEqual(ThrottleBucket.objects.filter(key__startswith='throttle_anon_').count(), 1)
+
+
+# Tests for the cached session engine, which settings select with a shared cache
+@override_settings(SESSION_ENGINE='core.sessions')
+class SessionTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='pass1234')
+
+    # Test case for a page view reading the session without touching the session table
+    def test_page_view_reads_session_from_cache(self):
+        self.client.post('/login/', {'username': 'user1', 'password': 'pass1234'})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/feed/').status_code, 200)
+        self.assertFalse([q['sql'] for q in queries if 'django_session' in q['sql']])
+
+        # A cold cache falls back to the row and refills the cache
+        cache.clear()
+        self.assertEqual(self.client.get('/feed/').status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/feed/')
+        self.assertFalse([q['sql'] for q in queries if 'django_session' in q['sql']])
+
+    # Test case for unchanged values not marking the session modified
+    def test_same_value_is_not_a_change(self):
+        store = sessions.SessionStore()
+        store['access_token'] = 'a'
+        store.save()
+        store = sessions.SessionStore(store.session_key)
+        store['access_token'] = 'a'
+        self.assertFalse(store.modified)
+        store['access_token'] = 'b'
+        self.assertTrue(store.modified)
+
+    # Test case for a value changed in place and assigned back being saved
+    def test_value_changed_in_place_is_saved(self):
+        store = sessions.SessionStore()
+        store['cart'] = [1]
+        store.save()
+        store = sessions.SessionStore(store.session_key)
+        cart = store['cart']
+        cart.append(2)
+        store['cart'] = cart
+        self.assertTrue(store.modified)
+        store.save()
+        cache.clear()
+        self.assertEqual(sessions.SessionStore(store.session_key)['cart'], [1, 2])
+
+    # Test case for expired sessions being deleted in batches
+    def test_clear_expired_in_batches(self):
+        for i in range(5):
+            store = sessions.SessionStore()
+            store['n'] = i
+            store.set_expiry(-1 if i < 4 else 3600)
+            store.save()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sessions.SessionStore.clear_expired(batch_size=2), 4)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('DELETE')]), 2)
+        self.assertEqual(Session.objects.count(), 1)
+
+
+# Tests for stateless JWT authentication and the JTI denylist
+class StatelessAuthTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='pass1234')
+        self.post = Post.objects.create(uploader=self.user, caption='Post')
+        self.refresh = authentication.RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.refresh.access_token}")
+        denylist.denylist.refresh(force=True)
+        patcher = mock.patch.object(authentication, 'STATELESS', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def user_queries(self, method, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url)
+        return response, [q['sql'] for q in queries if 'FROM "auth_user"' in q['sql']]
+
+    # Test case for tokens carrying the user claims
+    def test_token_endpoint_issues_claims(self):
+        response = self.client.post('/api/token/', {'username': 'user1', 'password': 'pass1234'})
+        access = AccessToken(response.data['access'])
+        self.assertEqual((access['username'], access['is_active'], access['profile_id']),
+                         ('user1', True, self.user.profile.id))
+        self.assertEqual(access['rjti'], RefreshToken(response.data['refresh'])['jti'])
+
+    # Test case for reads authenticating without loading the user and writes loading it
+    def test_reads_skip_the_user_query(self):
+        response, queries = self.user_queries('get', '/api/posts/timeline/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(queries, [])
+        self.assertEqual(response.data['results'][0]['id'], self.post.id)
+
+        response, queries = self.user_queries('post', f'/api/posts/{self.post.id}/like/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(queries)
+
+        # Tokens without the claims still authenticate through the database
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+        response, queries = self.user_queries('get', '/api/posts/timeline/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(queries)
+
+    # Test case for reads loading the user unless stateless mode is turned on
+    def test_stateless_mode_is_opt_in(self):
+        self.assertFalse(settings.JWT_STATELESS_AUTH)
+        with mock.patch.object(authentication, 'STATELESS', False):
+            response, queries = self.user_queries('get', '/api/posts/timeline/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(queries)
+            # A deactivated user is refused at once, whatever the token says
+            User.objects.filter(pk=self.user.pk).update(is_active=False)
+            self.assertEqual(self.client.get('/api/posts/timeline/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # Test case for an inactive claim being refused
+    def test_inactive_claim_is_refused(self):
+        access = self.refresh.access_token
+        access['is_active'] = False
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        self.assertEqual(self.client.get('/api/posts/timeline/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # Test case for a blacklisted refresh token revoking its access tokens
+    def test_blacklisted_refresh_token_revokes_access(self):
+        self.assertEqual(self.client.get('/api/posts/timeline/').status_code, status.HTTP_200_OK)
+        self.refresh.blacklist()
+        denylist.denylist.refresh(force=True)
+        self.assertEqual(self.client.get('/api/posts/timeline/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # Test case for the denylist picking up new rows and answering without queries
+    def test_denylist_refresh_and_lookup(self):
+        deny = denylist.Denylist(refresh_interval=3600)
+        deny.refresh()
+        self.assertNotIn(self.refresh['jti'], deny)
+        self.refresh.blacklist()
+        self.assertNotIn(self.refresh['jti'], deny)  # Not refreshed yet
+        deny.refreshed = 0  # Refresh interval is over, the next lookup pulls the new row
+        with self.assertNumQueries(1):
+            self.assertIn(self.refresh['jti'], deny)
+        with self.assertNumQueries(0):
+            self.assertNotIn('other', deny)
+
+        # Past the exact limit a filter hit is confirmed in the database
+        deny = denylist.Denylist(exact_limit=0)
+        deny.refresh()
+        self.assertIsNone(deny.exact)
+        with self.assertNumQueries(1):
+            self.assertIn(self.refresh['jti'], deny)
+
+    # Test case for a rebuild keeping a refresh token whose access tokens may still be valid
+    def test_rebuild_keeps_jti_for_access_lifetime(self):
+        self.refresh.blacklist()
+        outstanding = OutstandingToken.objects.get(jti=self.refresh['jti'])
+        lifetime = api_settings.ACCESS_TOKEN_LIFETIME
+        for expired_ago, kept in ((lifetime / 2, True), (lifetime * 2, False)):
+            outstanding.expires_at = timezone.now() - expired_ago
+            outstanding.save()
+            deny = denylist.Denylist()
+            deny.refresh(force=True)
+            self.assertEqual(self.refresh['jti'] in deny, kept)
+
+    # Test case for the Bloom filter having no false negatives and few false positives
+    def test_bloom_filter(self):
+        bloom = denylist.BloomFilter(1000)
+        for i in range(1000):
+            bloom.add(f'in{i}')
+        self.assertTrue(all(f'in{i}' in bloom for i in range(1000)))
+        false_positives = sum(f'out{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 50)
+
+
+# Tests for the purge of expired tokens and sessions
+class PurgeTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='pass1234')
+        now = timezone.now()
+        for i in range(5):
+            token = OutstandingToken.objects.create(user=self.user, jti=f'old{i}', token='',
+                                                    expires_at=now - timedelta(hours=1))
+            if i % 2:
+                BlacklistedToken.objects.create(token=token)
+        OutstandingToken.objects.create(user=self.user, jti='live', token='', expires_at=now + timedelta(hours=1))
+        for expiry in (-1, -1, 3600):
+            store = sessions.SessionStore()
+            store.set_expiry(expiry)
+            store.save()
+
+    # Test case for a dry run counting without deleting
+    def test_dry_run_counts_only(self):
+        out = io.StringIO()
+        call_command('purge_expired', '--dry-run', '--chunk-size', '2', '--pause', '0', stdout=out)
+        self.assertIn('tokens: 5 expired in 3 chunks', out.getvalue())
+        self.assertIn('sessions: 2 expired in 1 chunks', out.getvalue())
+        self.assertEqual(OutstandingToken.objects.count(), 6)
+
+    # Test case for expired rows being deleted chunk by chunk, blacklist rows with their tokens
+    def test_purge_deletes_expired_rows_in_chunks(self):
+        seen = []
+        results = purge.purge(chunk_size=2, pause=0, progress=lambda *args: seen.append(args[:3]))
+        self.assertEqual(results['tokens']['rows'], 5)
+        self.assertEqual(seen[:3], [('tokens', 2, 1), ('tokens', 4, 2), ('tokens', 5, 3)])
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), ['live'])
+        self.assertEqual(BlacklistedToken.objects.count(), 0)
+        self.assertEqual(Session.objects.count(), 1)
+
+    # Test case for the scheduled job queuing itself once
+    def test_scheduled_job_requeues_itself(self):
+        self.assertIsNotNone(purge.schedule())
+        self.assertIsNone(purge.schedule())
+        job = Job.objects.get()
+        self.assertGreater(job.run_at, timezone.now())
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.assertEqual(tasks.Worker(['default']).run_once(), 1)
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+        self.assertEqual(Job.objects.filter(name=purge.scheduled_purge.task_name, state=Job.QUEUED).count(), 1)
+
+    # Test case for a failing run being retried as itself, without queuing another run
+    def test_failed_scheduled_job_does_not_fork(self):
+        job = purge.schedule()
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with mock.patch.object(purge, 'purge', side_effect=RuntimeError('boom')), self.assertLogs('core.tasks', 'WARNING'):
+            tasks.Worker(['default']).run_once()
+        self.assertEqual(list(Job.objects.values_list('pk', 'state', 'attempts')), [(job.pk, Job.QUEUED, 1)])
+
+
+# Tests for the primary/replica routing, a second SQLite file stands in for the replica
+class ReplicaRoutingTestCase(TransactionTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Added here rather than in settings so the other tests and the runner never see it
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        connections.settings['replica'] = dict(connections['default'].settings_dict,
+                                               NAME=os.path.join(cls.replica_dir.name, 'replica.sqlite3'))
+        call_command('migrate', database='replica', verbosity=0)
+        cls.databases = {'default', 'replica'}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        del cls.databases
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        cls.replica_dir.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(replicas, 'REPLICAS', ['replica'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Rows only one of the two databases has tell which one served a read
+        User.objects.create_user(username='on-primary', password='pass1234')
+        User.objects.using('replica').bulk_create([User(username='on-replica')])
+
+    def usernames(self):
+        response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+        return {user['username'] for user in response.json()['results']}
+
+    # Test case for safe requests reading from the replica
+    def test_safe_requests_read_from_replica(self):
+        self.assertEqual(self.usernames(), {'on-replica'})
+        self.assertNotIn(replicas.PIN_COOKIE, self.client.cookies)
+
+    # Test case for reads right after a write staying on the primary until the window ends
+    def test_reads_after_write_use_primary(self):
+        response = self.client.post('/api/token/', {'username': 'on-primary', 'password': 'pass1234'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+        cache.clear()
+        self.assertEqual(self.usernames(), {'on-primary'})
+
+        self.client.cookies[replicas.PIN_COOKIE] = '0'  # Window over
+        cache.clear()
+        self.assertEqual(self.usernames(), {'on-replica'})
+
+    # Test case for response cache misses built from the primary only while a replica may lag
+    def test_cached_responses_built_from_primary_after_writes(self):
+        Post.objects.create(uploader=User.objects.get(), caption='on-primary')
+        Post.objects.using('replica').bulk_create([Post(uploader_id=User.objects.using('replica').get().pk,
+                                                        caption='on-replica')])
+        for outcome in ('MISS', 'HIT'):
+            response = self.client.get('/api/posts/')
+            self.assertEqual(response['X-Cache'], outcome)
+            self.assertEqual([post['caption'] for post in response.json()['results']], ['on-primary'])
+
+        # Once the last write is older than the replica lag, misses are read from the replica
+        with mock.patch.object(replicas, 'READ_YOUR_WRITES', 0):
+            response = self.client.get('/api/posts/', {'page_size': 10})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual([post['caption'] for post in response.json()['results']], ['on-replica'])
+
+    # Test case for code outside safe requests (commands, jobs, transactions) using the primary
+    def test_primary_outside_safe_requests(self):
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), ['on-primary'])
+        router = replicas.PrimaryReplicaRouter()
+        token = replicas._replica_reads.set(True)
+        try:
+            self.assertEqual(router.db_for_read(User), 'replica')
+            with replicas.use_primary():
+                self.assertEqual(router.db_for_read(User), 'default')
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(User), 'default')
+        finally:
+            replicas._replica_reads.reset(token)
+        self.assertEqual(router.db_for_write(User), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'core'))
+
+
+# Tests for the synthetic dataset generator
+class SeedTestCase(TestCase):
+
+    # Test case for the seeded rows and their denormalized counters agreeing
+    def test_seed_social(self):
+        out = io.StringIO()
+        call_command('seed_social', '--users', '40', '--batch-size', '50', '--prefix', 'sim', stdout=out)
+        self.assertIn('Seeded', out.getvalue())
+        self.assertEqual(User.objects.filter(username__startswith='sim').count(), 40)
+        self.assertEqual(Profile.objects.count(), 40)
+        self.assertTrue(Follow.objects.exists() and Post.objects.exists() and Like.objects.exists())
+        self.assertFalse(Follow.objects.filter(follower=F('following')).exists())
+        # The signals did not run, yet every counter is right
+        self.assertFalse(TimelineEntry.objects.exists())
+        for model, field, counted, fk, ref in counters.COUNTERS:
+            self.assertEqual(counters.repair_counter(model, field, counted, fk, ref, dry_run=True), 0, field)
+        # Timestamps are spread out and in causal order
+        self.assertGreater(Post.objects.values('created_at').distinct().count(), 1)
+        self.assertFalse(Like.objects.filter(created_at__lt=F('post__created_at')).exists())
+
+    # Test case for the same seed giving the same dataset and a used prefix being refused
+    def test_seed_is_deterministic(self):
+        seed.Seeder(users=20, prefix='a').run()
+        seed.Seeder(users=20, prefix='b').run()
+        captions = [list(Post.objects.filter(uploader__username__startswith=prefix).order_by('id')
+                         .values_list('caption', 'like_count')) for prefix in 'ab']
+        self.assertEqual(captions[0], captions[1])
+        with self.assertRaises(CommandError):
+            call_command('seed_social', '--users', '5', '--prefix', 'a', stdout=io.StringIO())
+
+
+# Tests for the request timing middleware and the metrics endpoint
+class InstrumentationTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        instrumentation.registry.clear()
+        self.user = User.objects.create_user(username='timed', password='pass1234')
+        Post.objects.create(uploader=self.user, caption='Timed post')
+
+    def timings(self, response):
+        return dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+
+    # Test case for the Server-Timing header counting every query and the rendering
+    def test_server_timing_header(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/posts/'))  # Opt-in only
+        patcher = mock.patch.object(instrumentation, 'SERVER_TIMING', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/posts/')
+        timings = self.timings(response)
+        self.assertIn(f'desc="{len(queries)}"', timings['db'])
+        self.assertIn('render', timings)
+        self.assertIn('total', timings)
+
+        self.client.force_login(self.user)
+        self.assertIn('render', self.timings(self.client.get('/feed/')))
+
+    # Test case for DEBUG=False in the environment leaving debug and Server-Timing off
+    def test_debug_false_sends_no_server_timing(self):
+        with mock.patch.dict(os.environ, {'DEBUG': 'False', 'METRICS_SERVER_TIMING': ''}):
+            values = runpy.run_path(os.path.join(settings.BASE_DIR, 'social_app', 'settings.py'))
+        self.assertIs(values['DEBUG'], False)
+        self.assertIs(values['METRICS_SERVER_TIMING'], False)
+        with mock.patch.object(instrumentation, 'SERVER_TIMING', values['METRICS_SERVER_TIMING']):
+            self.assertNotIn('Server-Timing', self.client.get('/api/posts/'))
+
+    # Test case for Cloudinary uploads being timed and sent with a timeout
+    def test_outbound_calls_are_timed(self):
+        with mock.patch('cloudinary.uploader.upload', return_value={'secure_url': 'https://res/x.jpg'}) as upload, \
+                instrumentation.track() as timings:
+            media.CloudinaryStorage().save('x.jpg', b'data')
+        self.assertEqual(timings.counts['cloudinary'], 1)
+        timeout = upload.call_args.kwargs['timeout']
+        self.assertEqual((timeout.connect_timeout, timeout.read_timeout), media.HTTP_TIMEOUT)
+
+    # Test case for timings added from several threads of one request all being counted
+    def test_timings_add_from_threads(self):
+        timings = instrumentation.Timings()
+
+        def add():
+            for _ in range(10000):
+                timings.add('db', 0.001)
+
+        threads = [threading.Thread(target=add) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(timings.counts['db'], 40000)
+        self.assertAlmostEqual(timings.seconds['db'], 40.0)
+
+    # Test case for the Prometheus endpoint, only served to allowed addresses, the token and staff
+    def test_metrics_endpoint(self):
+        self.client.get('/api/posts/')
+        self.client.get('/api/posts/')
+        # Not even to localhost by default, a reverse proxy makes every request come from there
+        self.assertEqual(self.client.get('/internal/metrics/').status_code, 404)
+        with mock.patch.object(instrumentation, 'TOKEN', 'scrape-secret'):
+            self.assertEqual(self.client.get('/internal/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+            self.assertEqual(self.client.get('/internal/metrics/', HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+        with mock.patch.object(instrumentation, 'ALLOWED_IPS', ['127.0.0.1']):
+            response = self.client.get('/internal/metrics/')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('app_requests_total{route="post-list",method="GET",status="200"} 2', body)
+        self.assertIn('app_request_duration_seconds_bucket{route="post-list",method="GET",le="+Inf"} 2', body)
+        self.assertIn('# TYPE app_request_db_queries histogram', body)
+        self.assertEqual(self.client.get('/internal/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 404)
+
+
+# Tests for the queued structured logger
+class LoggingTestCase(TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = log.QueueHandler(self.stream)
+        self.handler.addFilter(log.SamplingFilter({'sampled': 0.0}))
+        self.handler.addFilter(log.RedactingFilter())
+        self.addCleanup(self.handler.close)
+
+    def handle(self, name, level, message, *args, **extra):
+        record = logging.getLogger(name).makeRecord(name, level, __file__, 0, message, args, None, extra=extra)
+        self.handler.handle(record)
+        self.handler.flush()
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    # Test case for a record written as one JSON line with its extra fields
+    def test_json_lines(self):
+        entry = self.handle('core.views', logging.INFO, 'Post page %s', 7, post_id=7, comments=3)[0]
+        self.assertEqual((entry['level'], entry['logger'], entry['message']), ('INFO', 'core.views', 'Post page 7'))
+        self.assertEqual((entry['post_id'], entry['comments']), (7, 3))
+
+    # Test case for tokens being redacted from messages, arguments and extra fields
+    def test_tokens_are_redacted(self):
+        token = str(AccessToken.for_user(User.objects.create_user(username='logged', password='pass1234')))
+        entry = self.handle('core', logging.INFO, 'Header %s', f'Bearer {token}',
+                            session={'access_token': 'opaque', 'user': 'logged'}, note=f'jwt={token}')[0]
+        self.assertNotIn(token, json.dumps(entry))
+        self.assertEqual(entry['message'], 'Header Bearer [REDACTED]')
+        self.assertEqual(entry['session'], {'access_token': '[REDACTED]', 'user': 'logged'})
+
+    # Test case for sampling dropping records below WARNING only
+    def test_sampling(self):
+        self.handle('sampled.child', logging.INFO, 'dropped')
+        entries = self.handle('sampled', logging.WARNING, 'kept')
+        self.assertEqual([entry['message'] for entry in entries], ['kept'])
+
+    # Test case for the pages logging a summary where they used to print whole payloads
+    def test_pages_log_instead_of_print(self):
+        user = User.objects.create_user(username='viewer', password='pass1234')
+        post = Post.objects.create(uploader=user, caption='Logged post')
+        self.client.force_login(user)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), self.assertLogs('core.views', logging.DEBUG) as logs:
+            self.client.get(f'/post/{post.id}/')
+        self.assertEqual(out.getvalue(), '')
+        self.assertEqual((logs.records[0].post_id, logs.records[0].comments), (post.id, 0))
+
+    # Test case for a full queue dropping records instead of blocking
+    def test_full_queue_drops(self):
+        self.handler.close()
+        self.handler.queue = queue.Queue(1)
+        for _ in range(3):
+            self.handler.handle(logging.getLogger('core').makeRecord('core', logging.INFO, __file__, 0, 'x', (), None))
+        self.assertEqual(self.handler.dropped, 2)
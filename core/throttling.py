@@ -0,0 +1,113 @@
+import random
+import time
+from django.conf import settings
+from django.db import connection, transaction
+from rest_framework import throttling
+from .models import ThrottleBucket
+
+# DRF throttles that share their state through the database, so every worker
+# process and server enforces one limit per client. DRF's own throttles keep a
+# list of request timestamps per client in the cache: with locmem each process
+# counts on its own, and with a shared cache the read-modify-write of that list
+# races, so concurrent requests get through over the limit.
+#
+# Each client has a token bucket, one ThrottleBucket row of two floats no matter
+# the rate. A rate of N/duration holds up to N tokens and refills N per duration,
+# so a client can burst N requests and then sustain exactly N per duration.
+# Taking a token is one statement:
+#   postgresql, sqlite - INSERT ... ON CONFLICT DO UPDATE ... WHERE tokens >= 1 RETURNING,
+#                        the row is refilled and decremented atomically, no row back means throttled
+#   other              - SELECT ... FOR UPDATE and an UPDATE in a transaction
+# Rows idle longer than MAX_AGE (a full bucket, same as no row) are culled now and then.
+
+MAX_AGE = getattr(settings, 'THROTTLE_BUCKET_MAX_AGE', 86400)  # Longest DRF duration, a day
+CULL_PROBABILITY = getattr(settings, 'THROTTLE_CULL_PROBABILITY', 0.001)  # Chance a check also culls idle rows
+
+FUNCTIONS = {
+    'sqlite': ('MIN', 'MAX'),
+    'postgresql': ('LEAST', 'GREATEST'),
+}
+
+
+def table():
+    return connection.ops.quote_name(ThrottleBucket._meta.db_table)
+
+def take_sql(vendor):
+    least, greatest = FUNCTIONS[vendor]
+    name = table()
+    key = connection.ops.quote_name('key')
+    # Clocks of different hosts may disagree, a bucket never refills backwards
+    refilled = f"{least}(%(capacity)s, {name}.tokens + {greatest}(%(now)s - {name}.updated, 0) * %(rate)s)"
+    return (
+        f"INSERT INTO {name} ({key}, tokens, updated) VALUES (%(key)s, %(capacity)s - 1, %(now)s) "
+        f"ON CONFLICT ({key}) DO UPDATE SET tokens = {refilled} - 1, updated = %(now)s "
+        f"WHERE {refilled} >= 1 RETURNING tokens"
+    )
+
+
+def take(key, capacity, rate, now=None):
+    # Takes one token from key's bucket, returns False when it is empty.
+    # rate is tokens refilled per second
+    now = time.time() if now is None else now
+    if random.random() < CULL_PROBABILITY:
+        cull(now)
+    if connection.vendor in FUNCTIONS:
+        with connection.cursor() as cursor:
+            cursor.execute(take_sql(connection.vendor), {'key': key, 'capacity': capacity, 'now': now, 'rate': rate})
+            return cursor.fetchone() is not None
+    with transaction.atomic():
+        bucket = ThrottleBucket.objects.select_for_update().filter(key=key).first()
+        if bucket is None:
+            ThrottleBucket.objects.create(key=key, tokens=capacity - 1, updated=now)
+            return True
+        tokens = min(capacity, bucket.tokens + max(now - bucket.updated, 0) * rate)
+        if tokens < 1:
+            return False
+        ThrottleBucket.objects.filter(key=key).update(tokens=tokens - 1, updated=now)
+        return True
+
+def wait(key, capacity, rate, now=None):
+    # Seconds until key's bucket holds a whole token again
+    now = time.time() if now is None else now
+    bucket = ThrottleBucket.objects.filter(key=key).values_list('tokens', 'updated').first()
+    if bucket is None:
+        return 0.0
+    tokens = min(capacity, bucket[0] + max(now - bucket[1], 0) * rate)
+    return max(0.0, (1 - tokens) / rate)
+
+def cull(now=None):
+    now = time.time() if now is None else now
+    return ThrottleBucket.objects.filter(updated__lt=now - MAX_AGE).delete()[0]
+
+
+class SharedBucketMixin:
+    # Replaces SimpleRateThrottle's cached history with a shared token bucket
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        return take(self.key, self.num_requests, self.num_requests / self.duration)
+
+    def wait(self):
+        return wait(self.key, self.num_requests, self.num_requests / self.duration)
+
+
+class UserRateThrottle(SharedBucketMixin, throttling.UserRateThrottle):
+    pass
+
+class AnonRateThrottle(SharedBucketMixin, throttling.AnonRateThrottle):
+    pass
+
+class ScopedRateThrottle(SharedBucketMixin, throttling.ScopedRateThrottle):
+
+    def allow_request(self, request, view):
+        # DRF picks the rate from the view here, then hands over to the bucket
+        self.scope = getattr(view, self.scope_attr, None)
+        if not self.scope:
+            return True
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
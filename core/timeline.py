@@ -0,0 +1,118 @@
+from django.conf import settings
+from django.db.models import Q
+from .models import Profile, Post, Follow, TimelineEntry
+from . import tasks
+
+# Home timeline built with fan-out on write.
+# A new post is pushed into the TimelineEntry rows of the author and their followers.
+# Authors with more than FANOUT_LIMIT followers are not pushed, their followers pull
+# those posts at read time instead. When an author drops back under the limit their
+# recent posts are backfilled, the ones published meanwhile were never pushed.
+#
+# MAX_LENGTH is a soft cap. Pushes only trim about one timeline in TRIM_INTERVAL, so
+# between trims a timeline holds some entries past it; reads never go past MAX_LENGTH.
+
+MAX_LENGTH = getattr(settings, 'TIMELINE_MAX_LENGTH', 800)  # Entries kept per timeline, approximately
+FANOUT_LIMIT = getattr(settings, 'TIMELINE_FANOUT_LIMIT', 10000)  # Followers above this are served by pull
+TRIM_INTERVAL = getattr(settings, 'TIMELINE_TRIM_INTERVAL', 50)  # Each timeline is trimmed about once per this many pushes
+BATCH_SIZE = 1000
+
+
+def fan_out_post(post):
+    # Push a newly created post to the author and everyone following them
+    follower_ids = Follow.objects.filter(following_id=post.uploader_id).values_list('follower_id', flat=True)
+    follower_count = follower_ids.count()
+    high_fanout = follower_count > FANOUT_LIMIT
+    flipped = Profile.objects.filter(user_id=post.uploader_id).exclude(is_high_fanout=high_fanout).update(is_high_fanout=high_fanout)
+    if flipped and not high_fanout:
+        tasks.defer(backfill_followers, post.uploader_id)
+
+    recipients = [post.uploader_id]
+    if not high_fanout:
+        recipients.extend(follower_ids.iterator(chunk_size=BATCH_SIZE))
+
+    for start in range(0, len(recipients), BATCH_SIZE):
+        batch = recipients[start:start + BATCH_SIZE]
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, post_id=post.id, created_at=post.created_at) for user_id in batch],
+            ignore_conflicts=True,
+        )
+    for user_id in recipients:
+        # Spread the trimming out so each push only trims a slice of the timelines
+        if (user_id + post.id) % TRIM_INTERVAL == 0:
+            trim_timeline(user_id)
+
+
+def trim_timeline(user_id, max_length=MAX_LENGTH):
+    # Delete everything older than the newest max_length entries
+    boundary = (TimelineEntry.objects.filter(user_id=user_id)
+                .order_by('-created_at', '-post_id')
+                .values_list('created_at', 'post_id')[max_length:max_length + 1])
+    boundary = list(boundary)
+    if not boundary:
+        return 0
+    created_at, post_id = boundary[0]
+    older = TimelineEntry.objects.filter(user_id=user_id, created_at__lt=created_at)
+    same_time = TimelineEntry.objects.filter(user_id=user_id, created_at=created_at, post_id__lte=post_id)
+    return older.delete()[0] + same_time.delete()[0]
+
+
+def backfill_timeline(follower_id, following_id, limit=MAX_LENGTH):
+    # Copy the recent posts of a newly followed user into the follower's timeline
+    posts = (Post.objects.filter(uploader_id=following_id, media_state=Post.READY)
+             .order_by('-created_at', '-id')
+             .values_list('id', 'created_at')[:limit])
+    created = TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=follower_id, post_id=post_id, created_at=created_at) for post_id, created_at in posts],
+        ignore_conflicts=True,
+    )
+    trim_timeline(follower_id)
+    return len(created)
+
+
+@tasks.task()
+def backfill_followers(following_id, limit=MAX_LENGTH):
+    # Push the recent posts of an author that stopped being high fan-out to all their followers
+    posts = list(Post.objects.filter(uploader_id=following_id, media_state=Post.READY)
+                 .order_by('-created_at', '-id')
+                 .values_list('id', 'created_at')[:limit])
+    follower_ids = list(Follow.objects.filter(following_id=following_id).values_list('follower_id', flat=True))
+    for follower_id in follower_ids:
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=follower_id, post_id=post_id, created_at=created_at) for post_id, created_at in posts],
+            ignore_conflicts=True, batch_size=BATCH_SIZE,
+        )
+        trim_timeline(follower_id)
+    return len(follower_ids)
+
+
+def remove_from_timeline(follower_id, following_id):
+    # Drop the posts of an unfollowed user from the follower's timeline
+    return TimelineEntry.objects.filter(user_id=follower_id, post__uploader_id=following_id).delete()[0]
+
+
+def timeline_posts(user, limit=MAX_LENGTH, before=None):
+    # before is an optional (created_at, post id) keyset position to continue from
+    # Pushed posts come from one range read on the timeline index
+    # All conditions go in one filter() so they apply to the same entry row, and
+    # the order is on the entry's columns so the index returns it presorted
+    entry = Q(timeline_entries__user_id=user.pk)
+    if before:
+        entry &= Q(timeline_entries__created_at__lte=before[0]) & (
+            Q(timeline_entries__created_at__lt=before[0]) | Q(timeline_entries__post_id__lt=before[1]))
+    pushed = Post.objects.select_related('uploader').filter(entry)
+    posts = list(pushed.order_by('-timeline_entries__created_at', '-timeline_entries__post_id')[:limit])
+
+    # Posts from high fan-out accounts the user follows are pulled and merged in
+    pulled_ids = list(Follow.objects.filter(follower_id=user.pk, following__profile__is_high_fanout=True)
+                      .values_list('following_id', flat=True))
+    if pulled_ids:
+        seen = {post.id for post in posts}
+        pulled = Post.objects.select_related('uploader').filter(uploader_id__in=pulled_ids, media_state=Post.READY)
+        if before:
+            pulled = pulled.filter(created_at__lte=before[0]).filter(Q(created_at__lt=before[0]) | Q(id__lt=before[1]))
+        pulled = pulled.order_by('-created_at', '-id')[:limit]
+        posts.extend(post for post in pulled if post.id not in seen)
+        posts.sort(key=lambda post: (post.created_at, post.id), reverse=True)
+        posts = posts[:limit]
+    return posts
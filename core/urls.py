@@ -28,7 +28,8 @@ urlpatterns = [
     path('search/', views.search_view, name='search'),
      path('post/<int:pk>/', views.post_detail_view, name='post_detail'),
       path('post/<int:pk>/comment/', views.add_comment_view, name='add_comment'),
-      path('posts/<int:post_id>/like/', views.toggle_like_view, name='toggle_like'),
+      # Under post/ so the API router's posts/<pk>/like/ action does not shadow it
+      path('post/<int:post_id>/like/', views.toggle_like_view, name='toggle_like'),
       # JWT login/logout routes
     path('login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),  # Login
     path("token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
@@ -4,12 +4,20 @@ from django.contrib.auth.models import User
 from .models import Profile, Post, Comment, Follow, Like
 from .serializers import UserSerializer,ProfileSerializer,PostSerializer,CommentSerializer,FollowSerializer
 from .permissions import IsOwnerOrReadOnly
+from .filters import CommentFilter
+from .response_cache import CachedResponseMixin
+from . import services, search, suggestions
+from .timeline import timeline_posts
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.exceptions import NotFound, PermissionDenied
+from rest_framework import status
 from django.views.decorators.http import require_GET
-#Imports for creating views that coonsume the API
-import requests
-import json
+from asgiref.sync import sync_to_async
+import asyncio
+import logging
+#Imports for creating views that render pages
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.conf import settings
@@ -17,31 +25,49 @@ from django.contrib.auth import update_session_auth_hash
 from django.contrib import messages
 from django.db.models import Q
 from django.contrib.auth import authenticate, login, logout
-from rest_framework_simplejwt.tokens import RefreshToken
+from .authentication import RefreshToken
 from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
 from .forms import UserRegistrationForm, ProfileForm, LoginForm, PostForm
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponseNotAllowed
-from .utils import get_auth_headers
+from django.http import HttpResponseNotAllowed, Http404
+from .utils import blacklist_refresh_token
 from rest_framework.decorators import action
 
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    cursor_field = 'date_joined'  # Pages are keyed on (date_joined, id)
 
-class ProfileViewSet(viewsets.ModelViewSet):
+    # People you may know, precomputed by manage.py build_suggestions. Users only see their own
+    @action(detail=True, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def suggestions(self, request, pk=None):
+        if str(request.user.pk) != str(pk):
+            raise PermissionDenied('You can only see your own suggestions.')
+        return Response({'results': suggestions.suggestions_for(request.user.pk)})
+
+class ProfileViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     lookup_field = 'user__username' 
 
     def get_queryset(self):
-        return Profile.objects.select_related('user')
+        return services.profile_queryset()
+
+    def get_cache_namespaces(self):
+        if self.action == 'list':
+            return ['profiles']
+        if self.action == 'retrieve':
+            return [f"profile:{self.kwargs['user__username']}"]
+        return None
     
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        services.save_profile(serializer, self.request.user)
+
+    def perform_update(self, serializer):
+        services.save_profile(serializer, serializer.instance.user)
 
-class PostViewSet(viewsets.ModelViewSet):
+class PostViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Post.objects.all().order_by('-created_at')
     serializer_class = PostSerializer
     # Creates permission to allow only users to edit/delete their posts
@@ -49,115 +75,146 @@ class PostViewSet(viewsets.ModelViewSet):
     # Filters post by uploader username
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['uploader__username']
+
+    def get_queryset(self):
+        # Lists only show posts whose media is ready, the uploader can still fetch a processing post
+        if self.action == 'list':
+            return services.published_posts()
+        return services.post_queryset()
+
+    def get_cache_namespaces(self):
+        if self.action == 'list':
+            return ['posts']
+        if self.action == 'retrieve':
+            return [f"post:{self.kwargs['pk']}"]
+        return None
+
     def perform_create(self, serializer):
-        serializer.save(uploader=self.request.user)
+        services.save_post(serializer, self.request.user)
+
+    def perform_update(self, serializer):
+        services.save_post(serializer, serializer.instance.uploader)
+
+    # Home timeline of the logged in user, their posts and the posts of accounts they follow
+    @action(detail=False, methods=['get'], url_path='timeline', permission_classes=[permissions.IsAuthenticated])
+    def timeline(self, request):
+        position = self.paginator.get_position(request)
+        before = position[:2] if position else None
+        posts = timeline_posts(request.user, limit=self.paginator.page_size + 1, before=before)
+        page = self.paginator.paginate_list(posts, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    # Like and unlike are idempotent, repeating them just returns the current state
     @action(detail=True, methods=['post'], url_path='like')
     def like_post(self, request, pk=None):
-        post = self.get_object()
-        user = request.user
-
-        if post.likes.filter(user=user).exists():
-            return Response({'detail': 'You already liked this post.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        Like.objects.create(post=post, user=user)
-        return Response({'detail': 'Post liked successfully.'}, status=status.HTTP_201_CREATED)
+        return self.set_like(request, pk, True)
 
     @action(detail=True, methods=['post'], url_path='unlike')
     def unlike_post(self, request, pk=None):
-        post = self.get_object()
-        user = request.user
+        return self.set_like(request, pk, False)
 
-        like = Like.objects.filter(post=post, user=user).first()
-        if like:
-            like.delete()
-            return Response({'detail': 'Post unliked successfully.'}, status=status.HTTP_200_OK)
-        return Response({'detail': 'You have not liked this post.'}, status=status.HTTP_400_BAD_REQUEST)
+    def set_like(self, request, pk, liked):
+        try:
+            liked, like_count = services.set_like(request.user, pk, liked)
+        except (Post.DoesNotExist, ValueError):
+            raise NotFound('Post not found.')
+        return Response({'liked': liked, 'like_count': like_count}, status=status.HTTP_200_OK)
 
 
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Comment.objects.all().order_by('-created_at')
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
     # filter comments by post ID
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['post']  
+    filterset_class = CommentFilter
+
+    def get_queryset(self):
+        return services.comment_queryset()
+
+    def get_cache_namespaces(self):
+        if self.action == 'list':
+            post = self.request.query_params.get('post')
+            return [f'comments:{post}'] if post else ['comments']
+        if self.action == 'retrieve':
+            return ['comments']
+        return None
+
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        services.save_comment(serializer, self.request.user)
 
 class FollowViewSet(viewsets.ModelViewSet):
     queryset = Follow.objects.all()
     serializer_class = FollowSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    cursor_field = 'followed_at'  # Pages are keyed on (followed_at, id)
+
+    def get_queryset(self):
+        return services.follow_queryset()
 
     def perform_create(self, serializer):
         serializer.save(follower=self.request.user)
 
 
 
-# Views that consume the API
-API_BASE_URL = 'http://localhost:8000/api/' 
+# Views that render pages, they call the service layer directly instead of going over HTTP to the API
+logger = logging.getLogger(__name__)
+SEARCH_PAGE_SIZE = 10
+
+# The feed, profile and post pages are async views. Under ASGI (social_app/asgi.py)
+# a request waiting on the database does not hold a worker thread, and independent
+# fetches are awaited together. Under WSGI Django runs them through async_to_sync.
+async def arender(request, template_name, context):
+    # Templates read the session (messages) and CSRF token, which are sync only
+    return await sync_to_async(render)(request, template_name, context)
 
 # View to show the profile page
 @login_required
 
-def profile_view(request, username):
-        
-        headers = get_auth_headers(request)
+async def profile_view(request, username):
+        request.user = await request.auser()
+
         if request.method == 'POST':
-            # Handle follow action via API
-            response = requests.post(f'{API_BASE_URL}profiles/{username}/follow/', headers=headers)
-            if response.status_code != 200:
+            # Handle follow action
+            if await sync_to_async(services.toggle_follow)(request.user, username) is None:
                 messages.error(request, 'Failed to follow/unfollow user.')
             return redirect('profile', username=username)
         
-        # Get user profile
-        profile_response = requests.get(f'{API_BASE_URL}profiles/{username}/', headers=headers)
+        # Get user profile and their posts at the same time
+        profile, (posts, next_cursor) = await asyncio.gather(
+            services.aget_profile(username),
+            services.alist_posts(uploader_username=username, cursor=request.GET.get('cursor')),
+        )
      
-        if profile_response.status_code == 200:
-            profile = profile_response.json()
-            print("Profile data:", profile)
-            print("Profile picture:", profile.get("profile_picture"))  
-            # Optionally fetch user's posts
-            posts_response = requests.get(f"{API_BASE_URL}posts/?uploader__username={username}", headers=headers)
-            posts = posts_response.json().get("results", []) if posts_response.status_code == 200 else []
-
-            return render(request, 'profile.html', {
+        if profile is not None:
+            logger.debug("Profile page", extra={'username': username, 'profile_id': profile.get('id'),
+                                                'posts': len(posts)})
+            return await arender(request, 'profile.html', {
                 'profile': profile,
-                'posts': posts
+                'posts': posts,
+                'next_cursor': next_cursor,
             })
 
-        return render(request, 'profile.html', {'error': 'Profile not found'})
+        return await arender(request, 'profile.html', {'error': 'Profile not found'})
 
 # View for post details
-def post_detail_view(request, pk):
-    token = request.session.get('access_token')
-    headers = {'Authorization': f'Bearer {token}'} if token else {}
-
-    # Fetch post
-    post_response = requests.get(f"{API_BASE_URL}posts/{pk}/", headers=headers)
-    if post_response.status_code != 200:
+async def post_detail_view(request, pk):
+    request.user = await request.auser()
+    # Fetch post and comments at the same time
+    post, (comments, next_cursor) = await asyncio.gather(
+        services.aget_post(pk),
+        services.alist_comments(pk, cursor=request.GET.get('cursor')),
+    )
+    if post is None:
         messages.error(request, "Post not found or failed to load.")
         return redirect("feed")  # redirect to feed or 404 page
 
-    post = post_response.json()
+    logger.debug("Post page", extra={'post_id': pk, 'comments': len(comments)})
 
-    # Fetch comments
-    try:
-        response = requests.get(f"{API_BASE_URL}comments/?post={pk}", headers=headers)
-        if response.status_code == 200:
-            comment_data = response.json()
-            comments = comment_data.get("results", [])
-            print('COMMENTS FOR DEBUDDING', comments)
-        else:
-            comments = []
-            messages.error(request, "Failed to fetch comments.")
-    except requests.RequestException:
-        comments = []
-        messages.error(request, "Network error while fetching comments.")
-
-    return render(request, "post_detail.html", {
+    return await arender(request, "post_detail.html", {
         "post": post,
-        "comments": comments
+        "comments": comments,
+        "next_cursor": next_cursor,
     })
 
 
@@ -165,26 +222,13 @@ def post_detail_view(request, pk):
 @login_required
 def add_comment_view(request, pk):
     if request.method == "POST":
-        token = request.session.get('access_token')
-        headers = {
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json',
-        }
-
         comment_content = request.POST.get("content")
-        payload = {'content': comment_content,
-                    'post': pk}
-
-        url = f"{API_BASE_URL}comments/"  # Make sure this matches your API URL
-        response = requests.post(url, json=payload, headers=headers)
-
-        # Print the status code and response for debugging
-        print("STATUS:", response.status_code)
-        print("RESPONSE:", response.text)
+        serializer = services.create_comment(request.user, pk, comment_content)
 
-        if response.status_code == 201:
+        if not serializer.errors:
             return redirect("post_detail", pk=pk)
         else:
+            logger.info("Comment rejected", extra={'post_id': pk, 'errors': serializer.errors})
             messages.error(request, "Failed to post comment.")
 
     return redirect("post_detail", pk=pk)
@@ -192,61 +236,29 @@ def add_comment_view(request, pk):
 # View for editing profile
 @login_required
 def edit_profile_view(request):
-    headers = get_auth_headers(request)  # Handles token refresh or redirect
-
-    if request.method == 'POST':
-        bio = request.POST.get('bio')
-        profile_image = request.FILES.get('profile_image')
-
-        data = {'bio': bio}
-        files = {'profile_image': profile_image} if profile_image else {}
-
-        response = requests.put(
-            f'{API_BASE_URL}profiles/{request.user.username}/',
-            data=data,
-            files=files,
-            headers=headers
-        )
-
-        if response.status_code in [200, 204]:
-            messages.success(request, 'Profile updated successfully.')
-            return redirect('profile', username=request.user.username)
-        else:
-            messages.error(request, 'Failed to update profile.')
-
-    # GET request to show current data in form
-    response = requests.get(f'{API_BASE_URL}profiles/{request.user.username}/', headers=headers)
-
-    if response.status_code == 200:
-        profile = response.json()
-    else:
+    profile = services.get_profile(request.user.username)
+    if profile is None:
         messages.error(request, 'Failed to load profile.')
 
     if request.method == 'POST':
         form = ProfileForm(request.POST, request.FILES)
         if form.is_valid():
-            bio = form.cleaned_data.get('bio')
-            profile_image = form.cleaned_data.get('profile_image')
-
-            data = {'bio': bio}
-            files = {'profile_image': profile_image} if profile_image else {}
+            data = {'bio': form.cleaned_data.get('bio')}
+            profile_image = form.cleaned_data.get('profile_picture')
+            if profile_image:
+                data['profile_picture'] = profile_image
 
-            update_response = requests.put(
-                f'{API_BASE_URL}profiles/{request.user.username}/',
-                data=data,
-                files=files,
-                headers=headers
-            )
+            serializer = services.update_profile(request.user, data)
 
-            if update_response.status_code in [200, 204]:
+            if not serializer.errors:
                 messages.success(request, 'Profile updated successfully.')
                 return redirect('profile', username=request.user.username)
             else:
                 messages.error(request, 'Failed to update profile.')
     else:
-        # Pre-fill the form using API response
+        # Pre-fill the form using the profile data
         form = ProfileForm(initial={
-            'bio': profile.get('bio', '')
+            'bio': (profile or {}).get('bio', '')
         })
 
     return render(request, 'edit_profile.html', {
@@ -276,34 +288,38 @@ def change_password_view(request):
     return render(request, 'change_password.html')
 
 
-# View for searching users
+# View for searching users and posts
 def search_view(request):
-    query = request.GET.get('q')
-    users = User.objects.filter(Q(username__icontains=query) | Q(profile__bio__icontains=query)) if query else []
-    return render(request, 'search_results.html', {'query': query, 'users': users})
+    query = request.GET.get('q', '')
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    offset = (page - 1) * SEARCH_PAGE_SIZE
+    # One extra row tells us whether there is a next page
+    users = search.search_users(query, limit=SEARCH_PAGE_SIZE + 1, offset=offset) if query else []
+    posts = search.search_posts(query, limit=SEARCH_PAGE_SIZE + 1, offset=offset) if query else []
+    has_next = len(users) > SEARCH_PAGE_SIZE or len(posts) > SEARCH_PAGE_SIZE
+    return render(request, 'search_results.html', {
+        'query': query,
+        'users': users[:SEARCH_PAGE_SIZE],
+        'posts': posts[:SEARCH_PAGE_SIZE],
+        'page': page,
+        'next_page': page + 1 if has_next else None,
+        'previous_page': page - 1 if page > 1 else None,
+    })
 
 
 
 # View for showing feed
 @login_required
-def feed_view(request):
-    token = request.session.get('access_token')  # JWT token if stored
-    headers = {'Authorization': f'Bearer {token}'} if token else {}
-
-    response = requests.get(f'{API_BASE_URL}posts/', headers=headers)
-    if response.status_code == 200:
-        data = response.json()
-        posts = data.get('results', [])  # Only pass the list of posts
-    else:
-        posts = []
-
-    return render(request, 'feed.html', {'posts': posts})
+async def feed_view(request):
+    request.user = await request.auser()
+    posts, next_cursor = await services.ahome_timeline(request.user, cursor=request.GET.get('cursor'))
+    return await arender(request, 'feed.html', {'posts': posts, 'next_cursor': next_cursor})
 # View for creating posts
 @login_required
 def create_post_view(request):
-    token = request.session.get('access_token')  # JWT token
-    headers = {'Authorization': f'Bearer {token}'} if token else {}
-
     if request.method == 'POST':
         form = PostForm(request.POST, request.FILES)
 
@@ -312,14 +328,17 @@ def create_post_view(request):
             image = form.cleaned_data.get('image')
 
             data = {'caption': caption}
-            files = {'image': image} if image else {}
+            if image:
+                data['image'] = image
 
-            response = requests.post(f'{API_BASE_URL}posts/', data=data, files=files, headers=headers)
+            serializer = services.create_post(request.user, data)
 
-            if response.status_code in [200, 201]:
+            if not serializer.errors:
+                if image:
+                    messages.info(request, 'Your post will show up in the feed once its image is processed.')
                 return redirect('feed')
             else:
-                error = response.json()
+                error = serializer.errors
                 return render(request, 'create-post.html', {'form': form, 'error': error})
 
     else:
@@ -348,7 +367,7 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login
 from django.contrib import messages
 from .forms import LoginForm
-from rest_framework_simplejwt.tokens import RefreshToken
+from .authentication import RefreshToken
 
 def login_view(request):
     if request.method == 'POST':
@@ -379,18 +398,11 @@ def login_view(request):
 
 
 # View for logout
-def blacklist_token(token):
-    try:
-        token.blacklist()
-    except Exception:
-        pass
-
 @login_required
 def logout_view(request):
     refresh_token = request.session.get('refresh_token')
     if refresh_token:
-        token = RefreshToken(refresh_token)
-        blacklist_token(token)  # blacklist refresh token
+        blacklist_refresh_token(refresh_token)
 
     logout(request)
     request.session.flush()
@@ -399,19 +411,13 @@ def logout_view(request):
 
 @login_required
 def toggle_like_view(request, post_id):
-    headers = get_auth_headers(request) 
-    print("User:", request.user)
-    print("Authenticated?", request.user.is_authenticated)
     if request.method == 'POST':
-        post = get_object_or_404(Post, id=post_id)
-        like = Like.objects.filter(user=request.user, post=post).first()
-
-        if like:
-            like.delete()
-            messages.success(request, 'Like removed.')
-        else:
-            Like.objects.create(user=request.user, post=post)
-            messages.success(request, 'Post liked.')
+        try:
+            liked, _ = services.toggle_like(request.user, post_id)
+        except Post.DoesNotExist:
+            raise Http404('Post not found')
+        logger.debug("Like toggled", extra={'user_id': request.user.pk, 'post_id': post_id, 'liked': liked})
+        messages.success(request, 'Post liked.' if liked else 'Like removed.')
     
     return redirect(request.META.get('HTTP_REFERER', '/'))
 
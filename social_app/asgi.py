@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+The feed, profile and post detail pages are async views and run natively here:
+    uvicorn social_app.asgi:application --workers 4
 """
 
 import os
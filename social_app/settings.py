@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
 import dj_database_url
 import cloudinary
@@ -46,7 +47,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.getenv('SECRET_KEY')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG =os.getenv('DEBUG')
+DEBUG = os.getenv('DEBUG', '').lower() in ('1', 'true')  # DEBUG=False or 0 must mean off
 
 ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS','*').split(',')
 
@@ -65,12 +66,15 @@ INSTALLED_APPS = [
     'rest_framework',
     'cloudinary_storage',
     'django_filters',
+    'rest_framework_simplejwt.token_blacklist',  # Refresh tokens blacklisted on logout
      'django.contrib.humanize',
   
 ]
 
 MIDDLEWARE = [
+    'core.instrumentation.RequestTimingMiddleware',  # First, so it times everything below
     'django.middleware.security.SecurityMiddleware',
+    'core.replicas.ReplicaMiddleware',  # Before anything that reads the database
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -83,7 +87,7 @@ ROOT_URLCONF = 'social_app.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.instrumentation.DjangoTemplates',  # The Django backend with timed rendering
         'DIRS': [BASE_DIR/'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -105,6 +109,49 @@ WSGI_APPLICATION = 'social_app.wsgi.application'
 DATABASES = {
     'default': dj_database_url.config(default=os.getenv('DJ_DATABASE_URL'))
 }
+# On SQLite, take the write lock when a transaction starts so concurrent writers
+# wait for each other (up to timeout seconds) instead of failing with "database is locked"
+if DATABASES['default'].get('ENGINE') == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('OPTIONS', {}).update({'transaction_mode': 'IMMEDIATE', 'timeout': 20})
+    # A file rather than memory for the test database, so threaded tests get connections of their own
+    DATABASES['default'].setdefault('TEST', {}).setdefault(
+        'NAME', os.path.join(tempfile.gettempdir(), f'social_app_test_{os.getpid()}.sqlite3'))
+# Read replicas, DJ_REPLICA_URLS is a comma separated list of database URLs.
+# Safe requests read from them, see core/replicas.py. In tests they mirror default.
+DATABASE_REPLICAS = []
+for number, url in enumerate(filter(None, os.getenv('DJ_REPLICA_URLS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = dict(dj_database_url.parse(url.strip()), TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(f'replica{number}')
+DATABASE_ROUTERS = ['core.replicas.PrimaryReplicaRouter']
+READ_YOUR_WRITES_SECONDS = 5  # A client reads from the primary for this long after a write (above the replica lag)
+
+
+# Cache, used by the API response cache.
+# CACHE_BACKEND can be locmem, file or db; use file or db when running several
+# worker processes so they share one cache.
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+}
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.getenv('CACHE_LOCATION', 'social-app'),  # directory for file, table name for db (run createcachetable)
+    }
+}
+# Worker processes serving the app, gunicorn reads the same variable
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '1'))
+# A write invalidates cached responses only in the cache it runs against, so with a
+# per-process locmem cache and several workers the others would serve stale bodies
+RESPONSE_CACHE_ENABLED = CACHE_BACKEND != 'locmem' or WEB_CONCURRENCY <= 1
+RESPONSE_CACHE_TIMEOUT = 300  # Seconds a cached API response is kept, see core/response_cache.py
+# With a shared cache, sessions are read from it and written through to the database,
+# see core/sessions.py. A locmem cache would keep serving a session in other processes
+# after logout or a password change, so then they come straight from the database.
+# Run manage.py clearsessions periodically to delete expired rows.
+SESSION_ENGINE = 'core.sessions' if CACHE_BACKEND != 'locmem' else 'django.contrib.sessions.backends.db'
 
 
 # Password validation
@@ -143,6 +190,15 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded images and their resized derivatives, see core/media.py.
+# MEDIA_STORAGE is cloudinary or local; local keeps files under MEDIA_ROOT,
+# which works offline and in tests. It defaults to cloudinary when it is configured.
+MEDIA_STORAGE = os.getenv('MEDIA_STORAGE') or ('cloudinary' if os.getenv('CLOUD_NAME') else 'local')
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', BASE_DIR / 'media')
+MEDIA_URL = '/media/'
+MEDIA_STAGING_ROOT = os.getenv('MEDIA_STAGING_ROOT')  # Where uploads wait for the media worker, defaults to MEDIA_ROOT/incoming
+MEDIA_MAX_UPLOAD_SIZE = 5 * 1024 * 1024  # Larger post images are marked failed by the worker
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -152,18 +208,23 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.JWTAuthentication',  # Reads authenticate from the token claims, see JWT_STATELESS_AUTH
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.instrumentation.JSONRenderer',  # Timed JSON rendering, see core/instrumentation.py
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetCursorPagination',  # Cursor pages keyed on (created_at, id)
     'PAGE_SIZE': 10,
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.UserRateThrottle',   # Throttle authenticated users
-        'rest_framework.throttling.AnonRateThrottle',   # Throttle anonymous users
+        'core.throttling.UserRateThrottle',   # Throttle authenticated users, shared by all processes
+        'core.throttling.AnonRateThrottle',   # Throttle anonymous users, shared by all processes
     ],
+    # THROTTLE_USER_RATE and THROTTLE_ANON_RATE override them, the load tests raise them
     'DEFAULT_THROTTLE_RATES': {
-        'user': '1000/day',   # Allow 1000 requests per authenticated user per day
-        'anon': '100/day',    # Allow 100 requests per anonymous user per day
+        'user': os.getenv('THROTTLE_USER_RATE', '1000/day'),   # Allow 1000 requests per authenticated user per day
+        'anon': os.getenv('THROTTLE_ANON_RATE', '100/day'),    # Allow 100 requests per anonymous user per day
     },
 }
 # Used to control how long tje JWT tokens stay valid and how the will be used
@@ -171,8 +232,75 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),# token expires after 60 minutes
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),# How long the refreshed token stays valid
     'AUTH_HEADER_TYPES': ('Bearer',),
+    # Issue tokens carrying the user claims used by core.authentication
+    'TOKEN_OBTAIN_SERIALIZER': 'core.authentication.TokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'core.authentication.TokenRefreshSerializer',
+}
+# Opt-in: safe API requests build request.user from the token claims instead of loading
+# the User row. A deactivated user then keeps read access until the access token expires
+JWT_STATELESS_AUTH = os.getenv('JWT_STATELESS_AUTH', '').lower() == 'true'
+# Revoked tokens are kept in memory in every process, see core/denylist.py
+JWT_DENYLIST_REFRESH_INTERVAL = 30  # Seconds until a blacklisted token is refused by every process
+JWT_DENYLIST_REBUILD_INTERVAL = 3600
+# Request timing, see core/instrumentation.py. Prometheus histograms per route at
+# /internal/metrics/ for staff users, requests with METRICS_TOKEN as a bearer token and
+# METRICS_ALLOWED_IPS (empty by default: behind a local proxy every request comes from
+# 127.0.0.1). Server-Timing headers show SQL counts and times, so only with DEBUG or opt-in.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() != 'false'
+METRICS_SERVER_TIMING = DEBUG or os.getenv('METRICS_SERVER_TIMING', '').lower() == 'true'
+METRICS_ALLOWED_IPS = list(filter(None, os.getenv('METRICS_ALLOWED_IPS', '').split(',')))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# (connect, read) timeout in seconds for outbound HTTP calls (Cloudinary uploads, see core/media.py)
+OUTBOUND_HTTP_TIMEOUT = (3.05, 10)
+
+# Home timeline settings, see core/timeline.py
+TIMELINE_MAX_LENGTH = 800  # Entries kept per timeline
+TIMELINE_FANOUT_LIMIT = 10000  # Authors with more followers are pulled at read time instead of pushed
+TIMELINE_TRIM_INTERVAL = 50  # Each timeline is trimmed about once per this many pushes
+# Follow suggestions, see core/suggestions.py. Rebuild them periodically (e.g. nightly cron)
+# with manage.py build_suggestions
+SUGGESTIONS_TOP_K = 20  # Suggestions stored per user
+SUGGESTIONS_MAX_DEGREE = 1000  # Follows of one account looked at per hop, bounds the work for huge accounts
+# Background job queue, see core/tasks.py. Run workers with manage.py runworker.
+# concurrency caps the jobs of a queue running at once across all workers
+JOB_QUEUES = {
+    'default': {},
+    'media': {'concurrency': 4},  # Image processing is CPU and memory heavy
+}
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BACKOFF = 5  # Seconds before the first retry, doubled for each attempt
+JOB_RETRY_BACKOFF_MAX = 600
+JOB_TIMEOUT = 600  # Running jobs older than this are assumed lost and queued again
+# Purge of expired JWTs and sessions, see core/purge.py. Start the hourly job once
+# with manage.py purge_expired --schedule
+PURGE_CHUNK_SIZE = 1000  # Rows deleted per transaction
+PURGE_PAUSE = 0.05  # Seconds between chunks, lets live writers in
+PURGE_INTERVAL = 3600
+# Full-text search backend, see core/search.py. None follows the database vendor
+# (FTS5 on SQLite, tsvector/GIN on PostgreSQL), 'basic' forces the unindexed fallback
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND') or None
+
+# Logging, JSON lines on stderr written by a background thread, see core/log.py.
+# LOG_SAMPLING keeps this fraction of a logger's records below WARNING.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_SAMPLING = {
+    'core.views': 0.1,  # Per-request debugging, one in ten is enough to follow a problem
+}
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sample': {'()': 'core.log.SamplingFilter', 'rates': LOG_SAMPLING},
+        'redact': {'()': 'core.log.RedactingFilter'},
+    },
+    'handlers': {
+        'queue': {'class': 'core.log.QueueHandler', 'filters': ['sample', 'redact']},
+    },
+    'loggers': {
+        'core': {'handlers': ['queue'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+    'root': {'handlers': ['queue'], 'level': 'WARNING'},
 }
-
 
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'feed' 
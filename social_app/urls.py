@@ -14,15 +14,21 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from core.views import feed_view
+from core.instrumentation import metrics_view
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('internal/metrics/', metrics_view, name='metrics'),  # Prometheus scrape, see core/instrumentation.py
     path('api/', include('core.urls')),
     path('', feed_view, name='feed'),  
     path('', include('core.urls')),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),# Login(beginning token) endpoint
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),# refresh token endpoint
 ]
+# Locally stored media, only served by Django itself while DEBUG is on
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)